@@ -5,26 +5,76 @@ Este módulo contiene toda la lógica de validación integrada directamente.
 No depende de archivos externos.
 """
 
-from flask import Flask, request, jsonify, send_file
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import os
+import cProfile
+import csv
+import gc
+import gzip
+import hashlib
+import importlib
+import itertools
+import json
+import mmap
+import queue
+import shutil
+import sys
 import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime
-import pandas as pd
-import numpy as np
 import warnings
 
+# pandas y numpy se importan en cada función que los usa, como openpyxl o
+# pyarrow: importar el módulo o responder /api/health no los carga. Con
+# crear_app(precargar=True) se cargan una sola vez en el proceso maestro.
+
 warnings.filterwarnings('ignore')
 
-app = Flask(__name__)
-CORS(app)
+# Las rutas se registran en este blueprint; crear_app arma cada aplicación
+rutas = Blueprint('validador', __name__)
 
-# Configuración
-UPLOAD_FOLDER = tempfile.mkdtemp()
-ALLOWED_EXTENSIONS = {'xlsx', 'xls'}
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max
+# Configuración (valores por defecto de current_app.config en crear_app)
+UPLOAD_FOLDER = os.path.join(tempfile.gettempdir(), 'validador_calidad_aire')  # se crea al usarse
+ALLOWED_EXTENSIONS = {'xlsx', 'xls', 'csv', 'parquet', 'arrow', 'feather'}
+CONFIGURACION_POR_DEFECTO = {
+    'UPLOAD_FOLDER': UPLOAD_FOLDER,
+    'MAX_CONTENT_LENGTH': 50 * 1024 * 1024,  # 50MB max
+    'STORAGE_MAX_BYTES': 2 * 1024 * 1024 * 1024,  # archivos subidos y validados en UPLOAD_FOLDER
+    'STORAGE_TTL_SECONDS': 24 * 3600,  # se borran los archivos sin usar por más tiempo
+    'VALIDATION_WORKERS': 2,  # validaciones simultáneas; el resto espera en cola
+    'JOB_TTL_SECONDS': 3600,  # tiempo que se conserva un trabajo terminado
+    'VALIDATION_PROCESSES': 1,  # >1: validar estaciones en paralelo en un pool de procesos
+    'BATCH_PARSE_PROCESSES': min(4, os.cpu_count() or 1),  # archivos de un lote leídos en paralelo (1 = en serie)
+    'BATCH_MAX_FILES': 36,
+    'INCREMENTAL_HISTORY_ROWS': 24 * 62,  # horas por estación que conserva /api/validate/append en memoria
+    'RESULT_CACHE_FOLDER': os.path.join(UPLOAD_FOLDER, 'cache'),
+    'RESULT_CACHE_MAX_BYTES': 500 * 1024 * 1024,  # al superarlo se expulsan las entradas menos usadas
+    'RESULTS_IN_MEMORY': 8,  # resultados validados que se mantienen cargados para paginar
+    'RESULTS_PAGE_SIZE': 50,  # filas por página por defecto (y de data_preview)
+    'RESULTS_MAX_PAGE_SIZE': 5000,
+    'SERIES_DEFAULT_POINTS': 1000,  # puntos por serie en /api/results/<id>/series
+    'SERIES_MAX_POINTS': 5000,
+    'STREAM_CHUNK_ROWS': 1000,  # filas por mensaje en /api/validate/stream
+    'STREAM_QUEUE_MESSAGES': 16,  # mensajes de un flujo en espera del cliente antes de frenar la validación
+    'COMPRESS_MIN_BYTES': 1024,  # las respuestas más chicas se envían sin comprimir
+    'COMPRESS_LEVEL': 5,  # nivel de gzip (1-9) y de brotli (0-11)
+    'EXPORT_EAGER_FORMATS': (),  # formatos que se generan al validar; el resto, en la primera descarga
+    'CONVERTED_CACHE_ENABLED': True,  # guardar la tabla convertida de cada archivo en Arrow IPC (requiere pyarrow)
+    'HISTORY_FOLDER': os.path.join(UPLOAD_FOLDER, 'historial'),
+    'HISTORY_ENABLED': False,  # guardar cada validación en el almacén histórico (requiere pyarrow)
+    'METRICS_TRACE_MEMORY': False,  # memoria pico por etapa con tracemalloc (más lento; las mediciones no se solapan entre hilos)
+    'PROFILE_REQUESTS': False,  # guardar un perfil cProfile (.prof) por validación
+    'PROFILE_FOLDER': os.path.join(UPLOAD_FOLDER, 'perfiles'),
+}
 
 
 # ============================================================================
@@ -90,6 +140,31 @@ RANGOS = {
     'UVI': {'min': 0, 'max': 300}
 }
 
+# Temperatura interna de cabina: fuera de [min, max] se invalidan (IO) los contaminantes
+TEMPERATURA_INTERNA = {
+    'parametro': 'IT',
+    'min': 20,
+    'max': 30,
+    'contaminantes': ['O3', 'NOX', 'NO', 'NO2', 'PM10', 'PM2.5', 'SO2', 'CO']
+}
+
+# Valores constantes: rachas de más de HORAS_CONSTANTES horas se marcan DS
+PARAMETROS_CONSTANTES = ['CO', 'NOX', 'NO2', 'NO', 'O3', 'PM10', 'PM2.5']
+HORAS_CONSTANTES = 3
+
+# Relaciones entre parámetros: suma(numerador) / denominador fuera de [min, max]
+# invalida (IO) todos los parámetros de la relación (min None = sin límite inferior)
+RELACIONES = [
+    {'nombre': 'relacion_nox', 'numerador': ['NO', 'NO2'], 'denominador': 'NOX', 'min': 0.85, 'max': 1.15},
+    {'nombre': 'relacion_pm', 'numerador': ['PM2.5'], 'denominador': 'PM10', 'min': None, 'max': 1.15},
+]
+
+# Promedios regulatorios (solo con valores numéricos válidos): ventana móvil
+# en horas por parámetro y fracción mínima de horas válidas para que un
+# promedio (diario o móvil) cuente
+PROMEDIOS_MOVILES = {'O3': 8, 'CO': 8, 'PM10': 24, 'PM2.5': 24}
+COMPLETITUD_MINIMA = 0.75
+
 # Banderas de validación
 BANDERAS = {
     'IF': 'Inválido por falla en el equipo',
@@ -120,13 +195,490 @@ COLUMNAS_BD = [
     'PM10', 'PM2.5', 'IT', 'ET', 'RH', 'WS', 'WD', 'PP', 'ATM', 'RS', 'UVI'
 ]
 
+# Lectura de archivos ENVISTA por bloques
+FILAS_POR_BLOQUE_ENVISTA = 2000
+
+# Textos que pd.read_excel interpreta como celda vacía (más errores de Excel)
+VALORES_NA_ENVISTA = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND',
+    '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+    '#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!'
+}
+
+
+# ============================================================================
+# TABLAS DE BÚSQUEDA PRECOMPILADAS
+# ============================================================================
+# Lo que la conversión y la validación derivan de la configuración (índices de
+# estaciones y parámetros, reglas, decimales) se compila una sola vez. Con
+# crear_app(precargar=True) esto ocurre en el proceso maestro del servidor
+# WSGI y los workers lo heredan al hacer fork, sin copiarlo.
+
+tablas_compiladas = None
+
+
+def compilar_tablas():
+    """Tablas de búsqueda derivadas de la configuración
+
+    Se recompilan si cambió alguno de los mapeos, RANGOS, DECIMALES o las
+    reglas de series. Claves: 'estaciones' (nombre ENVISTA -> índice),
+    'codigos_estacion' (abreviaturas por índice), 'parametros' (nombre
+    ENVISTA o BD -> índice en COLUMNAS_BD[3:]), 'decimales' y 'reglas'.
+    """
+    import numpy as np
+    
+    global tablas_compiladas
+    huella = json.dumps([MAPEO_ESTACIONES, MAPEO_PARAMETROS, COLUMNAS_BD, DECIMALES, RANGOS,
+                         TEMPERATURA_INTERNA, PARAMETROS_CONSTANTES, HORAS_CONSTANTES, RELACIONES],
+                        sort_keys=True)
+    compiladas = tablas_compiladas
+    if compiladas is not None and compiladas['huella'] == huella:
+        return compiladas
+    
+    parametros_bd = COLUMNAS_BD[3:]
+    indice_bd = {param: j for j, param in enumerate(parametros_bd)}
+    parametros = dict(indice_bd)
+    for parametro_envista, parametro_base in MAPEO_PARAMETROS.items():
+        if parametro_base in indice_bd:
+            parametros[parametro_envista] = indice_bd[parametro_base]
+        else:
+            parametros.pop(parametro_envista, None)
+    
+    compiladas = {
+        'huella': huella,
+        'estaciones': {nombre: i for i, nombre in enumerate(MAPEO_ESTACIONES)},
+        'codigos_estacion': np.array(list(MAPEO_ESTACIONES.values()), dtype=object),
+        'parametros': parametros,
+        'decimales': tuple(DECIMALES.items()),
+        'reglas': compilar_reglas(RANGOS, TEMPERATURA_INTERNA, PARAMETROS_CONSTANTES,
+                                  HORAS_CONSTANTES, RELACIONES),
+    }
+    tablas_compiladas = compiladas
+    return compiladas
+
+
+# ============================================================================
+# REPRESENTACIÓN COLUMNAR (valor float64 + código de bandera uint8)
+# ============================================================================
+
+# Código 0 = sin bandera; 1..n siguen el orden de BANDERAS
+CODIGOS_BANDERA = {bandera: codigo for codigo, bandera in enumerate(BANDERAS, start=1)}
+BANDERA_POR_CODIGO = (None,) + tuple(BANDERAS)  # con np.array(..., dtype=object) se traduce un arreglo de códigos
+
+
+class TablaBD:
+    """Datos en formato BD con cada parámetro como valor float64 + bandera uint8
+
+    Una celda con bandera tiene valor NaN; una celda sin bandera y con valor
+    NaN es un dato vacío. Solo se convierte a la mezcla de números y textos
+    de BD_2024 al exportar o serializar a JSON (ver a_formato_base).
+
+    Las tablas validadas llevan además `origenes`: por parámetro, una máscara
+    uint16 con un bit por cada regla de REGLAS_ORIGEN que se cumplió en la
+    celda (la bandera solo guarda la última). Es None antes de validar.
+    """
+
+    def __init__(self, claves, valores, banderas, origenes=None):
+        self.claves = claves.reset_index(drop=True)
+        self.valores = valores
+        self.banderas = banderas
+        self.origenes = origenes
+
+    @classmethod
+    def vacia(cls):
+        """Tabla sin filas con todas las columnas BD"""
+        import numpy as np
+        import pandas as pd
+
+        parametros = COLUMNAS_BD[3:]
+        return cls(
+            pd.DataFrame({'STATION': pd.Series(dtype=object), 'DATE': pd.Series(dtype=object),
+                          'HOUR': pd.Series(dtype=np.int64)}),
+            {p: np.empty(0) for p in parametros},
+            {p: np.empty(0, dtype=np.uint8) for p in parametros}
+        )
+
+    @classmethod
+    def concatenar(cls, tablas):
+        """Unir varias tablas con los mismos parámetros, conservando el orden"""
+        import numpy as np
+        import pandas as pd
+
+        tablas = [t for t in tablas if len(t) > 0]
+        if not tablas:
+            return cls.vacia()
+        if len(tablas) == 1:
+            return tablas[0]
+
+        parametros = tablas[0].parametros
+        origenes = None
+        if all(t.origenes is not None for t in tablas):
+            origenes = {p: np.concatenate([t.origenes[p] for t in tablas]) for p in parametros}
+        return cls(
+            pd.concat([t.claves for t in tablas], ignore_index=True),
+            {p: np.concatenate([t.valores[p] for t in tablas]) for p in parametros},
+            {p: np.concatenate([t.banderas[p] for t in tablas]) for p in parametros},
+            origenes
+        )
+
+    def __len__(self):
+        return len(self.claves)
+
+    @property
+    def parametros(self):
+        return list(self.valores)
+
+    def copy(self):
+        return TablaBD(
+            self.claves.copy(),
+            {p: v.copy() for p, v in self.valores.items()},
+            {p: b.copy() for p, b in self.banderas.items()},
+            {p: o.copy() for p, o in self.origenes.items()} if self.origenes is not None else None
+        )
+
+    def tomar(self, indices):
+        """Nueva tabla con las filas indicadas (posiciones), en ese orden"""
+        return TablaBD(
+            self.claves.iloc[indices],
+            {p: v[indices] for p, v in self.valores.items()},
+            {p: b[indices] for p, b in self.banderas.items()},
+            {p: o[indices] for p, o in self.origenes.items()} if self.origenes is not None else None
+        )
+
+    def ordenada(self):
+        """Nueva tabla ordenada (estable) por STATION, DATE, HOUR"""
+        orden = self.claves.sort_values(['STATION', 'DATE', 'HOUR']).index.to_numpy()
+        return self.tomar(orden)
+
+    def iniciar_origenes(self):
+        """Máscaras de origen por parámetro, creándolas si todavía no existen
+
+        Al crearlas, las celdas que ya traen bandera del archivo reciben el
+        bit 'envista' (bit 0); por eso solo se crean sobre tablas sin validar.
+        """
+        import numpy as np
+
+        if self.origenes is None:
+            self.origenes = {p: (b != 0).astype(np.uint16) for p, b in self.banderas.items()}
+        return self.origenes
+
+    def numericos(self, parametro):
+        """Máscara de celdas con valor numérico válido (sin bandera)"""
+        import numpy as np
+
+        return ~np.isnan(self.valores[parametro])
+
+    def marcar(self, parametro, mask, bandera):
+        """Aplicar una bandera a las celdas indicadas (máscara o posiciones)"""
+        import numpy as np
+
+        self.banderas[parametro][mask] = CODIGOS_BANDERA[bandera]
+        self.valores[parametro][mask] = np.nan
+
+    def a_formato_base(self):
+        """Convertir a DataFrame BD con números y banderas mezclados por columna
+
+        Las claves van primero (STATION, DATE, HOUR; las tablas de promedios
+        diarios no tienen HOUR).
+        """
+        import numpy as np
+        import pandas as pd
+
+        claves = list(self.claves.columns)
+        datos = {col: self.claves[col].to_numpy() for col in claves}
+        bandera_por_codigo = np.array(BANDERA_POR_CODIGO, dtype=object)
+
+        for param in self.parametros:
+            valores = self.valores[param]
+            codigos = self.banderas[param]
+            columna = valores.astype(object)
+            columna[np.isnan(valores)] = None
+            mask_bandera = codigos != 0
+            columna[mask_bandera] = bandera_por_codigo[codigos[mask_bandera]]
+            datos[param] = columna
+
+        return pd.DataFrame(datos, columns=claves + self.parametros)
+
+
+# ============================================================================
+# MÉTRICAS DE RENDIMIENTO
+# ============================================================================
+
+# Cada etapa del pipeline y cada regla de validación acumulan ejecuciones,
+# tiempo (histograma), filas y celdas procesadas y, con METRICS_TRACE_MEMORY,
+# memoria pico, por (tipo, nombre). /api/metrics las publica en formato de
+# texto de Prometheus. Las mediciones de la solicitud en curso se guardan
+# además en una lista local al hilo, para el encabezado Server-Timing.
+#
+# tracemalloc es uno solo para todo el proceso: con METRICS_TRACE_MEMORY los
+# bloques medidos de distintos hilos se ejecutan de a uno (rastreo_lock),
+# así ninguna validación reinicia el pico de otra. Es un modo de diagnóstico.
+#
+# Las reglas que corren en el pool de procesos (VALIDATION_PROCESSES > 1) no
+# se registran aquí; la etapa 'validacion' sí.
+LIMITES_HISTOGRAMA = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRICAS = {}
+metricas_lock = threading.Lock()
+mediciones_hilo = threading.local()
+rastreo_lock = threading.RLock()
+
+
+def memoria_pico_proceso():
+    """Memoria residente máxima del proceso en bytes (None si no está disponible)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maximo if sys.platform == 'darwin' else maximo * 1024
+
+
+def registrar_medicion(tipo, nombre, segundos, filas, celdas, memoria):
+    """Sumar una medición a los acumulados de (tipo, nombre)"""
+    with metricas_lock:
+        metrica = METRICAS.get((tipo, nombre))
+        if metrica is None:
+            metrica = METRICAS[(tipo, nombre)] = {
+                'ejecuciones': 0, 'segundos': 0.0, 'filas': 0, 'celdas': 0,
+                'memoria_pico_bytes': None, 'histograma': [0] * len(LIMITES_HISTOGRAMA),
+            }
+        metrica['ejecuciones'] += 1
+        metrica['segundos'] += segundos
+        metrica['filas'] += filas
+        metrica['celdas'] += celdas
+        if memoria is not None:
+            metrica['memoria_pico_bytes'] = max(metrica['memoria_pico_bytes'] or 0, memoria)
+        for i, limite in enumerate(LIMITES_HISTOGRAMA):
+            if segundos <= limite:
+                metrica['histograma'][i] += 1
+
+
+@contextmanager
+def medir(tipo, nombre, filas=0, celdas=0):
+    """Medir un bloque de código como etapa ('etapa') o regla ('regla')
+
+    Entrega un dict en el que el bloque puede corregir 'filas' y 'celdas'
+    cuando no se conocen de antemano. Con METRICS_TRACE_MEMORY la memoria
+    pico es la de tracemalloc durante el bloque (incluidos los bloques
+    anidados) y el bloque más externo de cada hilo espera a que ningún otro
+    hilo esté midiendo; si no, no se mide memoria por etapa (la del proceso
+    se publica aparte).
+    """
+    medicion = {'filas': filas, 'celdas': celdas}
+    pila = getattr(mediciones_hilo, 'pila_memoria', None)
+    rastrear = current_app.config['METRICS_TRACE_MEMORY']
+    
+    if rastrear:
+        if pila is None:
+            pila = mediciones_hilo.pila_memoria = []
+        if not pila:
+            rastreo_lock.acquire()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if pila:
+            pila[-1] = max(pila[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        pila.append(0)
+    
+    inicio = time.perf_counter()
+    try:
+        yield medicion
+    finally:
+        segundos = time.perf_counter() - inicio
+        memoria = None
+        if rastrear:
+            memoria = max(pila.pop(), tracemalloc.get_traced_memory()[1])
+            if pila:
+                pila[-1] = max(pila[-1], memoria)
+            else:
+                rastreo_lock.release()
+        
+        anotar_medicion(tipo, nombre, segundos, medicion['filas'], medicion['celdas'], memoria)
+
+
+def anotar_medicion(tipo, nombre, segundos, filas=0, celdas=0, memoria=None):
+    """Registrar una medición ya tomada (acumulados y Server-Timing de la solicitud)"""
+    registrar_medicion(tipo, nombre, segundos, filas, celdas, memoria)
+    tiempos = getattr(mediciones_hilo, 'tiempos', None)
+    if tiempos is not None:
+        tiempos.append({'tipo': tipo, 'nombre': nombre, 'ms': round(segundos * 1000, 3)})
+
+
+def iniciar_tiempos_solicitud():
+    """Empezar a guardar las mediciones de este hilo (para Server-Timing)"""
+    mediciones_hilo.tiempos = []
+    return mediciones_hilo.tiempos
+
+
+def terminar_tiempos_solicitud():
+    """Dejar de guardar las mediciones de este hilo y devolverlas"""
+    tiempos = getattr(mediciones_hilo, 'tiempos', None) or []
+    mediciones_hilo.tiempos = None
+    return tiempos
+
+
+def encabezado_server_timing(tiempos):
+    """Valor del encabezado Server-Timing (las reglas llevan el prefijo 'regla.')"""
+    return ', '.join(
+        f"{'regla.' if t['tipo'] == 'regla' else ''}{t['nombre']};dur={t['ms']}" for t in tiempos
+    )
+
+
+@contextmanager
+def perfilar(nombre):
+    """Ejecutar el bloque con cProfile si PROFILE_REQUESTS está activo
+
+    Entrega la ruta del .prof (PROFILE_FOLDER/<nombre>.prof) o None si no se
+    perfila; el archivo se escribe al salir del bloque.
+    """
+    perfil = None
+    if current_app.config['PROFILE_REQUESTS']:
+        perfil = cProfile.Profile()
+        try:
+            perfil.enable()
+        except ValueError:
+            # Otro perfilador activo (otra solicitud perfilándose en Python 3.12+)
+            perfil = None
+    
+    if perfil is None:
+        yield None
+        return
+    
+    ruta = os.path.join(current_app.config['PROFILE_FOLDER'], f'{secure_filename(nombre)}.prof')
+    try:
+        yield ruta
+    finally:
+        perfil.disable()
+        os.makedirs(current_app.config['PROFILE_FOLDER'], exist_ok=True)
+        perfil.dump_stats(ruta)
+
+
+def etiquetas_prometheus(**etiquetas):
+    return '{' + ','.join(f'{clave}="{valor}"' for clave, valor in etiquetas.items()) + '}'
+
+
+def metricas_prometheus():
+    """Métricas acumuladas en formato de texto de Prometheus"""
+    with metricas_lock:
+        metricas = {clave: {**m, 'histograma': list(m['histograma'])} for clave, m in METRICAS.items()}
+    
+    lineas = [
+        '# HELP validador_duracion_segundos Duración de etapas del pipeline y reglas de validación',
+        '# TYPE validador_duracion_segundos histogram',
+    ]
+    for (tipo, nombre), m in sorted(metricas.items()):
+        for limite, conteo in zip(LIMITES_HISTOGRAMA, m['histograma']):
+            lineas.append(f"validador_duracion_segundos_bucket"
+                          f"{etiquetas_prometheus(tipo=tipo, nombre=nombre, le=limite)} {conteo}")
+        lineas.append(f"validador_duracion_segundos_bucket"
+                      f"{etiquetas_prometheus(tipo=tipo, nombre=nombre, le='+Inf')} {m['ejecuciones']}")
+        lineas.append(f"validador_duracion_segundos_sum{etiquetas_prometheus(tipo=tipo, nombre=nombre)} "
+                      f"{m['segundos']:.6f}")
+        lineas.append(f"validador_duracion_segundos_count{etiquetas_prometheus(tipo=tipo, nombre=nombre)} "
+                      f"{m['ejecuciones']}")
+    
+    for metrica, clave, tipo_metrica, ayuda in (
+        ('validador_filas_procesadas_total', 'filas', 'counter', 'Filas procesadas'),
+        ('validador_celdas_procesadas_total', 'celdas', 'counter', 'Celdas (fila x parámetro) procesadas'),
+        ('validador_memoria_pico_bytes', 'memoria_pico_bytes', 'gauge', 'Memoria pico observada (METRICS_TRACE_MEMORY)'),
+    ):
+        lineas.append(f'# HELP {metrica} {ayuda}')
+        lineas.append(f'# TYPE {metrica} {tipo_metrica}')
+        for (tipo, nombre), m in sorted(metricas.items()):
+            if m[clave] is not None:
+                lineas.append(f"{metrica}{etiquetas_prometheus(tipo=tipo, nombre=nombre)} {m[clave]}")
+    
+    cache = estado_cache()
+    lineas += [
+        '# HELP validador_cache_consultas_total Consultas a la caché de resultados',
+        '# TYPE validador_cache_consultas_total counter',
+        f"validador_cache_consultas_total{etiquetas_prometheus(resultado='acierto')} {cache['aciertos']}",
+        f"validador_cache_consultas_total{etiquetas_prometheus(resultado='fallo')} {cache['fallos']}",
+        '# HELP validador_cache_bytes Uso de disco de la caché de resultados',
+        '# TYPE validador_cache_bytes gauge',
+        f"validador_cache_bytes {cache['bytes']}",
+    ]
+    
+    almacen = estado_almacen()
+    lineas += [
+        '# HELP validador_almacen_bytes Uso de disco de los archivos subidos y validados',
+        '# TYPE validador_almacen_bytes gauge',
+        f"validador_almacen_bytes {almacen['bytes']}",
+        '# HELP validador_almacen_expulsados_total Archivos borrados por TTL o cuota',
+        '# TYPE validador_almacen_expulsados_total counter',
+        f"validador_almacen_expulsados_total {almacen['expulsados']}",
+    ]
+    
+    with clasificaciones_lock:
+        clasificaciones = dict(ESTADISTICAS_CLASIFICACION)
+    lineas += [
+        '# HELP validador_clasificaciones_envista_total Valores de celda ENVISTA distintos buscados en la memoria de clasificaciones',
+        '# TYPE validador_clasificaciones_envista_total counter',
+        f"validador_clasificaciones_envista_total{etiquetas_prometheus(resultado='acierto')} {clasificaciones['aciertos']}",
+        f"validador_clasificaciones_envista_total{etiquetas_prometheus(resultado='fallo')} {clasificaciones['fallos']}",
+    ]
+    
+    with trabajos_lock:
+        estados = [t['estado'] for t in TRABAJOS.values()]
+    lineas += [
+        '# HELP validador_trabajos Trabajos de validación conocidos por estado',
+        '# TYPE validador_trabajos gauge',
+    ]
+    for estado in ('en_cola', 'procesando', 'completado', 'error'):
+        lineas.append(f"validador_trabajos{etiquetas_prometheus(estado=estado)} {estados.count(estado)}")
+    
+    memoria = memoria_pico_proceso()
+    if memoria is not None:
+        lineas += [
+            '# HELP validador_proceso_memoria_max_bytes Memoria residente máxima del proceso',
+            '# TYPE validador_proceso_memoria_max_bytes gauge',
+            f'validador_proceso_memoria_max_bytes {memoria}',
+        ]
+    
+    return '\n'.join(lineas) + '\n'
+
 
 # ============================================================================
 # FUNCIONES DE VALIDACIÓN
 # ============================================================================
 
+# Clasificación de celdas ENVISTA: el mapeo de banderas se compila una vez
+# (claves en minúsculas para la búsqueda por subcadena, en el orden del mapeo)
+# y cada valor de celda distinto se clasifica una sola vez; el resultado queda
+# en un LRU acotado que se comparte entre solicitudes. Ambos se rehacen si
+# cambia MAPEO_BANDERAS_ENVISTA.
+
+MAX_CLASIFICACIONES_ENVISTA = 4096
+CLASIFICACIONES_ENVISTA = OrderedDict()  # (tipo, valor) -> (número, código de bandera)
+ESTADISTICAS_CLASIFICACION = {'aciertos': 0, 'fallos': 0}
+clasificaciones_lock = threading.Lock()
+mapeo_banderas_compilado = None
+
+
+def compilar_mapeo_banderas():
+    """(items del mapeo, subcadenas en minúsculas con su bandera) de MAPEO_BANDERAS_ENVISTA
+
+    Se recompila, y se vacía la memoria de clasificaciones, si el mapeo cambió.
+    """
+    global mapeo_banderas_compilado
+    items = tuple(MAPEO_BANDERAS_ENVISTA.items())
+    compilado = mapeo_banderas_compilado
+    if compilado is None or compilado[0] != items:
+        subcadenas = tuple((bandera_envista.lower(), bandera_std) for bandera_envista, bandera_std in items
+                           if bandera_envista)
+        compilado = (items, subcadenas)
+        with clasificaciones_lock:
+            CLASIFICACIONES_ENVISTA.clear()
+            mapeo_banderas_compilado = compilado
+    return compilado
+
+
 def mapear_bandera_envista(valor):
     """Mapear una bandera de ENVISTA a formato estándar"""
+    import pandas as pd
+    
     if pd.isna(valor):
         return None
     
@@ -135,8 +687,9 @@ def mapear_bandera_envista(valor):
     if valor_str in MAPEO_BANDERAS_ENVISTA:
         return MAPEO_BANDERAS_ENVISTA[valor_str]
     
-    for bandera_envista, bandera_std in MAPEO_BANDERAS_ENVISTA.items():
-        if bandera_envista and bandera_envista.lower() in valor_str.lower():
+    valor_min = valor_str.lower()
+    for bandera_envista, bandera_std in compilar_mapeo_banderas()[1]:
+        if bandera_envista in valor_min:
             return bandera_std
     
     try:
@@ -146,363 +699,3585 @@ def mapear_bandera_envista(valor):
         return 'IO'
 
 
+def es_celda_vacia(valor):
+    """Celda sin dato según las reglas de pd.read_excel (None, NaN o texto NA)"""
+    import pandas as pd
+
+    if isinstance(valor, str):
+        return valor in VALORES_NA_ENVISTA
+    return valor is None or pd.isna(valor)
+
+
+def construir_columnas_envista(filas_encabezado):
+    """Nombres de columna a partir de las filas de encabezado ENVISTA
+
+    La fila 2 trae la estación y la fila 3 el parámetro; la primera columna
+    siempre es 'DateTime' y las columnas sin ambos datos quedan como Col_i.
+    """
+    filas_encabezado = [list(fila) for fila in filas_encabezado] + [[]] * (4 - len(filas_encabezado))
+    ancho = max(len(fila) for fila in filas_encabezado)
+
+    def celda(fila, i):
+        valor = filas_encabezado[fila][i] if i < len(filas_encabezado[fila]) else None
+        if isinstance(valor, float) and valor.is_integer():
+            return int(valor)
+        return valor
+
+    nuevas_columnas = ['DateTime']
+    for i in range(1, ancho):
+        estacion, parametro = celda(2, i), celda(3, i)
+        if not es_celda_vacia(estacion) and not es_celda_vacia(parametro):
+            nuevas_columnas.append(f"{estacion}_{parametro}")
+        else:
+            nuevas_columnas.append(f"Col_{i}")
+
+    return nuevas_columnas
+
+
+def preparar_bloque_envista(df_bloque):
+    """Interpretar la columna DateTime de un bloque y descartar filas sin fecha"""
+    import pandas as pd
+
+    df_bloque['DateTime'] = pd.to_datetime(df_bloque['DateTime'], errors='coerce')
+    return df_bloque.dropna(subset=['DateTime'])
+
+
+def numeros_desde_texto(df_bloque):
+    """Convertir a número las celdas de texto numérico (exportaciones CSV/Parquet/Arrow)"""
+    import pandas as pd
+
+    for col in df_bloque.columns[1:]:
+        if not pd.api.types.is_numeric_dtype(df_bloque[col]):
+            numeros = pd.to_numeric(df_bloque[col], errors='coerce')
+            celdas = df_bloque[col].to_numpy(dtype=object)
+            mask_numerico = numeros.notna().to_numpy()
+            celdas[mask_numerico] = numeros.to_numpy()[mask_numerico]
+            celdas[pd.isna(celdas)] = None
+            df_bloque[col] = pd.Series(celdas, index=df_bloque.index, dtype=object)
+    return df_bloque
+
+
+def leer_bloques_xlsx(archivo, filas_por_bloque):
+    """Leer un libro ENVISTA en modo read-only de openpyxl, por bloques de filas"""
+    import numpy as np
+    import pandas as pd
+    from openpyxl import load_workbook
+
+    libro = load_workbook(archivo, read_only=True, data_only=True, keep_links=False)
+    try:
+        hoja = libro.worksheets[0]
+        hoja.reset_dimensions()
+        filas = hoja.iter_rows(values_only=True)
+
+        nuevas_columnas = construir_columnas_envista(list(itertools.islice(filas, 4)))
+        ancho = len(nuevas_columnas)
+        next(filas, None)
+
+        while True:
+            bloque = [fila[:ancho] + (None,) * (ancho - len(fila))
+                      for fila in itertools.islice(filas, filas_por_bloque)]
+            if not bloque:
+                break
+            df_bloque = pd.DataFrame(bloque, columns=nuevas_columnas, dtype=object)
+            # Celdas vacías y textos NA como NaN, igual que pd.read_excel
+            mask_vacia = df_bloque.isna() | df_bloque.isin(list(VALORES_NA_ENVISTA))
+            if mask_vacia.to_numpy().any():
+                df_bloque = df_bloque.mask(mask_vacia, np.nan)
+            yield preparar_bloque_envista(df_bloque)
+    finally:
+        libro.close()
+
+
+def leer_bloques_xls(archivo, filas_por_bloque):
+    """Leer un libro .xls (formato antiguo) completo con pandas"""
+    import pandas as pd
+
+    df_raw = pd.read_excel(archivo, sheet_name=0, header=None)
+    nuevas_columnas = construir_columnas_envista(df_raw.iloc[:4].values.tolist())
+
+    df_datos = df_raw.iloc[5:, :len(nuevas_columnas)].copy()
+    df_datos.columns = nuevas_columnas
+    df_datos = df_datos.reset_index(drop=True)
+
+    for inicio in range(0, len(df_datos), filas_por_bloque):
+        yield preparar_bloque_envista(df_datos.iloc[inicio:inicio + filas_por_bloque].copy())
+
+
+def leer_bloques_csv(archivo, filas_por_bloque):
+    """Leer una exportación ENVISTA en CSV (mismo diseño de filas que el xlsx)"""
+    import pandas as pd
+
+    with open(archivo, 'rb') as f:
+        muestra = f.read(64 * 1024)
+    try:
+        muestra.decode('utf-8-sig')
+        codificacion = 'utf-8-sig'
+    except UnicodeDecodeError:
+        codificacion = 'latin-1'
+
+    with open(archivo, newline='', encoding=codificacion) as f:
+        filas_encabezado = list(itertools.islice(csv.reader(f), 4))
+    nuevas_columnas = construir_columnas_envista(
+        [[None if celda == '' else celda for celda in fila] for fila in filas_encabezado]
+    )
+
+    lector = pd.read_csv(archivo, header=None, names=nuevas_columnas, skiprows=5,
+                         index_col=False, encoding=codificacion, chunksize=filas_por_bloque)
+    for df_bloque in lector:
+        yield preparar_bloque_envista(numeros_desde_texto(df_bloque))
+
+
+def leer_bloques_arrow(archivo, filas_por_bloque, extension):
+    """Leer una exportación Parquet o Arrow IPC/Feather por lotes de registros
+
+    Se espera una tabla plana: la primera columna es la fecha y el resto se
+    llama 'Estación_Parámetro', igual que las columnas que arma el lector xlsx.
+    """
+    import pyarrow as pa
+
+    if extension == 'parquet':
+        import pyarrow.parquet as pq
+        lotes = pq.ParquetFile(archivo).iter_batches(batch_size=filas_por_bloque)
+    else:
+        fuente = pa.memory_map(archivo)
+        try:
+            lector = pa.ipc.open_file(fuente)
+            lotes = (lector.get_batch(i) for i in range(lector.num_record_batches))
+        except pa.ArrowInvalid:
+            fuente.seek(0)
+            lotes = pa.ipc.open_stream(fuente)
+
+    for lote in lotes:
+        df_bloque = lote.to_pandas()
+        df_bloque.columns = ['DateTime'] + [str(col) for col in df_bloque.columns[1:]]
+        yield preparar_bloque_envista(numeros_desde_texto(df_bloque))
+
+
+def leer_envista_por_bloques(archivo_trs, filas_por_bloque=FILAS_POR_BLOQUE_ENVISTA):
+    """Leer un archivo ENVISTA por bloques de filas según su extensión
+
+    Cada bloque es un DataFrame con 'DateTime' y columnas 'Estación_Parámetro'
+    (el mismo formato que cargar_y_procesar_envista) sin filas sin fecha.
+    """
+    extension = str(archivo_trs).rsplit('.', 1)[-1].lower()
+
+    if extension == 'xls':
+        return leer_bloques_xls(archivo_trs, filas_por_bloque)
+    if extension == 'csv':
+        return leer_bloques_csv(archivo_trs, filas_por_bloque)
+    if extension in ('parquet', 'arrow', 'feather', 'ipc'):
+        return leer_bloques_arrow(archivo_trs, filas_por_bloque, extension)
+    return leer_bloques_xlsx(archivo_trs, filas_por_bloque)
+
+
 def cargar_y_procesar_envista(archivo_trs):
     """Cargar y procesar datos desde Trs.xlsx (formato ENVISTA)"""
+    import pandas as pd
+    
     try:
-        df_raw = pd.read_excel(archivo_trs, sheet_name=0, header=None)
-        
-        estaciones = df_raw.iloc[2, :].values
-        parametros = df_raw.iloc[3, :].values
-        
-        nuevas_columnas = ['DateTime']
-        for i in range(1, len(estaciones)):
-            if pd.notna(estaciones[i]) and pd.notna(parametros[i]):
-                nuevas_columnas.append(f"{estaciones[i]}_{parametros[i]}")
-            else:
-                nuevas_columnas.append(f"Col_{i}")
-        
-        df_datos = df_raw.iloc[5:, :len(nuevas_columnas)].copy()
-        df_datos.columns = nuevas_columnas
-        df_datos = df_datos.reset_index(drop=True)
-        
-        df_datos['DateTime'] = pd.to_datetime(df_datos['DateTime'], errors='coerce')
-        df_datos = df_datos.dropna(subset=['DateTime'])
-        
-        return df_datos
+        bloques = list(leer_envista_por_bloques(archivo_trs))
+        if not bloques:
+            return None
+        return pd.concat(bloques, ignore_index=True)
     
     except Exception as e:
         print(f"Error al cargar datos ENVISTA: {e}")
         return None
 
 
-def convertir_a_formato_base(df_envista):
-    """Convertir formato ENVISTA al formato exacto de BD_2024.xlsx"""
-    datos_convertidos = []
-    
-    for idx, fila in df_envista.iterrows():
-        fecha_hora = fila['DateTime']
-        if pd.isna(fecha_hora):
-            continue
-        
-        fecha = fecha_hora.strftime('%Y-%m-%d %H:%M')
-        hora = fecha_hora.hour
-        
-        for estacion_completa, abrev_estacion in MAPEO_ESTACIONES.items():
-            fila_base = {
-                'STATION': abrev_estacion,
-                'DATE': fecha,
-                'HOUR': hora
-            }
-            
-            for param in COLUMNAS_BD[3:]:
-                fila_base[param] = None
-            
-            for col in df_envista.columns:
-                if col.startswith(estacion_completa + '_'):
-                    parametro_envista = col.split('_', 1)[1]
-                    parametro_base = MAPEO_PARAMETROS.get(parametro_envista, parametro_envista)
-                    
-                    if parametro_base in COLUMNAS_BD:
-                        valor = fila[col]
-                        if pd.notna(valor) and valor != '':
-                            bandera_mapeada = mapear_bandera_envista(valor)
-                            
-                            if bandera_mapeada is not None:
-                                fila_base[parametro_base] = bandera_mapeada
-                            else:
-                                try:
-                                    valor_num = float(valor)
-                                    fila_base[parametro_base] = valor_num
-                                except (ValueError, TypeError):
-                                    fila_base[parametro_base] = 'IO'
-            
-            datos_validos = sum(1 for k, v in fila_base.items()
-                              if k not in ['STATION', 'DATE', 'HOUR'] and v is not None)
-            
-            if datos_validos > 0:
-                datos_convertidos.append(fila_base)
-    
-    if datos_convertidos:
-        df_convertido = pd.DataFrame(datos_convertidos)
-        
-        for col in COLUMNAS_BD:
-            if col not in df_convertido.columns:
-                df_convertido[col] = None
-        
-        df_convertido = df_convertido[COLUMNAS_BD]
-        df_convertido = df_convertido.sort_values(['STATION', 'DATE', 'HOUR']).reset_index(drop=True)
-        
-        return df_convertido
-    else:
-        return pd.DataFrame()
-
+def clasificar_celda_envista(valor):
+    """Convertir una celda ENVISTA no vacía en bandera estándar o valor numérico"""
+    bandera_mapeada = mapear_bandera_envista(valor)
+    if bandera_mapeada is not None:
+        return bandera_mapeada
 
-def validar_rangos(df):
-    """Validar datos por rangos establecidos"""
-    df_validado = df.copy()
-    
-    for parametro, config in RANGOS.items():
-        if parametro in df_validado.columns:
-            valores_num = pd.to_numeric(df_validado[parametro], errors='coerce')
-            mask_numerico = valores_num.notna()
-            
-            if mask_numerico.sum() == 0:
-                continue
-            
-            mask_fuera = mask_numerico & ((valores_num < config['min']) | (valores_num > config['max']))
-            if mask_fuera.sum() > 0:
-                df_validado.loc[mask_fuera, parametro] = 'IR'
-            
-            if 'limite_deteccion' in config and config['limite_deteccion'] is not None:
-                mask_limite = (mask_numerico &
-                             (valores_num >= config['min']) &
-                             (valores_num < config['limite_deteccion']))
-                if mask_limite.sum() > 0:
-                    df_validado.loc[mask_limite, parametro] = config['limite_deteccion']
-    
-    return df_validado
+    try:
+        return float(valor)
+    except (ValueError, TypeError):
+        return 'IO'
 
 
-def validar_temperatura_interna(df):
-    """Validar por temperatura interna de cabina (20-30°C)"""
-    if 'IT' not in df.columns:
-        return df
+def clasificar_unicos_envista(unicos):
+    """(números, códigos de bandera) de valores de celda distintos, con memoria LRU"""
+    import numpy as np
     
-    df_validado = df.copy()
-    temp_interna = pd.to_numeric(df_validado['IT'], errors='coerce')
+    compilar_mapeo_banderas()
+    claves = [(type(v), v) for v in unicos]
     
-    mask_temp_invalida = (temp_interna < 20) | (temp_interna > 30)
+    with clasificaciones_lock:
+        conocidos = [CLASIFICACIONES_ENVISTA.get(clave) for clave in claves]
+        for clave, conocido in zip(claves, conocidos):
+            if conocido is not None:
+                CLASIFICACIONES_ENVISTA.move_to_end(clave)
     
-    contaminantes = ['O3', 'NOX', 'NO', 'NO2', 'PM10', 'PM2.5', 'SO2', 'CO']
+    nuevos = {}
+    for i, (clave, conocido) in enumerate(zip(claves, conocidos)):
+        if conocido is None:
+            clasificado = clasificar_celda_envista(unicos[i])
+            conocido = (np.nan, CODIGOS_BANDERA.get(clasificado, 0)) if isinstance(clasificado, str) \
+                else (clasificado, 0)
+            conocidos[i] = nuevos[clave] = conocido
     
-    for contaminante in contaminantes:
-        if contaminante in df_validado.columns:
-            mask_datos = pd.to_numeric(df_validado[contaminante], errors='coerce').notna()
-            mask_invalidar = mask_temp_invalida & mask_datos
-            
-            if mask_invalidar.sum() > 0:
-                df_validado.loc[mask_invalidar, contaminante] = 'IO'
+    with clasificaciones_lock:
+        ESTADISTICAS_CLASIFICACION['aciertos'] += len(claves) - len(nuevos)
+        ESTADISTICAS_CLASIFICACION['fallos'] += len(nuevos)
+        CLASIFICACIONES_ENVISTA.update(nuevos)
+        while len(CLASIFICACIONES_ENVISTA) > MAX_CLASIFICACIONES_ENVISTA:
+            CLASIFICACIONES_ENVISTA.popitem(last=False)
     
-    return df_validado
+    # El último elemento (NaN, sin bandera) es el del código -1 de pd.factorize
+    numeros = np.array([numero for numero, _ in conocidos] + [np.nan], dtype=np.float64)
+    codigos = np.array([codigo for _, codigo in conocidos] + [0], dtype=np.uint8)
+    return numeros, codigos
 
 
-def validar_series_temporales(df):
-    """Validar datos por series temporales"""
-    df_validado = df.copy()
-    
-    df_validado['datetime_temp'] = pd.to_datetime(df_validado['DATE'].astype(str) + ' ' +
-                                                   df_validado['HOUR'].astype(str) + ':00:00')
-    
-    for estacion in df_validado['STATION'].unique():
-        df_estacion = df_validado[df_validado['STATION'] == estacion].copy()
-        df_estacion = df_estacion.sort_values('datetime_temp').reset_index()
-        
-        # Validación de valores constantes > 3 horas
-        parametros_constantes = ['CO', 'NOX', 'NO2', 'NO', 'O3', 'PM10', 'PM2.5']
-        
-        for param in parametros_constantes:
-            if param in df_estacion.columns:
-                valores = pd.to_numeric(df_estacion[param], errors='coerce')
-                grupos_constantes = (valores != valores.shift()).cumsum()
-                conteo_grupos = valores.groupby(grupos_constantes).size()
-                grupos_largos = conteo_grupos[conteo_grupos > 3].index
-                
-                for grupo in grupos_largos:
-                    mask_grupo = (grupos_constantes == grupo) & valores.notna()
-                    indices_originales = df_estacion.loc[mask_grupo, 'index']
-                    df_validado.loc[indices_originales, param] = 'DS'
-        
-        # Validación de relación (NO+NO2)/NOX
-        if all(param in df_estacion.columns for param in ['NO', 'NO2', 'NOX']):
-            no_vals = pd.to_numeric(df_estacion['NO'], errors='coerce')
-            no2_vals = pd.to_numeric(df_estacion['NO2'], errors='coerce')
-            nox_vals = pd.to_numeric(df_estacion['NOX'], errors='coerce')
-            
-            mask_validos = no_vals.notna() & no2_vals.notna() & nox_vals.notna() & (nox_vals != 0)
-            
-            if mask_validos.sum() > 0:
-                relacion = (no_vals + no2_vals) / nox_vals
-                mask_fuera_rango = mask_validos & ((relacion < 0.85) | (relacion > 1.15))
-                
-                if mask_fuera_rango.sum() > 0:
-                    indices_originales = df_estacion.loc[mask_fuera_rango, 'index']
-                    for param in ['NO', 'NO2', 'NOX']:
-                        df_validado.loc[indices_originales, param] = 'IO'
-        
-        # Validación de relación PM2.5/PM10
-        if all(param in df_estacion.columns for param in ['PM2.5', 'PM10']):
-            pm25_vals = pd.to_numeric(df_estacion['PM2.5'], errors='coerce')
-            pm10_vals = pd.to_numeric(df_estacion['PM10'], errors='coerce')
-            
-            mask_validos = pm25_vals.notna() & pm10_vals.notna() & (pm10_vals != 0)
-            
-            if mask_validos.sum() > 0:
-                relacion = pm25_vals / pm10_vals
-                mask_fuera_rango = mask_validos & (relacion > 1.15)
-                
-                if mask_fuera_rango.sum() > 0:
-                    indices_originales = df_estacion.loc[mask_fuera_rango, 'index']
-                    for param in ['PM2.5', 'PM10']:
-                        df_validado.loc[indices_originales, param] = 'IO'
-    
-    df_validado = df_validado.drop('datetime_temp', axis=1)
-    
-    return df_validado
+def clasificar_celdas_envista(valores):
+    """Clasificar un arreglo de celdas ENVISTA no vacías de forma vectorizada
 
+    Devuelve (valores float64, códigos de bandera uint8). Los números nativos
+    se convierten directamente; el resto se factoriza, cada valor distinto se
+    clasifica una sola vez (ver clasificar_unicos_envista) y el resultado se
+    reparte a las celdas por su código.
+    """
+    import numpy as np
+    import pandas as pd
 
-def aplicar_decimales(df):
-    """Aplicar formato de decimales"""
-    df_formateado = df.copy()
-    
-    for parametro, decimales in DECIMALES.items():
-        if parametro in df_formateado.columns:
-            valores_num = pd.to_numeric(df_formateado[parametro], errors='coerce')
-            mask_numerico = valores_num.notna()
-            
-            if mask_numerico.sum() > 0:
-                df_formateado.loc[mask_numerico, parametro] = valores_num.round(decimales)
-    
-    return df_formateado
+    tipos_numericos = (float, int, np.float64, np.int64)
+    numeros = np.full(len(valores), np.nan)
+    codigos = np.zeros(len(valores), dtype=np.uint8)
 
+    mask_numerico = np.fromiter((type(v) in tipos_numericos for v in valores), dtype=bool,
+                                count=len(valores))
+    numeros[mask_numerico] = valores[mask_numerico].astype(np.float64)
 
-def validar_datos_completo(df):
-    """Ejecutar todas las validaciones"""
-    df_validado = validar_rangos(df)
-    df_validado = validar_temperatura_interna(df_validado)
-    df_validado = validar_series_temporales(df_validado)
-    return df_validado
+    if not mask_numerico.all():
+        codigos_unicos, unicos = pd.factorize(valores[~mask_numerico])
+        numeros_unicos, banderas_unicas = clasificar_unicos_envista(unicos)
+        numeros[~mask_numerico] = numeros_unicos[codigos_unicos]
+        codigos[~mask_numerico] = banderas_unicas[codigos_unicos]
 
+    return numeros, codigos
 
-def crear_resumen_validacion(df):
-    """Crear resumen de la validación"""
-    banderas_encontradas = {}
-    columnas_parametros = [col for col in df.columns if col not in ['STATION', 'DATE', 'HOUR']]
-    
-    for col in columnas_parametros:
-        if df[col].dtype == 'object':
-            valores_unicos = df[col].unique()
-            for valor in valores_unicos:
-                if isinstance(valor, str) and valor in BANDERAS:
-                    if valor not in banderas_encontradas:
-                        banderas_encontradas[valor] = 0
-                    banderas_encontradas[valor] += (df[col] == valor).sum()
-    
-    if banderas_encontradas:
-        resumen = pd.DataFrame.from_dict(banderas_encontradas, orient='index', columns=['Cantidad'])
-        resumen['Descripción'] = resumen.index.map(BANDERAS)
-        resumen = resumen.sort_values('Cantidad', ascending=False)
-    else:
-        resumen = pd.DataFrame({'Cantidad': [0], 'Descripción': ['Sin banderas aplicadas']})
-    
-    # Resumen detallado
-    resumen_detallado = []
-    for estacion in df['STATION'].unique():
-        df_est = df[df['STATION'] == estacion]
-        for param in columnas_parametros:
-            if df_est[param].dtype == 'object':
-                for bandera in BANDERAS:
-                    cantidad = (df_est[param] == bandera).sum()
-                    if cantidad > 0:
-                        resumen_detallado.append({
-                            'Estación': estacion,
-                            'Contaminante': param,
-                            'Bandera': bandera,
-                            'Descripción': BANDERAS[bandera],
-                            'Cantidad': cantidad
-                        })
-    resumen_detallado = pd.DataFrame(resumen_detallado)
-    
-    # Estadísticas
-    estadisticas = pd.DataFrame({
-        'Cantidad': [
-            len(df),
-            len(df['STATION'].unique()),
-            len(df['DATE'].unique()),
-            sum(pd.to_numeric(df[col], errors='coerce').notna().sum() for col in columnas_parametros)
-        ],
-        'Descripción': [
-            'Total de registros',
-            'Estaciones procesadas',
-            'Días procesados',
-            'Valores numéricos válidos'
-        ]
-    }, index=['Total_Registros', 'Estaciones', 'Días', 'Valores_Válidos'])
-    
-    # Estadísticas detalladas
-    estadisticas_detalladas = []
-    for estacion in df['STATION'].unique():
-        df_est = df[df['STATION'] == estacion]
-        for param in columnas_parametros:
-            valores = pd.to_numeric(df_est[param], errors='coerce')
-            valores_validos = valores.dropna()
-            if len(valores_validos) > 0:
-                estadisticas_detalladas.append({
-                    'Estación': estacion,
-                    'Contaminante': param,
-                    'Total de registros': len(df_est),
-                    'Valores válidos': len(valores_validos),
-                    'Mínimo': valores_validos.min(),
-                    'Máximo': valores_validos.max(),
-                    'Promedio': valores_validos.mean(),
-                    'Desviación estándar': valores_validos.std(),
-                })
-    estadisticas_detalladas = pd.DataFrame(estadisticas_detalladas)
-    
-    return resumen, resumen_detallado, estadisticas, estadisticas_detalladas
 
+def resolver_columnas_envista(columnas):
+    """Resolver columnas 'Estación_Parámetro' a (columna, índice de estación, parámetro BD)
 
-def exportar_resultados(df_validado, archivo_salida):
-    """Exportar resultados a Excel"""
-    try:
-        df_export = aplicar_decimales(df_validado)
-        resumen_banderas, resumen_detallado, estadisticas, estadisticas_detalladas = crear_resumen_validacion(df_export)
-        
-        with pd.ExcelWriter(archivo_salida, engine='openpyxl') as writer:
-            df_export.to_excel(writer, sheet_name='Datos_Validados', index=False)
-            resumen_banderas.to_excel(writer, sheet_name='Resumen_Banderas_Global', index=True)
-            resumen_detallado.to_excel(writer, sheet_name='Resumen_Banderas_Detallado', index=False)
-            estadisticas.to_excel(writer, sheet_name='Estadísticas_Generales', index=True)
-            estadisticas_detalladas.to_excel(writer, sheet_name='Estadísticas_Detalladas', index=False)
-            
-            config_df = pd.DataFrame({
-                'Parámetro': list(RANGOS.keys()),
-                'Mín': [r['min'] for r in RANGOS.values()],
-                'Máx': [r['max'] for r in RANGOS.values()],
-                'Decimales': [DECIMALES.get(p, 0) for p in RANGOS.keys()]
-            })
-            config_df.to_excel(writer, sheet_name='Configuración', index=False)
-        
-        return resumen_banderas, estadisticas
-    
-    except Exception as e:
-        print(f"Error al exportar: {e}")
-        return None, None
+    Los destinos quedan ordenados por estación (en el orden de
+    MAPEO_ESTACIONES) y, dentro de cada una, por columna.
+    """
+    tablas = compilar_tablas()
+    estaciones, parametros = tablas['estaciones'], tablas['parametros']
+    destinos = []
 
+    for col in columnas:
+        if not isinstance(col, str):
+            continue
+        estacion_completa, separador, parametro_envista = col.partition('_')
+        idx_estacion = estaciones.get(estacion_completa)
+        idx_parametro = parametros.get(parametro_envista)
+        if separador and idx_estacion is not None and idx_parametro is not None:
+            destinos.append((col, idx_estacion, idx_parametro))
 
-# ============================================================================
-# ENDPOINTS DE LA API
-# ============================================================================
+    destinos.sort(key=lambda destino: destino[1])
+    return destinos
 
-def allowed_file(filename):
-    """Verificar si el archivo tiene una extensión permitida"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def convertir_a_tabla_bd(df_envista):
+    """Convertir formato ENVISTA a TablaBD (formato BD_2024 tipado)
 
-@app.route('/api/health', methods=['GET'])
-def health_check():
-    """Endpoint de salud de la API"""
-    return jsonify({
-        'status': 'ok',
-        'message': 'API de Validación de Calidad del Aire funcionando',
-        'timestamp': datetime.now().isoformat(),
-        'version': '2.0.0'
-    })
+    Las columnas 'Estación_Parámetro' se funden (melt) en una tabla larga de
+    celdas no vacías y se pivotean a filas (STATION, DATE, HOUR). Cuando dos
+    columnas ENVISTA apuntan al mismo parámetro gana la última no vacía.
+    Devuelve una tabla vacía si no hay ningún dato que convertir.
+    """
+    import numpy as np
+    import pandas as pd
 
+    df_envista = df_envista[df_envista['DateTime'].notna()]
+    destinos = resolver_columnas_envista(df_envista.columns)
 
-@app.route('/api/config', methods=['GET'])
-def get_config():
-    """Obtener configuración del validador"""
-    return jsonify({
+    if len(df_envista) == 0 or not destinos:
+        return TablaBD.vacia()
+
+    parametros_bd = COLUMNAS_BD[3:]
+    n_filas = len(df_envista)
+    n_estaciones = len(MAPEO_ESTACIONES)
+    n_parametros = len(parametros_bd)
+
+    # Melt: una entrada por celda, recorriendo columna por columna
+    columnas = [col for col, _, _ in destinos]
+    valores = df_envista[columnas].to_numpy(dtype=object).ravel(order='F')
+
+    mask_dato = pd.notna(valores)
+    mask_dato[mask_dato] = valores[mask_dato] != ''
+    posiciones = np.flatnonzero(mask_dato)
+    del mask_dato
+
+    idx_destino, filas = np.divmod(posiciones, n_filas)
+    estaciones = np.array([est for _, est, _ in destinos])[idx_destino]
+    parametros = np.array([par for _, _, par in destinos])[idx_destino]
+
+    celda = (filas * n_estaciones + estaciones) * n_parametros + parametros
+    ultima = ~pd.Series(celda).duplicated(keep='last').to_numpy()
+    celda = celda[ultima]
+    if len(celda) == 0:
+        return TablaBD.vacia()
+    numeros, codigos = clasificar_celdas_envista(valores[posiciones[ultima]])
+
+    # Pivot: filas (fila ENVISTA, estación) x parámetros BD
+    fila_estacion, idx_parametro = np.divmod(celda, n_parametros)
+    matriz_valores = np.full((n_filas * n_estaciones, n_parametros), np.nan)
+    matriz_banderas = np.zeros((n_filas * n_estaciones, n_parametros), dtype=np.uint8)
+    matriz_valores[fila_estacion, idx_parametro] = numeros
+    matriz_banderas[fila_estacion, idx_parametro] = codigos
+
+    filas_con_datos = np.unique(fila_estacion)
+    idx_fila, idx_estacion = np.divmod(filas_con_datos, n_estaciones)
+    fechas_hora = pd.DatetimeIndex(df_envista['DateTime'].to_numpy()[idx_fila])
+
+    claves = pd.DataFrame({
+        'STATION': compilar_tablas()['codigos_estacion'][idx_estacion],
+        'DATE': fechas_hora.strftime('%Y-%m-%d %H:%M').to_numpy(dtype=object),
+        'HOUR': fechas_hora.hour.to_numpy(dtype=np.int64),
+    })
+
+    return TablaBD(
+        claves,
+        {p: matriz_valores[filas_con_datos, j] for j, p in enumerate(parametros_bd)},
+        {p: matriz_banderas[filas_con_datos, j] for j, p in enumerate(parametros_bd)}
+    ).ordenada()
+
+
+def cargar_tabla_bd(archivo_trs, al_leer_bloque=None):
+    """Leer un archivo ENVISTA por bloques convirtiendo cada uno a TablaBD
+
+    Nunca se materializa el archivo completo como objetos: solo el bloque en
+    curso y las columnas tipadas ya convertidas. Devuelve None si el archivo
+    no se pudo leer o no tiene filas con fecha. `al_leer_bloque` recibe el
+    total de filas leídas después de cada bloque.
+
+    Con CONVERTED_CACHE_ENABLED la tabla convertida se guarda en Arrow IPC
+    junto al archivo y las lecturas siguientes la cargan desde ahí, sin
+    volver a leer ni convertir el libro.
+    """
+    ruta_arrow = None
+    if current_app.config['CONVERTED_CACHE_ENABLED']:
+        ruta_arrow = ruta_tabla_convertida(archivo_trs)
+        tabla = cargar_tabla_convertida(ruta_arrow)
+        if tabla is not None:
+            if al_leer_bloque is not None:
+                al_leer_bloque(len(tabla))
+            return tabla
+    
+    tablas = []
+    filas_leidas = 0
+    
+    try:
+        for df_bloque in leer_envista_por_bloques(archivo_trs):
+            filas_leidas += len(df_bloque)
+            tablas.append(convertir_a_tabla_bd(df_bloque))
+            if al_leer_bloque is not None:
+                al_leer_bloque(filas_leidas)
+    except Exception as e:
+        print(f"Error al cargar datos ENVISTA: {e}")
+        return None
+    
+    if filas_leidas == 0:
+        return None
+    
+    tabla = TablaBD.concatenar(tablas)
+    del tablas
+    tabla = tabla.ordenada()
+    if ruta_arrow is not None:
+        guardar_tabla_convertida(tabla, ruta_arrow)
+    return tabla
+
+
+def convertir_a_formato_base(df_envista):
+    """Convertir formato ENVISTA al formato exacto de BD_2024.xlsx"""
+    import pandas as pd
+
+    tabla = convertir_a_tabla_bd(df_envista)
+    if len(tabla) == 0:
+        return pd.DataFrame()
+
+    return tabla.a_formato_base().infer_objects()
+
+
+# Motor de reglas: las reglas se describen como datos (RANGOS, TEMPERATURA_INTERNA,
+# PARAMETROS_CONSTANTES, RELACIONES) y se aplican en una sola pasada por
+# parámetro sobre una única copia de la tabla. Fases, en orden de precedencia
+# (una bandera posterior reemplaza a la anterior en la misma celda):
+#   'rangos'     IR fuera de [min, max]; valores bajo el límite de detección se igualan a él
+#   'compuerta'  IO en contaminantes si la temperatura interna está fuera de rango
+#   'series'     DS en rachas constantes y luego IO por relaciones; ambas reglas
+#                leen los valores que dejan las fases anteriores
+FASES_REGLAS = ('rangos', 'compuerta', 'series')
+
+# Bits de las máscaras de origen (TablaBD.origenes), en este orden; después
+# van las relaciones de RELACIONES, un bit cada una, hasta 16 en total
+REGLAS_ORIGEN = ('envista', 'rangos', 'limite_deteccion', 'temperatura_interna', 'valores_constantes')
+MAX_REGLAS_ORIGEN = 16
+
+
+def compilar_reglas(rangos=None, temperatura_interna=None, parametros_constantes=None,
+                    horas_constantes=None, relaciones=None):
+    """Reglas de validación como datos, a partir de la configuración (o de la indicada)
+
+    Sin argumentos devuelve las reglas ya compiladas en compilar_tablas().
+    """
+    if all(arg is None for arg in (rangos, temperatura_interna, parametros_constantes,
+                                   horas_constantes, relaciones)):
+        return compilar_tablas()['reglas']
+    
+    rangos = RANGOS if rangos is None else rangos
+    temperatura_interna = TEMPERATURA_INTERNA if temperatura_interna is None else temperatura_interna
+    relaciones = RELACIONES if relaciones is None else relaciones
+    
+    origenes = REGLAS_ORIGEN + tuple(relacion['nombre'] for relacion in relaciones)
+    if len(origenes) > MAX_REGLAS_ORIGEN:
+        raise ValueError(f'Se permiten hasta {MAX_REGLAS_ORIGEN - len(REGLAS_ORIGEN)} relaciones')
+    
+    return {
+        'rangos': {
+            param: (config['min'], config['max'], config.get('limite_deteccion'))
+            for param, config in rangos.items()
+        },
+        'compuerta': {
+            'parametro': temperatura_interna['parametro'],
+            'min': temperatura_interna['min'],
+            'max': temperatura_interna['max'],
+            'afecta': set(temperatura_interna['contaminantes']),
+        },
+        'constantes': {
+            'parametros': set(PARAMETROS_CONSTANTES if parametros_constantes is None else parametros_constantes),
+            'horas': HORAS_CONSTANTES if horas_constantes is None else horas_constantes,
+        },
+        'relaciones': relaciones,
+        'origenes': {nombre: 1 << bit for bit, nombre in enumerate(origenes)},
+    }
+
+
+def calcular_fecha_hora(claves):
+    """Fecha y hora (datetime64) de cada fila BD a partir de DATE y HOUR
+
+    Equivale a interpretar 'DATE HOUR:00:00': se toma el día de DATE y la
+    hora de HOUR (los minutos de DATE se descartan). Solo se interpreta cada
+    DATE distinto una vez.
+    """
+    import pandas as pd
+
+    codigos, fechas_unicas = pd.factorize(claves['DATE'])
+    dias = pd.to_datetime(pd.Index(fechas_unicas).astype(str).str[:10], format='%Y-%m-%d')[codigos]
+    return (dias + pd.to_timedelta(claves['HOUR'].to_numpy(), unit='h')).to_numpy()
+
+
+def marcar_valores_constantes(valores, inicio_serie, horas=HORAS_CONSTANTES):
+    """Máscara de valores que forman rachas constantes de más de `horas` horas
+
+    `valores` debe estar ordenado por (estación, fecha) e `inicio_serie`
+    marca la primera fila de cada estación; las rachas no cruzan estaciones
+    y un NaN siempre corta la racha.
+    """
+    import numpy as np
+
+    cambio = np.empty(len(valores), dtype=bool)
+    cambio[0] = True
+    cambio[1:] = valores[1:] != valores[:-1]
+    cambio |= inicio_serie
+
+    racha = np.cumsum(cambio) - 1
+    longitud_racha = np.bincount(racha)
+    return (longitud_racha[racha] > horas) & ~np.isnan(valores)
+
+
+def orden_series(claves):
+    """Orden por (STATION, fecha) y máscara de la primera fila de cada estación en ese orden"""
+    import numpy as np
+    import pandas as pd
+
+    codigos_estacion, _ = pd.factorize(claves['STATION'])
+    orden = np.lexsort((calcular_fecha_hora(claves), codigos_estacion))
+    estacion_ordenada = codigos_estacion[orden]
+    inicio_serie = np.empty(len(orden), dtype=bool)
+    inicio_serie[0] = True
+    inicio_serie[1:] = estacion_ordenada[1:] != estacion_ordenada[:-1]
+    return orden, inicio_serie
+
+
+def mascara_relacion(valores, relacion):
+    """Celdas donde suma(numerador) / denominador queda fuera de los límites de la relación"""
+    import numpy as np
+    
+    numerador = valores[relacion['numerador'][0]]
+    for param in relacion['numerador'][1:]:
+        numerador = numerador + valores[param]
+    denominador = valores[relacion['denominador']]
+    
+    mask_validos = ~np.isnan(numerador) & ~np.isnan(denominador) & (denominador != 0)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cociente = numerador / denominador
+    fuera = cociente > relacion['max']
+    if relacion['min'] is not None:
+        fuera |= cociente < relacion['min']
+    return mask_validos & fuera
+
+
+def aplicar_reglas(tabla, reglas=None, fases=FASES_REGLAS, en_sitio=False):
+    """Aplicar las reglas compiladas en una sola pasada por parámetro
+
+    Trabaja sobre una copia de la tabla (o sobre la misma con `en_sitio`).
+    Las fases omitidas no se aplican; el resultado de aplicar todas es el
+    mismo que encadenar rangos, temperatura interna y series temporales.
+    """
+    import numpy as np
+    
+    reglas = reglas or compilar_reglas()
+    tabla_validada = tabla if en_sitio else tabla.copy()
+    if len(tabla_validada) == 0:
+        return tabla_validada
+    
+    valores, banderas = tabla_validada.valores, tabla_validada.banderas
+    origenes, bits = tabla_validada.iniciar_origenes(), reglas['origenes']
+    filas = len(tabla_validada)
+    codigo_ir, codigo_io, codigo_ds = CODIGOS_BANDERA['IR'], CODIGOS_BANDERA['IO'], CODIGOS_BANDERA['DS']
+    segundos = dict.fromkeys(['rangos', 'temperatura_interna', 'valores_constantes'], 0.0)
+    celdas = dict.fromkeys(segundos, 0)
+    
+    rangos = reglas['rangos'] if 'rangos' in fases else {}
+    compuerta = reglas['compuerta']
+    aplicar_compuerta = 'compuerta' in fases and compuerta['parametro'] in valores
+    constantes = reglas['constantes']['parametros'] if 'series' in fases else set()
+    if constantes & set(valores):
+        orden, inicio_serie = orden_series(tabla_validada.claves)
+    
+    # El parámetro de la compuerta va primero: la compuerta usa su valor ya validado por rango
+    parametros = tabla_validada.parametros
+    if aplicar_compuerta:
+        parametros.remove(compuerta['parametro'])
+        parametros.insert(0, compuerta['parametro'])
+    mask_compuerta = None
+    mascaras_ds = {}
+    
+    for param in parametros:
+        v, b, o = valores[param], banderas[param], origenes[param]
+        
+        # La compuerta también queda registrada en las celdas que el rango ya invalidó
+        afectado_compuerta = aplicar_compuerta and param in compuerta['afecta'] and param != compuerta['parametro']
+        if afectado_compuerta:
+            con_dato = ~np.isnan(v)
+        
+        if param in rangos:
+            inicio = time.perf_counter()
+            minimo, maximo, limite = rangos[param]
+            fuera = np.flatnonzero((v < minimo) | (v > maximo))
+            b[fuera] = codigo_ir
+            v[fuera] = np.nan
+            o[fuera] |= bits['rangos']
+            if limite is not None:
+                igualar = np.flatnonzero((v >= minimo) & (v < limite))
+                v[igualar] = limite
+                o[igualar] |= bits['limite_deteccion']
+            segundos['rangos'] += time.perf_counter() - inicio
+            celdas['rangos'] += filas
+        
+        if aplicar_compuerta:
+            inicio = time.perf_counter()
+            if param == compuerta['parametro']:
+                mask_compuerta = (v < compuerta['min']) | (v > compuerta['max'])
+            elif afectado_compuerta:
+                o[np.flatnonzero(mask_compuerta & con_dato)] |= bits['temperatura_interna']
+                invalidar = np.flatnonzero(mask_compuerta & ~np.isnan(v))
+                b[invalidar] = codigo_io
+                v[invalidar] = np.nan
+                celdas['temperatura_interna'] += filas
+            segundos['temperatura_interna'] += time.perf_counter() - inicio
+        
+        # Las rachas se buscan ahora pero se marcan después de calcular las
+        # relaciones, que leen los valores sin las banderas DS
+        if param in constantes:
+            inicio = time.perf_counter()
+            mask_constante = marcar_valores_constantes(v[orden], inicio_serie, reglas['constantes']['horas'])
+            mascaras_ds[param] = orden[mask_constante]
+            segundos['valores_constantes'] += time.perf_counter() - inicio
+            celdas['valores_constantes'] += filas
+    
+    mascaras_relacion = []
+    if 'series' in fases:
+        for relacion in reglas['relaciones']:
+            afectados = relacion['numerador'] + [relacion['denominador']]
+            if all(param in valores for param in afectados):
+                inicio = time.perf_counter()
+                mascaras_relacion.append((relacion['nombre'], afectados, mascara_relacion(valores, relacion)))
+                segundos[relacion['nombre']] = time.perf_counter() - inicio
+                celdas[relacion['nombre']] = filas * len(afectados)
+    
+    inicio = time.perf_counter()
+    for param, posiciones in mascaras_ds.items():
+        banderas[param][posiciones] = codigo_ds
+        valores[param][posiciones] = np.nan
+        origenes[param][posiciones] |= bits['valores_constantes']
+    segundos['valores_constantes'] += time.perf_counter() - inicio
+    
+    for nombre, afectados, mask_fuera in mascaras_relacion:
+        fuera = np.flatnonzero(mask_fuera)
+        for param in afectados:
+            banderas[param][fuera] = codigo_io
+            valores[param][fuera] = np.nan
+            origenes[param][fuera] |= bits[nombre]
+    
+    for nombre, tiempo in segundos.items():
+        if celdas[nombre]:
+            anotar_medicion('regla', nombre, tiempo, filas, celdas[nombre])
+    
+    return tabla_validada
+
+
+def validar_rangos(tabla):
+    """Validar datos por rangos establecidos"""
+    return aplicar_reglas(tabla, fases=('rangos',))
+
+
+def validar_temperatura_interna(tabla):
+    """Validar por temperatura interna de cabina (20-30°C)"""
+    return aplicar_reglas(tabla, fases=('compuerta',))
+
+
+def validar_series_temporales(tabla):
+    """Validar datos por series temporales
+
+    Se ordena una sola vez por (STATION, fecha) y todas las estaciones se
+    evalúan juntas. Todas las reglas usan los valores de entrada; las banderas
+    de relación (IO) se aplican después de las de valores constantes (DS).
+    """
+    return aplicar_reglas(tabla, fases=('series',))
+
+
+def aplicar_decimales(tabla):
+    """Aplicar formato de decimales"""
+    import numpy as np
+    
+    tabla_formateada = tabla.copy()
+    
+    for parametro, decimales in compilar_tablas()['decimales']:
+        if parametro in tabla_formateada.valores:
+            tabla_formateada.valores[parametro] = np.round(tabla_formateada.valores[parametro], decimales)
+    
+    return tabla_formateada
+
+
+# Los pools de procesos usan 'spawn': cada worker importa este módulo de nuevo
+# y tendría los valores por defecto, no los de crear_app. El initializer
+# le pasa la configuración que usan la lectura y las reglas y deja activo
+# el contexto de una aplicación creada con ella; el pool se vuelve a crear
+# si esa configuración cambia.
+
+CONFIG_WORKERS = ('UPLOAD_FOLDER', 'CONVERTED_CACHE_ENABLED')
+GLOBALES_WORKERS = ('MAPEO_ESTACIONES', 'MAPEO_PARAMETROS', 'MAPEO_BANDERAS_ENVISTA', 'VALORES_NA_ENVISTA',
+                    'COLUMNAS_BD', 'DECIMALES', 'RANGOS', 'TEMPERATURA_INTERNA', 'PARAMETROS_CONSTANTES',
+                    'HORAS_CONSTANTES', 'RELACIONES')
+
+ejecutor_procesos = None
+ejecutor_procesos_lock = threading.Lock()
+
+
+def configuracion_workers():
+    """(claves de current_app.config, globales de configuración) que necesita un worker de los pools"""
+    return ({clave: current_app.config[clave] for clave in CONFIG_WORKERS},
+            {nombre: globals()[nombre] for nombre in GLOBALES_WORKERS})
+
+
+def iniciar_worker(config, globales):
+    """Initializer de los pools: aplicar la configuración del proceso principal y compilar las tablas"""
+    globals().update(globales)
+    crear_app(config).app_context().push()
+    compilar_tablas()
+    compilar_mapeo_banderas()
+
+
+def crear_ejecutor_procesos(ejecutor, procesos):
+    """Devolver `ejecutor` o, si tiene otro tamaño u otra configuración, uno nuevo (con el lock de su pool)"""
+    configuracion = configuracion_workers()
+    huella = json.dumps(configuracion, sort_keys=True, default=sorted)
+    if ejecutor is not None and (ejecutor._max_workers != procesos or ejecutor.huella_configuracion != huella):
+        ejecutor.shutdown(wait=False)
+        ejecutor = None
+    if ejecutor is None:
+        ejecutor = ProcessPoolExecutor(
+            max_workers=procesos,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=iniciar_worker,
+            initargs=configuracion
+        )
+        ejecutor.huella_configuracion = huella
+    return ejecutor
+
+
+def validar_estaciones(tabla, en_sitio=False):
+    """Ejecutar todas las validaciones en serie (una pasada del motor de reglas)"""
+    return aplicar_reglas(tabla, en_sitio=en_sitio)
+
+
+def obtener_ejecutor_procesos(procesos):
+    """Pool de procesos para validar estaciones en paralelo (se reutiliza entre solicitudes)"""
+    global ejecutor_procesos
+    with ejecutor_procesos_lock:
+        ejecutor_procesos = crear_ejecutor_procesos(ejecutor_procesos, procesos)
+        return ejecutor_procesos
+
+
+def validar_datos_completo(tabla, procesos=1, en_sitio=False):
+    """Ejecutar todas las validaciones
+
+    Con `procesos` > 1 la tabla se divide por STATION y cada estación se
+    valida en un pool de procesos; como ninguna regla compara estaciones
+    entre sí, el resultado es idéntico al de la ejecución en serie. Cada
+    parte se vuelve a colocar en sus posiciones originales. Con `en_sitio`
+    las banderas se escriben sobre la misma tabla, sin copiarla.
+    """
+    import numpy as np
+    import pandas as pd
+    
+    if procesos <= 1:
+        return validar_estaciones(tabla, en_sitio)
+    
+    codigos_estacion, estaciones = pd.factorize(tabla.claves['STATION'])
+    if len(estaciones) <= 1:
+        return validar_estaciones(tabla, en_sitio)
+    
+    # Cada proceso recibe su propia copia de la parte: se valida en sitio
+    posiciones = [np.flatnonzero(codigos_estacion == i) for i in range(len(estaciones))]
+    ejecutor = obtener_ejecutor_procesos(procesos)
+    partes = ejecutor.map(validar_estaciones, [tabla.tomar(indices) for indices in posiciones],
+                          itertools.repeat(True))
+    
+    tabla_validada = tabla if en_sitio else tabla.copy()
+    for indices, parte in zip(posiciones, partes):
+        escribir_parte(tabla_validada, indices, parte)
+    
+    return tabla_validada
+
+
+def escribir_parte(tabla, posiciones, parte):
+    """Copiar en las filas `posiciones` de la tabla los valores, banderas y orígenes de una parte validada"""
+    origenes = tabla.iniciar_origenes()
+    for param in tabla.parametros:
+        tabla.valores[param][posiciones] = parte.valores[param]
+        tabla.banderas[param][posiciones] = parte.banderas[param]
+        origenes[param][posiciones] = parte.origenes[param]
+
+
+def nombres_origen(mascara, bits):
+    """Reglas (nombres) cuyos bits están en la máscara de origen de una celda"""
+    return [nombre for nombre, bit in bits.items() if mascara & bit]
+
+
+def celdas_con_origen(tabla, indices=None, parametros=None, mascara=0):
+    """Celdas con algún bit de origen, ordenadas por fila y parámetro
+
+    `indices` limita las filas (posiciones) y `mascara` deja solo las celdas
+    con alguno de esos bits. Devuelve (filas, índice en `parametros`, máscaras).
+    """
+    import numpy as np
+    
+    indices = np.arange(len(tabla)) if indices is None else indices
+    parametros = tabla.parametros if parametros is None else parametros
+    filas, columnas, mascaras = [np.empty(0, dtype=np.intp)], [np.empty(0, dtype=np.intp)], [np.empty(0, np.uint16)]
+    
+    for j, param in enumerate(parametros):
+        origen = tabla.origenes[param][indices]
+        seleccion = np.flatnonzero(origen & mascara if mascara else origen)
+        filas.append(indices[seleccion])
+        columnas.append(np.full(len(seleccion), j, dtype=np.intp))
+        mascaras.append(origen[seleccion])
+    
+    filas, columnas, mascaras = np.concatenate(filas), np.concatenate(columnas), np.concatenate(mascaras)
+    orden = np.lexsort((columnas, filas))
+    return filas[orden], columnas[orden], mascaras[orden]
+
+
+def registros_origen(tabla, filas, columnas, mascaras, parametros, bits):
+    """Registros (STATION, DATE, HOUR, Contaminante, Bandera, Origen, Reglas) de celdas con origen"""
+    import numpy as np
+
+    claves = tabla.claves.iloc[filas]
+    reglas = {int(m): nombres_origen(int(m), bits) for m in np.unique(mascaras)}
+    return [
+        {
+            'STATION': estacion,
+            'DATE': fecha,
+            'HOUR': int(hora),
+            'Contaminante': parametros[j],
+            'Bandera': BANDERA_POR_CODIGO[tabla.banderas[parametros[j]][fila]],
+            'Origen': int(mascara),
+            'Reglas': reglas[int(mascara)],
+        }
+        for fila, j, mascara, estacion, fecha, hora in zip(
+            filas.tolist(), columnas.tolist(), mascaras.tolist(),
+            claves['STATION'], claves['DATE'], claves['HOUR']
+        )
+    ]
+
+
+def crear_resumen_validacion(tabla):
+    """Crear resumen de la validación
+
+    Todo sale de una pasada agrupada: las banderas se cuentan por
+    (estación, parámetro, código) con un solo np.bincount y las estadísticas
+    se reducen por tramos de estación con reduceat sobre la matriz de valores.
+    """
+    import numpy as np
+    import pandas as pd
+    
+    parametros = tabla.parametros
+    codigos_estacion, estaciones = pd.factorize(tabla.claves['STATION'])
+    estaciones = estaciones.to_numpy(dtype=object)
+    n_estaciones, n_parametros, n_codigos = len(estaciones), len(parametros), len(BANDERA_POR_CODIGO)
+    
+    def matriz(columnas, dtype):
+        if not parametros:
+            return np.zeros((len(tabla), 0), dtype=dtype)
+        return np.column_stack([columnas[p] for p in parametros])
+    
+    # Conteos [estación, parámetro, código de bandera]
+    indice = ((codigos_estacion[:, None] * n_parametros + np.arange(n_parametros)) * n_codigos
+              + matriz(tabla.banderas, np.uint8))
+    conteos = np.bincount(indice.ravel(), minlength=n_estaciones * n_parametros * n_codigos)
+    conteos = conteos.reshape(n_estaciones, n_parametros, n_codigos)
+    del indice
+    
+    # Resumen global: las banderas en el orden en que aparecen recorriendo
+    # parámetro por parámetro, luego ordenadas (estable) por cantidad
+    por_parametro = conteos.sum(axis=0)
+    totales = por_parametro.sum(axis=0)
+    presentes = [codigo for codigo in range(1, n_codigos) if totales[codigo] > 0]
+    presentes.sort(key=lambda codigo: (np.argmax(por_parametro[:, codigo] > 0), codigo))
+    
+    if presentes:
+        resumen = pd.DataFrame(
+            {'Cantidad': [int(totales[codigo]) for codigo in presentes]},
+            index=[BANDERA_POR_CODIGO[codigo] for codigo in presentes]
+        )
+        resumen['Descripción'] = resumen.index.map(BANDERAS)
+        resumen = resumen.sort_values('Cantidad', ascending=False, kind='stable')
+    else:
+        resumen = pd.DataFrame({'Cantidad': [0], 'Descripción': ['Sin banderas aplicadas']})
+    
+    # Resumen detallado
+    i_est, i_par, i_cod = np.nonzero(conteos[:, :, 1:])
+    i_cod += 1
+    if len(i_est):
+        banderas_detalle = np.array(BANDERA_POR_CODIGO, dtype=object)[i_cod]
+        resumen_detallado = pd.DataFrame({
+            'Estación': estaciones[i_est],
+            'Contaminante': np.array(parametros, dtype=object)[i_par],
+            'Bandera': banderas_detalle,
+            'Descripción': [BANDERAS[bandera] for bandera in banderas_detalle],
+            'Cantidad': conteos[i_est, i_par, i_cod]
+        })
+    else:
+        resumen_detallado = pd.DataFrame()
+    
+    # Estadísticas por tramos de estación (orden estable por código de estación)
+    orden = np.argsort(codigos_estacion, kind='stable')
+    filas_por_estacion = np.bincount(codigos_estacion, minlength=n_estaciones)
+    inicios = np.concatenate([[0], np.cumsum(filas_por_estacion)[:-1]]).astype(np.intp)
+    
+    valores = matriz(tabla.valores, np.float64)[orden]
+    validos = ~np.isnan(valores)
+    
+    if n_estaciones:
+        n_validos = np.add.reduceat(validos, inicios, axis=0, dtype=np.int64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            promedio = np.add.reduceat(np.where(validos, valores, 0.0), inicios, axis=0) / n_validos
+            desvio = np.where(validos, valores - np.repeat(promedio, filas_por_estacion, axis=0), 0.0)
+            desviacion = np.sqrt(np.add.reduceat(desvio ** 2, inicios, axis=0) / (n_validos - 1))
+        minimo = np.fmin.reduceat(valores, inicios, axis=0)
+        maximo = np.fmax.reduceat(valores, inicios, axis=0)
+    else:
+        n_validos = np.zeros((0, n_parametros), dtype=np.int64)
+    
+    estadisticas = pd.DataFrame({
+        'Cantidad': [
+            len(tabla),
+            n_estaciones,
+            tabla.claves['DATE'].nunique(),
+            int(n_validos.sum())
+        ],
+        'Descripción': [
+            'Total de registros',
+            'Estaciones procesadas',
+            'Días procesados',
+            'Valores numéricos válidos'
+        ]
+    }, index=['Total_Registros', 'Estaciones', 'Días', 'Valores_Válidos'])
+    
+    # Estadísticas detalladas
+    i_est, i_par = np.nonzero(n_validos)
+    if len(i_est):
+        estadisticas_detalladas = pd.DataFrame({
+            'Estación': estaciones[i_est],
+            'Contaminante': np.array(parametros, dtype=object)[i_par],
+            'Total de registros': filas_por_estacion[i_est],
+            'Valores válidos': n_validos[i_est, i_par],
+            'Mínimo': minimo[i_est, i_par],
+            'Máximo': maximo[i_est, i_par],
+            'Promedio': promedio[i_est, i_par],
+            'Desviación estándar': desviacion[i_est, i_par],
+        })
+    else:
+        estadisticas_detalladas = pd.DataFrame()
+    
+    return resumen, resumen_detallado, estadisticas, estadisticas_detalladas
+
+
+def valor_excel(valor):
+    """Valor listo para openpyxl: NaN como celda vacía y escalares de numpy como Python"""
+    import numpy as np
+
+    if isinstance(valor, np.generic):
+        valor = valor.item()
+    if isinstance(valor, float) and np.isnan(valor):
+        return None
+    return valor
+
+
+def escribir_hoja_excel(libro, nombre, df, index):
+    """Escribir un DataFrame pequeño (resúmenes) con el mismo diseño que to_excel"""
+    hoja = libro.create_sheet(nombre)
+    if len(df.columns) == 0:
+        return
+    
+    hoja.append(([None] if index else []) + list(df.columns))
+    for etiqueta, fila in zip(df.index, df.itertuples(index=False, name=None)):
+        valores = [valor_excel(valor) for valor in fila]
+        hoja.append(([etiqueta] if index else []) + valores)
+
+
+def exportar_resultados(tabla_export, resumenes, archivo_salida, filas_por_bloque=FILAS_POR_BLOQUE_ENVISTA):
+    """Exportar resultados a Excel (tabla con decimales aplicados y sus resúmenes)
+
+    Usa el modo write_only de openpyxl: las filas se escriben por bloques
+    directo al archivo, sin armar el libro completo en memoria.
+    """
+    import pandas as pd
+    from openpyxl import Workbook
+    
+    try:
+        resumen_banderas, resumen_detallado, estadisticas, estadisticas_detalladas = resumenes
+        libro = Workbook(write_only=True)
+        
+        hoja = libro.create_sheet('Datos_Validados')
+        hoja.append(['STATION', 'DATE', 'HOUR'] + tabla_export.parametros)
+        for inicio in range(0, len(tabla_export), filas_por_bloque):
+            bloque = tabla_export.tomar(slice(inicio, inicio + filas_por_bloque)).a_formato_base()
+            # a_formato_base ya deja None en lugar de NaN y escalares de Python
+            for fila in bloque.to_numpy(dtype=object).tolist():
+                hoja.append(fila)
+        
+        escribir_hoja_excel(libro, 'Resumen_Banderas_Global', resumen_banderas, index=True)
+        escribir_hoja_excel(libro, 'Resumen_Banderas_Detallado', resumen_detallado, index=False)
+        escribir_hoja_excel(libro, 'Estadísticas_Generales', estadisticas, index=True)
+        escribir_hoja_excel(libro, 'Estadísticas_Detalladas', estadisticas_detalladas, index=False)
+        
+        if tabla_export.origenes is not None:
+            escribir_hoja_origen(libro, tabla_export, filas_por_bloque)
+        
+        config_df = pd.DataFrame({
+            'Parámetro': list(RANGOS.keys()),
+            'Mín': [r['min'] for r in RANGOS.values()],
+            'Máx': [r['max'] for r in RANGOS.values()],
+            'Decimales': [DECIMALES.get(p, 0) for p in RANGOS.keys()]
+        })
+        escribir_hoja_excel(libro, 'Configuración', config_df, index=False)
+        
+        libro.save(archivo_salida)
+        return resumen_banderas, estadisticas
+    
+    except Exception as e:
+        print(f"Error al exportar: {e}")
+        return None, None
+
+
+def escribir_hoja_origen(libro, tabla, filas_por_bloque=FILAS_POR_BLOQUE_ENVISTA):
+    """Hojas Origen_Banderas (una fila por celda con alguna regla) y Reglas_Origen (bits)"""
+    import numpy as np
+    import pandas as pd
+    
+    bits = compilar_reglas()['origenes']
+    columnas_hoja = ['STATION', 'DATE', 'HOUR', 'Contaminante', 'Bandera', 'Origen', 'Reglas']
+    hoja = libro.create_sheet('Origen_Banderas')
+    hoja.append(columnas_hoja)
+    
+    for inicio in range(0, len(tabla), filas_por_bloque):
+        filas, columnas, mascaras = celdas_con_origen(tabla, np.arange(inicio, min(inicio + filas_por_bloque, len(tabla))))
+        for registro in registros_origen(tabla, filas, columnas, mascaras, tabla.parametros, bits):
+            registro['Reglas'] = ', '.join(registro['Reglas'])
+            hoja.append([registro[columna] for columna in columnas_hoja])
+    
+    escribir_hoja_excel(libro, 'Reglas_Origen', pd.DataFrame({'Regla': list(bits), 'Bit': list(bits.values())}),
+                        index=False)
+
+
+def exportar_csv_gz(tabla_export, archivo_salida, filas_por_bloque=FILAS_POR_BLOQUE_ENVISTA):
+    """Exportar los datos validados (hoja Datos_Validados) a CSV comprimido con gzip"""
+    try:
+        with gzip.open(archivo_salida, 'wt', encoding='utf-8', newline='') as f:
+            for inicio in range(0, max(len(tabla_export), 1), filas_por_bloque):
+                bloque = tabla_export.tomar(slice(inicio, inicio + filas_por_bloque)).a_formato_base()
+                bloque.to_csv(f, header=(inicio == 0), index=False)
+        return True
+    
+    except Exception as e:
+        print(f"Error al exportar CSV: {e}")
+        return False
+
+
+def esquema_arrow(parametros, claves=('STATION', 'DATE', 'HOUR'), origenes=False):
+    """Esquema Arrow de una tabla BD: claves + valor y bandera por parámetro
+
+    Con `origenes` cada parámetro lleva también '<parámetro>_ORIGEN' (uint16)
+    y los bits de cada regla van en los metadatos ('reglas_origen').
+    """
+    import pyarrow as pa
+    
+    campos = [(clave, pa.int64() if clave == 'HOUR' else pa.string()) for clave in claves]
+    for param in parametros:
+        campos += [(param, pa.float64()), (f'{param}_BANDERA', pa.string())]
+        if origenes:
+            campos.append((f'{param}_ORIGEN', pa.uint16()))
+    if not origenes:
+        return pa.schema(campos)
+    return pa.schema(campos, metadata={'reglas_origen': json.dumps(compilar_reglas()['origenes'])})
+
+
+def tabla_a_arrow(tabla, esquema=None):
+    """Convertir una TablaBD a tabla Arrow (valor nulo si hay bandera o no hay dato)"""
+    import numpy as np
+    import pyarrow as pa
+    
+    # Las tablas de promedios diarios no tienen HOUR
+    claves = [clave for clave in ('STATION', 'DATE', 'HOUR') if clave in tabla.claves.columns]
+    esquema = esquema or esquema_arrow(tabla.parametros, claves)
+    columnas = [
+        pa.array(tabla.claves[clave].to_numpy(dtype=np.int64), pa.int64()) if clave == 'HOUR'
+        else pa.array(tabla.claves[clave].to_numpy(dtype=object), pa.string())
+        for clave in claves
+    ]
+    nombres = set(esquema.names)
+    bandera_por_codigo = np.array(BANDERA_POR_CODIGO, dtype=object)
+    for param in tabla.parametros:
+        valores = tabla.valores[param]
+        columnas.append(pa.array(valores, pa.float64(), mask=np.isnan(valores)))
+        columnas.append(pa.array(bandera_por_codigo[tabla.banderas[param]], pa.string()))
+        if f'{param}_ORIGEN' in nombres:
+            columnas.append(pa.array(tabla.origenes[param], pa.uint16()))
+    return pa.Table.from_arrays(columnas, schema=esquema)
+
+
+def tabla_desde_arrow(tabla_arrow):
+    """Convertir una tabla Arrow con el esquema de esquema_arrow a TablaBD"""
+    import numpy as np
+    import pandas as pd
+    
+    claves = pd.DataFrame({
+        'STATION': tabla_arrow.column('STATION').to_numpy(zero_copy_only=False).astype(object),
+        'DATE': tabla_arrow.column('DATE').to_numpy(zero_copy_only=False).astype(object),
+        'HOUR': tabla_arrow.column('HOUR').to_numpy().astype(np.int64),
+    })
+    parametros = [nombre for nombre in tabla_arrow.column_names
+                  if nombre not in ('STATION', 'DATE', 'HOUR') and not nombre.endswith(('_BANDERA', '_ORIGEN'))]
+    
+    valores, banderas = {}, {}
+    for param in parametros:
+        valores[param] = tabla_arrow.column(param).to_numpy(zero_copy_only=False).astype(np.float64)
+        codigos, textos = pd.factorize(tabla_arrow.column(f'{param}_BANDERA').to_numpy(zero_copy_only=False))
+        # código -1 (sin bandera) cae en el último elemento, que es 0
+        por_texto = np.array([CODIGOS_BANDERA.get(texto, 0) for texto in textos] + [0], dtype=np.uint8)
+        banderas[param] = por_texto[codigos]
+    
+    return TablaBD(claves, valores, banderas)
+
+
+def exportar_parquet(tabla_export, archivo_salida, filas_por_bloque=FILAS_POR_BLOQUE_ENVISTA):
+    """Exportar los datos validados a Parquet con columnas tipadas
+
+    Cada parámetro se guarda como valor float64 (nulo si tiene bandera o no
+    hay dato) más una columna '<parámetro>_BANDERA' con el texto de la bandera
+    y, en tablas validadas, '<parámetro>_ORIGEN' con la máscara de reglas.
+    """
+    try:
+        import pyarrow.parquet as pq
+        
+        esquema = esquema_arrow(tabla_export.parametros, origenes=tabla_export.origenes is not None)
+        with pq.ParquetWriter(archivo_salida, esquema) as writer:
+            for inicio in range(0, max(len(tabla_export), 1), filas_por_bloque):
+                bloque = tabla_export.tomar(slice(inicio, inicio + filas_por_bloque))
+                writer.write_table(tabla_a_arrow(bloque, esquema))
+        return True
+    
+    except Exception as e:
+        print(f"Error al exportar Parquet: {e}")
+        return False
+
+
+# ============================================================================
+# VALIDACIÓN INCREMENTAL POR ESTACIÓN
+# ============================================================================
+
+# Por estación se guardan dos tablas ordenadas por fecha: 'previa' (con rangos
+# y temperatura interna, antes de series temporales) y 'validada'. Rangos,
+# temperatura y relaciones son reglas por fila, así que solo se aplican a las
+# filas nuevas; la de valores constantes mira filas vecinas, pero una racha
+# solo puede cambiar desde su inicio, y de ahí se revalida cada parámetro.
+#
+# Cada estación conserva solo sus últimas INCREMENTAL_HISTORY_ROWS horas, más
+# lo que haga falta para no partir una racha constante que todavía se puede
+# alargar (de una racha larga bastan HORAS_CONSTANTES + 1 filas para seguir
+# marcándola). Las horas que llegan más atrás de lo conservado se validan
+# solo contra lo conservado.
+
+HISTORIAL_ESTACIONES = {}
+historial_lock = threading.Lock()
+
+
+def inicio_racha(valores, posicion, limite=0):
+    """Primera fila de la racha de valores iguales que incluye `posicion` (un NaN corta)
+
+    No se busca antes de la fila `limite`.
+    """
+    inicio = posicion
+    while inicio > limite and valores[inicio - 1] == valores[inicio]:
+        inicio -= 1
+    return inicio
+
+
+def recortar_historial(historial, max_filas, reglas_constantes):
+    """Historial de una estación sin las filas viejas que las reglas ya no pueden cambiar"""
+    import numpy as np
+    
+    filas = len(historial['fechas'])
+    corte = filas - max_filas
+    if corte <= 0:
+        return historial
+    
+    previa = historial['previa']
+    limite = max(corte - reglas_constantes['horas'] - 1, 0)
+    for param in reglas_constantes['parametros']:
+        if param in previa.valores:
+            corte = min(corte, inicio_racha(previa.valores[param], corte, limite))
+    if corte == 0:
+        return historial
+    
+    # Con posiciones (no un slice) se copian las filas y se liberan las viejas
+    conservar = np.arange(corte, filas)
+    return {
+        'previa': previa.tomar(conservar),
+        'validada': historial['validada'].tomar(conservar),
+        'fechas': historial['fechas'][conservar],
+    }
+
+
+def ventana_estacion(historial, nuevas, fechas_nuevas):
+    """Mezclar filas nuevas de una estación (con rangos y temperatura) con su historial
+
+    Las filas con la misma fecha y hora que una del historial la reemplazan.
+    Devuelve la tabla previa mezclada y la ventana que hay que revalidar:
+    desde el inicio de la racha que llega a la primera fila cambiada.
+    """
+    import numpy as np
+    import pandas as pd
+    
+    unicas = np.flatnonzero(~pd.Series(fechas_nuevas).duplicated(keep='last').to_numpy())
+    orden = unicas[np.argsort(fechas_nuevas[unicas], kind='stable')]
+    nuevas, fechas_nuevas = nuevas.tomar(orden), fechas_nuevas[orden]
+    
+    if historial is None:
+        return {'previa': nuevas, 'fechas': fechas_nuevas, 'inicio': 0, 'inicios': {},
+                'reemplazadas': 0, 'ventana': nuevas}
+    
+    previa, fechas = historial['previa'], historial['fechas']
+    
+    # Filas del historial desde la primera fecha nueva: se mezclan con las
+    # nuevas (las repetidas se reemplazan) y se reordenan por fecha
+    pos = int(np.searchsorted(fechas, fechas_nuevas[0], side='left'))
+    conservar = pos + np.flatnonzero(~np.isin(fechas[pos:], fechas_nuevas))
+    cola = TablaBD.concatenar([previa.tomar(conservar), nuevas])
+    fechas_cola = np.concatenate([fechas[conservar], fechas_nuevas])
+    orden = np.argsort(fechas_cola, kind='stable')
+    cola, fechas_cola = cola.tomar(orden), fechas_cola[orden]
+    
+    # Inicio de la racha que llega a la fila anterior a los cambios, por parámetro
+    inicios = {param: inicio_racha(previa.valores[param], pos - 1) if pos > 0 else 0
+               for param in PARAMETROS_CONSTANTES if param in previa.valores}
+    inicio = min([pos] + list(inicios.values()))
+    
+    return {
+        'previa': TablaBD.concatenar([previa.tomar(slice(0, pos)), cola]),
+        'fechas': np.concatenate([fechas[:pos], fechas_cola]),
+        'inicio': inicio,
+        'inicios': inicios,
+        'reemplazadas': len(fechas) - pos - len(conservar),
+        'ventana': TablaBD.concatenar([previa.tomar(slice(inicio, pos)), cola]),
+    }
+
+
+def cerrar_ventana_estacion(historial, mezcla, ventana_validada):
+    """Historial actualizado a partir de la ventana ya validada (y fila donde empieza la ventana)"""
+    inicio = mezcla['inicio']
+    
+    if historial is not None:
+        validada = historial['validada']
+        for param, inicio_param in mezcla['inicios'].items():
+            # Antes del inicio de su racha el parámetro no cambia
+            ventana_validada.valores[param][:inicio_param - inicio] = validada.valores[param][inicio:inicio_param]
+            ventana_validada.banderas[param][:inicio_param - inicio] = validada.banderas[param][inicio:inicio_param]
+            ventana_validada.origenes[param][:inicio_param - inicio] = validada.origenes[param][inicio:inicio_param]
+        ventana_validada = TablaBD.concatenar([validada.tomar(slice(0, inicio)), ventana_validada])
+    
+    return {'previa': mezcla['previa'], 'validada': ventana_validada, 'fechas': mezcla['fechas']}, inicio
+
+
+def anexar_tabla(tabla):
+    """Validar filas nuevas de forma incremental y sumarlas al historial de cada estación
+
+    Las ventanas de todas las estaciones se validan juntas en una sola pasada
+    de validar_series_temporales. Devuelve el detalle por estación y la tabla
+    con las filas revalidadas.
+    """
+    import numpy as np
+    import pandas as pd
+    
+    previa = aplicar_reglas(tabla, fases=('rangos', 'compuerta'))
+    fechas = calcular_fecha_hora(previa.claves)
+    codigos_estacion, estaciones = pd.factorize(previa.claves['STATION'])
+    reglas_constantes = compilar_reglas()['constantes']
+    detalle = {}
+    
+    with historial_lock:
+        mezclas = {}
+        for i, estacion in enumerate(estaciones):
+            filas = np.flatnonzero(codigos_estacion == i)
+            mezclas[estacion] = ventana_estacion(
+                HISTORIAL_ESTACIONES.get(estacion), previa.tomar(filas), fechas[filas]
+            )
+            detalle[estacion] = {'filas_recibidas': len(filas)}
+        
+        ventanas = validar_series_temporales(TablaBD.concatenar([m['ventana'] for m in mezclas.values()]))
+        
+        revalidadas = []
+        desplazamiento = 0
+        for estacion, mezcla in mezclas.items():
+            filas = np.arange(desplazamiento, desplazamiento + len(mezcla['ventana']))
+            desplazamiento += len(filas)
+            historial, inicio = cerrar_ventana_estacion(
+                HISTORIAL_ESTACIONES.get(estacion), mezcla, ventanas.tomar(filas)
+            )
+            validada = historial['validada']
+            revalidadas.append(validada.tomar(np.arange(inicio, len(validada))))
+            
+            historial = recortar_historial(historial, current_app.config['INCREMENTAL_HISTORY_ROWS'], reglas_constantes)
+            HISTORIAL_ESTACIONES[estacion] = historial
+            validada = historial['validada']
+            detalle[estacion].update({
+                'filas_reemplazadas': mezcla['reemplazadas'],
+                'filas_revalidadas': len(filas),
+                'total_filas': len(validada),
+                'fecha_inicio': validada.claves['DATE'].iloc[0],
+                'fecha_fin': validada.claves['DATE'].iloc[-1],
+            })
+    
+    return detalle, TablaBD.concatenar(revalidadas).ordenada()
+
+
+# ============================================================================
+# VALIDACIÓN POR LOTES (VARIOS ARCHIVOS)
+# ============================================================================
+
+# Los archivos de un lote se leen en paralelo (un proceso por archivo), se
+# unen en una sola tabla BD y se validan juntos, de modo que las reglas de
+# series temporales ven la serie completa aunque cruce de un archivo a otro.
+
+ejecutor_lectura = None
+ejecutor_lectura_lock = threading.Lock()
+
+
+def obtener_ejecutor_lectura(procesos):
+    """Pool de procesos para leer los archivos de un lote (se reutiliza entre solicitudes)"""
+    global ejecutor_lectura
+    with ejecutor_lectura_lock:
+        ejecutor_lectura = crear_ejecutor_procesos(ejecutor_lectura, procesos)
+        return ejecutor_lectura
+
+
+def leer_archivos_lote(rutas, procesos=1, al_leer_archivo=None):
+    """Leer varios archivos ENVISTA como TablaBD, en paralelo si procesos > 1
+
+    Devuelve las tablas en el orden de `rutas` (None para los archivos que no
+    se pudieron leer). `al_leer_archivo` recibe la posición y la tabla de
+    cada archivo a medida que termina.
+    """
+    tablas = [None] * len(rutas)
+    
+    if procesos <= 1 or len(rutas) <= 1:
+        for i, ruta in enumerate(rutas):
+            tablas[i] = cargar_tabla_bd(ruta)
+            if al_leer_archivo is not None:
+                al_leer_archivo(i, tablas[i])
+        return tablas
+    
+    ejecutor = obtener_ejecutor_lectura(procesos)
+    futuros = {ejecutor.submit(cargar_tabla_bd, ruta): i for i, ruta in enumerate(rutas)}
+    for futuro in as_completed(futuros):
+        i = futuros[futuro]
+        tablas[i] = futuro.result()
+        if al_leer_archivo is not None:
+            al_leer_archivo(i, tablas[i])
+    
+    return tablas
+
+
+def unir_tablas_lote(tablas):
+    """Unir las tablas de un lote en una tabla BD ordenada sin horas repetidas
+
+    Si una hora (STATION, DATE, HOUR) aparece en varios archivos se conserva
+    la del último archivo de la lista. Devuelve (tabla, filas descartadas).
+    """
+    import numpy as np
+
+    tabla = TablaBD.concatenar(tablas)
+    duplicadas = tabla.claves.duplicated(subset=['STATION', 'DATE', 'HOUR'], keep='last').to_numpy()
+    if duplicadas.any():
+        tabla = tabla.tomar(np.flatnonzero(~duplicadas))
+    return tabla.ordenada(), int(duplicadas.sum())
+
+
+def clave_cache_lote(rutas):
+    """Clave de caché de un lote: las claves de sus archivos, en orden"""
+    texto = 'lote:' + ':'.join(clave_cache(ruta) for ruta in rutas)
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+
+# ============================================================================
+# ALMACÉN HISTÓRICO
+# ============================================================================
+
+# Filas validadas en Parquet, un archivo por estación y mes:
+# HISTORY_FOLDER/<STATION>/<AAAA-MM>.parquet. Cada archivo queda ordenado por
+# DATE y HOUR; una fila que ya existe (misma estación, DATE y HOUR) se
+# reemplaza. Las consultas solo leen los archivos de las estaciones y meses
+# pedidos, y solo las columnas de los parámetros pedidos.
+#
+# Es opcional (HISTORY_ENABLED). Las validaciones no esperan a la escritura:
+# las filas se encargan a un único hilo escritor, que actualiza las
+# particiones en orden; las consultas ven cada partición completa, la
+# anterior o la nueva.
+
+historial_almacen_lock = threading.Lock()  # particiones leídas en memoria
+historial_escritura_lock = threading.Lock()
+ejecutor_historial = None
+ejecutor_historial_lock = threading.Lock()
+PARTICIONES_LEIDAS = OrderedDict()
+MAX_PARTICIONES_LEIDAS = 512
+
+
+def ruta_particion(estacion, mes):
+    return os.path.join(current_app.config['HISTORY_FOLDER'], secure_filename(estacion), f'{mes}.parquet')
+
+
+def leer_particion(ruta, parametros=None):
+    """Leer una partición como TablaBD (se recuerdan las últimas leídas, por fecha de modificación)"""
+    import pyarrow.parquet as pq
+    
+    marca = os.stat(ruta).st_mtime_ns
+    llave = (ruta, marca, tuple(parametros) if parametros is not None else None)
+    
+    with historial_almacen_lock:
+        tabla = PARTICIONES_LEIDAS.get(llave)
+        if tabla is not None:
+            PARTICIONES_LEIDAS.move_to_end(llave)
+            return tabla
+    
+    columnas = None
+    if parametros is not None:
+        columnas = ['STATION', 'DATE', 'HOUR'] + [c for p in parametros for c in (p, f'{p}_BANDERA')]
+    tabla = tabla_desde_arrow(pq.read_table(ruta, columns=columnas))
+    
+    with historial_almacen_lock:
+        PARTICIONES_LEIDAS[llave] = tabla
+        while len(PARTICIONES_LEIDAS) > MAX_PARTICIONES_LEIDAS:
+            PARTICIONES_LEIDAS.popitem(last=False)
+    
+    return tabla
+
+
+def guardar_en_historial(tabla):
+    """Sumar filas validadas al almacén (reemplaza las que ya existían)"""
+    import numpy as np
+    import pandas as pd
+    import pyarrow.parquet as pq
+    
+    if len(tabla) == 0:
+        return 0
+    
+    particion = tabla.claves['STATION'].astype(str) + '/' + tabla.claves['DATE'].astype(str).str[:7]
+    codigos, particiones = pd.factorize(particion)
+    
+    with historial_escritura_lock:
+        for i, nombre in enumerate(particiones):
+            estacion, mes = nombre.rsplit('/', 1)
+            ruta = ruta_particion(estacion, mes)
+            nuevas = tabla.tomar(np.flatnonzero(codigos == i))
+            
+            if os.path.exists(ruta):
+                existente = tabla_desde_arrow(pq.read_table(ruta))
+                llave_nueva = nuevas.claves['DATE'].astype(str) + ' ' + nuevas.claves['HOUR'].astype(str)
+                llave_existente = existente.claves['DATE'].astype(str) + ' ' + existente.claves['HOUR'].astype(str)
+                existente = existente.tomar(np.flatnonzero(~llave_existente.isin(llave_nueva).to_numpy()))
+                nuevas = TablaBD.concatenar([existente, nuevas])
+            
+            orden = nuevas.claves.sort_values(['DATE', 'HOUR'], kind='stable').index.to_numpy()
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            temporal = f'{ruta}.tmp'
+            pq.write_table(tabla_a_arrow(nuevas.tomar(orden)), temporal)
+            os.replace(temporal, ruta)
+    
+    return len(particiones)
+
+
+def particiones_historial(estaciones=None, fecha_inicio=None, fecha_fin=None):
+    """Rutas de las particiones que pueden tener filas de la consulta, en orden (estación, mes)"""
+    carpeta = current_app.config['HISTORY_FOLDER']
+    if not os.path.isdir(carpeta):
+        return []
+    
+    desde = fecha_inicio[:7] if fecha_inicio else None
+    hasta = fecha_fin[:7] if fecha_fin else None
+    rutas = []
+    for estacion in sorted(set(estaciones)) if estaciones else sorted(os.listdir(carpeta)):
+        carpeta_estacion = os.path.join(carpeta, secure_filename(estacion))
+        if not os.path.isdir(carpeta_estacion):
+            continue
+        for archivo in sorted(os.listdir(carpeta_estacion)):
+            if not archivo.endswith('.parquet'):
+                continue
+            mes = archivo[:-len('.parquet')]
+            if desde and mes[:len(desde)] < desde:
+                continue
+            if hasta and mes[:len(hasta)] > hasta:
+                continue
+            rutas.append(os.path.join(carpeta_estacion, archivo))
+    return rutas
+
+
+FILAS_PARTICION = {}
+
+
+def filas_particion(ruta):
+    """Filas de una partición según los metadatos de Parquet (sin leer los datos)"""
+    import pyarrow.parquet as pq
+    
+    marca = os.stat(ruta).st_mtime_ns
+    guardado = FILAS_PARTICION.get(ruta)
+    if guardado is None or guardado[0] != marca:
+        guardado = (marca, pq.read_metadata(ruta).num_rows)
+        FILAS_PARTICION[ruta] = guardado
+    return guardado[1]
+
+
+def consultar_historial(estaciones=None, parametros=None, fecha_inicio=None, fecha_fin=None,
+                        inicio=0, limite=None):
+    """Página de filas del almacén que cumplen los filtros y total de filas
+
+    Solo se leen las particiones que caen dentro de la página: el total sale
+    de los metadatos, salvo en los meses del borde de un rango de fechas con
+    día, que sí se leen para filtrarlos.
+    """
+    if parametros is None:
+        parametros = COLUMNAS_BD[3:]
+    
+    def mes_parcial(mes):
+        return any(fecha and len(fecha) > 7 and mes == fecha[:7] for fecha in (fecha_inicio, fecha_fin))
+    
+    # (ruta, filas, tabla ya filtrada o None si la partición entra completa)
+    particiones = []
+    for ruta in particiones_historial(estaciones, fecha_inicio, fecha_fin):
+        if mes_parcial(os.path.basename(ruta)[:-len('.parquet')]):
+            tabla = leer_particion(ruta, parametros)
+            tabla = tabla.tomar(filtrar_resultado(tabla, fecha_inicio=fecha_inicio, fecha_fin=fecha_fin))
+            particiones.append((ruta, len(tabla), tabla))
+        else:
+            particiones.append((ruta, filas_particion(ruta), None))
+    
+    total = sum(filas for _, filas, _ in particiones)
+    fin = total if limite is None else min(total, inicio + limite)
+    
+    partes = []
+    desplazamiento = 0
+    for ruta, filas, tabla in particiones:
+        if desplazamiento + filas > inicio and desplazamiento < fin:
+            if tabla is None:
+                tabla = leer_particion(ruta, parametros)
+            desde = max(inicio - desplazamiento, 0)
+            partes.append(tabla.tomar(slice(desde, min(fin - desplazamiento, filas))))
+        desplazamiento += filas
+    
+    tabla = TablaBD.concatenar(partes)
+    tabla = TablaBD(tabla.claves, {p: tabla.valores[p] for p in parametros},
+                    {p: tabla.banderas[p] for p in parametros})
+    return tabla, total
+
+
+def guardar_en_historial_seguro(tabla):
+    """Encargar al hilo escritor guardar las filas en el almacén (si está activo)
+
+    La tabla no se debe modificar después. Devuelve el futuro de la escritura
+    (None si el almacén está desactivado); un error solo se informa.
+    """
+    global ejecutor_historial
+    if not current_app.config['HISTORY_ENABLED']:
+        return None
+    
+    def guardar():
+        try:
+            guardar_en_historial(tabla)
+        except Exception as e:
+            print(f"Error al guardar en el historial: {e}")
+    
+    with ejecutor_historial_lock:
+        if ejecutor_historial is None:
+            ejecutor_historial = ThreadPoolExecutor(max_workers=1, thread_name_prefix='historial')
+    return ejecutor_historial.submit(en_contexto(guardar))
+
+
+# ============================================================================
+# CACHÉ DE RESULTADOS
+# ============================================================================
+
+# La clave combina el contenido del archivo subido y la configuración activa,
+# así un mismo Trs.xlsx validado con otros rangos no reutiliza el resultado.
+# Cada entrada es una carpeta con la respuesta, la tabla validada y los
+# archivos exportados a medida que se generan; la fecha de modificación de la carpeta marca su último uso (LRU).
+
+ARCHIVO_CACHE_RESPUESTA = 'respuesta.json'
+ARCHIVO_CACHE_TABLA = 'tabla.npz'
+
+cache_lock = threading.Lock()
+ESTADISTICAS_CACHE = {'aciertos': 0, 'fallos': 0, 'expulsiones': 0}
+
+
+def huella_configuracion():
+    """Hash de las reglas, DECIMALES y los mapeos que afectan al resultado"""
+    configuracion = {
+        'rangos': RANGOS,
+        'temperatura_interna': TEMPERATURA_INTERNA,
+        'constantes': [PARAMETROS_CONSTANTES, HORAS_CONSTANTES],
+        'relaciones': RELACIONES,
+        'decimales': DECIMALES,
+        'estaciones': MAPEO_ESTACIONES,
+        'parametros': MAPEO_PARAMETROS,
+        'banderas': MAPEO_BANDERAS_ENVISTA,
+        'origenes': REGLAS_ORIGEN,
+    }
+    texto = json.dumps(configuracion, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+
+def hash_archivo(ruta, tamano_bloque=1024 * 1024):
+    """SHA-256 del contenido de un archivo, leído por bloques"""
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(tamano_bloque), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def clave_cache(ruta):
+    """Clave de caché: contenido + extensión (define el lector) + configuración"""
+    extension = os.path.splitext(ruta)[1].lower()
+    texto = f"{huella_subida(ruta) or hash_archivo(ruta)}:{extension}:{huella_configuracion()}"
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+
+def carpeta_cache(clave):
+    return os.path.join(current_app.config['RESULT_CACHE_FOLDER'], clave)
+
+
+def tamano_carpeta(carpeta):
+    return sum(entrada.stat().st_size for entrada in os.scandir(carpeta) if entrada.is_file())
+
+
+def guardar_tabla(tabla, ruta):
+    """Guardar una TablaBD (claves + arreglos de valores, banderas y orígenes) en .npz"""
+    import numpy as np
+
+    arreglos = {
+        'STATION': tabla.claves['STATION'].to_numpy(dtype=str),
+        'DATE': tabla.claves['DATE'].to_numpy(dtype=str),
+        'HOUR': tabla.claves['HOUR'].to_numpy(dtype=np.int64),
+        'parametros': np.array(tabla.parametros, dtype=str),
+    }
+    for i, param in enumerate(tabla.parametros):
+        arreglos[f'valores_{i}'] = tabla.valores[param]
+        arreglos[f'banderas_{i}'] = tabla.banderas[param]
+        if tabla.origenes is not None:
+            arreglos[f'origenes_{i}'] = tabla.origenes[param]
+    np.savez(ruta, **arreglos)
+
+
+def cargar_tabla(ruta):
+    """Leer una TablaBD guardada con guardar_tabla"""
+    import numpy as np
+    import pandas as pd
+
+    with np.load(ruta) as arreglos:
+        claves = pd.DataFrame({
+            'STATION': arreglos['STATION'].astype(object),
+            'DATE': arreglos['DATE'].astype(object),
+            'HOUR': arreglos['HOUR'],
+        })
+        parametros = [str(p) for p in arreglos['parametros']]
+        valores = {p: arreglos[f'valores_{i}'] for i, p in enumerate(parametros)}
+        banderas = {p: arreglos[f'banderas_{i}'] for i, p in enumerate(parametros)}
+        origenes = None
+        if 'origenes_0' in arreglos.files:
+            origenes = {p: arreglos[f'origenes_{i}'] for i, p in enumerate(parametros)}
+    return TablaBD(claves, valores, banderas, origenes)
+
+
+def buscar_en_cache(clave):
+    """Respuesta guardada para la clave (o None) y actualizar los contadores"""
+    carpeta = carpeta_cache(clave)
+    
+    with cache_lock:
+        try:
+            with open(os.path.join(carpeta, ARCHIVO_CACHE_RESPUESTA), encoding='utf-8') as f:
+                respuesta = json.load(f)
+        except (OSError, ValueError):
+            ESTADISTICAS_CACHE['fallos'] += 1
+            return None
+        os.utime(carpeta)
+        ESTADISTICAS_CACHE['aciertos'] += 1
+    
+    return respuesta
+
+
+def archivo_exportado_cache(clave, formato):
+    return os.path.join(carpeta_cache(clave), f'validado.{formato}')
+
+
+def guardar_en_cache(clave, respuesta, tabla_validada, archivos_exportados=None):
+    """Guardar una entrada completa; se escribe aparte y se publica con un rename"""
+    carpeta = carpeta_cache(clave)
+    os.makedirs(current_app.config['RESULT_CACHE_FOLDER'], exist_ok=True)
+    temporal = tempfile.mkdtemp(dir=current_app.config['RESULT_CACHE_FOLDER'], prefix='.tmp_')
+    
+    try:
+        for formato, ruta in (archivos_exportados or {}).items():
+            publicar_archivo(ruta, os.path.join(temporal, f'validado.{formato}'))
+        guardar_tabla(tabla_validada, os.path.join(temporal, ARCHIVO_CACHE_TABLA))
+        with open(os.path.join(temporal, ARCHIVO_CACHE_RESPUESTA), 'w', encoding='utf-8') as f:
+            json.dump(respuesta, f, ensure_ascii=False)
+        
+        with cache_lock:
+            if os.path.exists(carpeta):
+                shutil.rmtree(temporal)
+            else:
+                os.rename(temporal, carpeta)
+            expulsar_entradas_cache()
+    except Exception as e:
+        print(f"Error al guardar en caché: {e}")
+        shutil.rmtree(temporal, ignore_errors=True)
+
+
+def agregar_archivo_cache(clave, formato, ruta):
+    """Sumar a una entrada existente un archivo exportado después (descarga diferida)"""
+    with cache_lock:
+        if not os.path.isdir(carpeta_cache(clave)):
+            return
+        try:
+            publicar_archivo(ruta, archivo_exportado_cache(clave, formato))
+        except OSError as e:
+            print(f"Error al guardar en caché: {e}")
+            return
+        expulsar_entradas_cache()
+
+
+def expulsar_entradas_cache():
+    """Borrar las entradas menos usadas hasta quedar bajo RESULT_CACHE_MAX_BYTES (con cache_lock)"""
+    entradas = []
+    for entrada in os.scandir(current_app.config['RESULT_CACHE_FOLDER']):
+        if entrada.is_dir() and not entrada.name.startswith('.'):
+            entradas.append((entrada.stat().st_mtime, tamano_carpeta(entrada.path), entrada.path))
+    
+    total = sum(tamano for _, tamano, _ in entradas)
+    for _, tamano, ruta in sorted(entradas):
+        if total <= current_app.config['RESULT_CACHE_MAX_BYTES']:
+            break
+        shutil.rmtree(ruta, ignore_errors=True)
+        total -= tamano
+        ESTADISTICAS_CACHE['expulsiones'] += 1
+
+
+def publicar_archivo(origen, archivo_destino):
+    """Poner un archivo en otra ruta con un enlace duro (o copia si no se puede)"""
+    if os.path.exists(archivo_destino):
+        os.remove(archivo_destino)
+    try:
+        os.link(origen, archivo_destino)
+    except OSError:
+        shutil.copyfile(origen, archivo_destino)
+
+
+def estado_cache():
+    """Contadores de la caché y uso de disco"""
+    carpeta = current_app.config['RESULT_CACHE_FOLDER']
+    
+    with cache_lock:
+        entradas = [e.path for e in os.scandir(carpeta)
+                    if e.is_dir() and not e.name.startswith('.')] if os.path.isdir(carpeta) else []
+        consultas = ESTADISTICAS_CACHE['aciertos'] + ESTADISTICAS_CACHE['fallos']
+        return {
+            **ESTADISTICAS_CACHE,
+            'tasa_aciertos': round(ESTADISTICAS_CACHE['aciertos'] / consultas, 4) if consultas else 0,
+            'entradas': len(entradas),
+            'bytes': sum(tamano_carpeta(ruta) for ruta in entradas),
+            'max_bytes': current_app.config['RESULT_CACHE_MAX_BYTES'],
+        }
+
+
+# ============================================================================
+# RESULTADOS PAGINADOS
+# ============================================================================
+
+# Un resultado se identifica con su clave de caché; los más recientes se
+# mantienen en memoria y los demás se vuelven a leer de la caché en disco.
+# Cada entrada guarda la tabla validada (None hasta que se pide), los
+# archivos subidos de los que sale y su tabla convertida para revalidar;
+# todo se olvida junto cuando el LRU la expulsa.
+
+RESULTADOS = OrderedDict()  # result_id -> {'tabla', 'origen', 'convertida'}
+resultados_lock = threading.Lock()
+
+FORMATOS_RESULTADO = ('records', 'columnar')
+
+
+def registrar_resultado(result_id, tabla=None, origen=None):
+    """Guardar en memoria la tabla validada y/o el origen de un resultado (LRU acotado)
+
+    `origen` son los nombres de los archivos subidos que lo originaron. Con
+    el resultado expulsado se olvidan también sus descargas registradas.
+    """
+    expulsados = set()
+    with resultados_lock:
+        entrada = RESULTADOS.setdefault(result_id, {'tabla': None, 'origen': None, 'convertida': None})
+        if tabla is not None:
+            entrada['tabla'] = tabla
+        if origen is not None:
+            entrada['origen'] = tuple(origen)
+        RESULTADOS.move_to_end(result_id)
+        while len(RESULTADOS) > current_app.config['RESULTS_IN_MEMORY']:
+            expulsados.add(RESULTADOS.popitem(last=False)[0])
+    
+    if expulsados:
+        olvidar_descargas(expulsados)
+
+
+def obtener_resultado(result_id):
+    """Tabla validada de un resultado, o None si no existe"""
+    with resultados_lock:
+        entrada = RESULTADOS.get(result_id)
+        if entrada is not None and entrada['tabla'] is not None:
+            RESULTADOS.move_to_end(result_id)
+            return entrada['tabla']
+    
+    if len(result_id) != 64 or any(c not in '0123456789abcdef' for c in result_id):
+        return None
+    
+    ruta = os.path.join(carpeta_cache(result_id), ARCHIVO_CACHE_TABLA)
+    try:
+        tabla = cargar_tabla(ruta)
+    except (OSError, ValueError, KeyError):
+        return None
+    
+    registrar_resultado(result_id, tabla)
+    return tabla
+
+
+def filtrar_resultado(tabla, estaciones=None, fecha_inicio=None, fecha_fin=None):
+    """Posiciones de las filas que cumplen los filtros de estación y fechas
+
+    Las fechas se comparan como texto con el prefijo de DATE, así
+    '2024-01-31' incluye todas las horas de ese día.
+    """
+    import numpy as np
+    
+    mask = np.ones(len(tabla), dtype=bool)
+    fechas = tabla.claves['DATE']
+    
+    if estaciones:
+        mask &= tabla.claves['STATION'].isin(estaciones).to_numpy()
+    if fecha_inicio:
+        mask &= (fechas.str[:len(fecha_inicio)] >= fecha_inicio).to_numpy()
+    if fecha_fin:
+        mask &= (fechas.str[:len(fecha_fin)] <= fecha_fin).to_numpy()
+    
+    return np.flatnonzero(mask)
+
+
+def pagina_resultado(tabla, indices, pagina=1, limite=None, columnas=None, formato='records'):
+    """Página de filas (ya filtradas) con proyección de columnas
+
+    Las columnas STATION, DATE y HOUR siempre se incluyen. En formato
+    'columnar' cada columna es una lista; en 'records', una lista de filas.
+    """
+    limite = limite or current_app.config['RESULTS_PAGE_SIZE']
+    pagina_tabla = recortar_pagina(tabla, indices, pagina, limite, columnas)
+    return formatear_pagina(pagina_tabla, pagina, limite, len(indices), formato)
+
+
+def recortar_pagina(tabla, indices, pagina, limite, columnas=None):
+    """TablaBD con las filas de una página y solo los parámetros pedidos"""
+    parametros = [p for p in tabla.parametros if columnas is None or p in columnas]
+    
+    inicio = (pagina - 1) * limite
+    pagina_tabla = tabla.tomar(indices[inicio:inicio + limite])
+    return TablaBD(
+        pagina_tabla.claves,
+        {p: pagina_tabla.valores[p] for p in parametros},
+        {p: pagina_tabla.banderas[p] for p in parametros}
+    )
+
+
+def datos_pagina(pagina, limite, total):
+    """Datos de paginación de una página de filas"""
+    return {
+        'page': pagina,
+        'limit': limite,
+        'total': total,
+        'total_pages': -(-total // limite),
+    }
+
+
+def formatear_pagina(pagina_tabla, pagina, limite, total, formato='records'):
+    """Cuerpo JSON de una página de filas ya recortada"""
+    df = pagina_tabla.a_formato_base().fillna('')
+    
+    return {
+        **datos_pagina(pagina, limite, total),
+        'columns': list(df.columns),
+        'layout': formato,
+        'data': df.to_dict(orient='list' if formato == 'columnar' else 'records'),
+    }
+
+
+# ============================================================================
+# PROMEDIOS Y SERIES PARA GRÁFICAS
+# ============================================================================
+# Productos que se calculan una vez por resultado, solo con los valores
+# numéricos válidos, y se guardan en un LRU como RESULTADOS: promedios
+# diarios, promedios móviles (PROMEDIOS_MOVILES) y completitud diaria. Cada
+# producto es una TablaBD, así se filtra y pagina igual que las filas
+# validadas. Las series para gráficas se reducen en el servidor con LTTB.
+
+AGREGADOS = OrderedDict()
+agregados_lock = threading.Lock()
+
+PRODUCTOS_AGREGADOS = ('daily', 'moving', 'completeness')
+PRODUCTOS_SERIES = ('hourly',) + PRODUCTOS_AGREGADOS
+HORAS_DIA = 24
+
+
+def minimo_horas(ventana):
+    """Horas válidas necesarias para que cuente un promedio de `ventana` horas"""
+    import numpy as np
+
+    return int(np.ceil(ventana * COMPLETITUD_MINIMA))
+
+
+def promedios_diarios(tabla):
+    """Promedio diario y completitud (% de horas válidas) por estación, día y parámetro
+
+    El día es la fecha de DATE. Un promedio diario sin COMPLETITUD_MINIMA de
+    las 24 horas válidas queda vacío. La tabla debe venir ordenada por
+    STATION y DATE. Devuelve (promedios, completitud) con claves STATION y DATE.
+    """
+    import numpy as np
+    import pandas as pd
+    
+    estaciones = tabla.claves['STATION'].to_numpy()
+    dias = tabla.claves['DATE'].str[:10].to_numpy()
+    cambios = np.flatnonzero((estaciones[1:] != estaciones[:-1]) | (dias[1:] != dias[:-1])) + 1
+    inicios = np.concatenate([[0], cambios]).astype(np.intp)
+    claves = pd.DataFrame({'STATION': estaciones[inicios], 'DATE': dias[inicios]})
+    
+    promedios, completitud, banderas = {}, {}, {}
+    minimo = minimo_horas(HORAS_DIA)
+    for param in tabla.parametros:
+        valores = tabla.valores[param]
+        validos = ~np.isnan(valores)
+        n_validos = np.add.reduceat(validos.astype(np.int64), inicios)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            promedio = np.add.reduceat(np.where(validos, valores, 0.0), inicios) / n_validos
+        promedio[n_validos < minimo] = np.nan
+        promedios[param] = promedio
+        completitud[param] = n_validos * (100.0 / HORAS_DIA)
+        banderas[param] = np.zeros(len(inicios), dtype=np.uint8)
+    
+    return (TablaBD(claves, promedios, banderas),
+            TablaBD(claves.copy(), completitud, {p: b.copy() for p, b in banderas.items()}))
+
+
+def rejilla_horaria(claves, relleno):
+    """Posición de cada fila en una serie horaria continua por estación
+
+    Las estaciones se colocan una detrás de otra, cada una desde su primera
+    hasta su última hora y precedida por `relleno` horas vacías, así una
+    ventana móvil nunca mezcla dos estaciones. Devuelve (posiciones, largo
+    total, horas esperadas por estación, código de estación de cada fila).
+    """
+    import numpy as np
+    import pandas as pd
+    
+    codigos_estacion, estaciones = pd.factorize(claves['STATION'])
+    horas = calcular_fecha_hora(claves).astype('datetime64[h]').astype(np.int64)
+    
+    primera = np.full(len(estaciones), np.iinfo(np.int64).max)
+    ultima = np.full(len(estaciones), np.iinfo(np.int64).min)
+    np.minimum.at(primera, codigos_estacion, horas)
+    np.maximum.at(ultima, codigos_estacion, horas)
+    
+    esperadas = ultima - primera + 1
+    largos = esperadas + relleno
+    desplazamientos = np.concatenate([[0], np.cumsum(largos)[:-1]]) + relleno
+    posiciones = desplazamientos[codigos_estacion] + horas - primera[codigos_estacion]
+    return posiciones, int(largos.sum()), esperadas, codigos_estacion
+
+
+def promedios_moviles(tabla):
+    """Promedio móvil de PROMEDIOS_MOVILES horas que termina en cada hora, por estación
+
+    Las horas que faltan en el archivo cuentan como no válidas; un promedio
+    sin COMPLETITUD_MINIMA de la ventana válida queda vacío. Devuelve una
+    TablaBD con las mismas claves que `tabla` y solo esos parámetros.
+    """
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+    
+    parametros = [p for p in PROMEDIOS_MOVILES if p in tabla.valores]
+    if not parametros:
+        return TablaBD(tabla.claves.copy(), {}, {})
+    
+    relleno = max(PROMEDIOS_MOVILES[p] for p in parametros) - 1
+    posiciones, largo, _, _ = rejilla_horaria(tabla.claves, relleno)
+    
+    promedios, banderas = {}, {}
+    for param in parametros:
+        ventana = PROMEDIOS_MOVILES[param]
+        serie = np.full(largo, np.nan)
+        serie[posiciones] = tabla.valores[param]
+        validos = ~np.isnan(serie)
+        
+        # Ventana k = horas [k, k + ventana); la que termina en la posición p es p - ventana + 1
+        n_validos = sliding_window_view(validos, ventana).sum(axis=1)
+        sumas = sliding_window_view(np.where(validos, serie, 0.0), ventana).sum(axis=1)
+        ventanas = posiciones - ventana + 1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            promedio = sumas[ventanas] / n_validos[ventanas]
+        promedio[n_validos[ventanas] < minimo_horas(ventana)] = np.nan
+        promedios[param] = promedio
+        banderas[param] = np.zeros(len(tabla), dtype=np.uint8)
+    
+    return TablaBD(tabla.claves.copy(), promedios, banderas)
+
+
+def completitud_periodo(tabla):
+    """% de horas válidas de cada estación y parámetro entre su primera y última hora"""
+    import numpy as np
+    import pandas as pd
+    
+    _, _, esperadas, codigos_estacion = rejilla_horaria(tabla.claves, 0)
+    estaciones = pd.unique(tabla.claves['STATION'])
+    
+    registros = []
+    for param in tabla.parametros:
+        validas = np.bincount(codigos_estacion, weights=~np.isnan(tabla.valores[param]),
+                              minlength=len(estaciones)).astype(np.int64)
+        for i, estacion in enumerate(estaciones):
+            registros.append({
+                'Estación': estacion,
+                'Contaminante': param,
+                'Horas esperadas': int(esperadas[i]),
+                'Horas válidas': int(validas[i]),
+                'Completitud (%)': round(100.0 * validas[i] / esperadas[i], 2),
+            })
+    return registros
+
+
+def estadisticas_periodo(tabla):
+    """Promedio, desviación, mínimo, cuartiles y máximo de cada estación y parámetro
+
+    Solo con los valores válidos. Los cuartiles son los de las gráficas: el
+    valor ordenado en la posición n/4 y 3n/4 (truncada); la desviación es
+    la poblacional. Las estaciones sin valores válidos de un parámetro no
+    aparecen.
+    """
+    import numpy as np
+    import pandas as pd
+    
+    codigos_estacion, estaciones = pd.factorize(tabla.claves['STATION'])
+    orden_estacion = np.argsort(codigos_estacion, kind='stable')
+    limites = np.searchsorted(codigos_estacion[orden_estacion], np.arange(len(estaciones) + 1))
+    
+    registros = []
+    for param in tabla.parametros:
+        valores = tabla.valores[param][orden_estacion]
+        for i, estacion in enumerate(estaciones):
+            serie = valores[limites[i]:limites[i + 1]]
+            serie = np.sort(serie[~np.isnan(serie)])
+            n = len(serie)
+            if n == 0:
+                continue
+            registros.append({
+                'Estación': estacion,
+                'Contaminante': param,
+                'Horas válidas': n,
+                'Promedio': round(float(serie.mean()), 4),
+                'Desviación': round(float(serie.std()), 4),
+                'Mínimo': round(float(serie[0]), 4),
+                'Q1': round(float(serie[n // 4]), 4),
+                'Mediana': round(float(np.median(serie)), 4),
+                'Q3': round(float(serie[(3 * n) // 4]), 4),
+                'Máximo': round(float(serie[-1]), 4),
+            })
+    return registros
+
+
+def calcular_agregados(tabla):
+    """Todos los productos de un resultado validado"""
+    import pandas as pd
+    
+    if not tabla.claves['STATION'].is_monotonic_increasing:
+        tabla = tabla.ordenada()
+    if len(tabla) == 0:
+        vacia = TablaBD(pd.DataFrame({'STATION': pd.Series(dtype=object), 'DATE': pd.Series(dtype=object)}),
+                        {}, {})
+        return {'daily': vacia, 'moving': TablaBD(tabla.claves.copy(), {}, {}), 'completeness': vacia.copy(),
+                'completitud_periodo': [], 'estadisticas_periodo': []}
+    
+    diarios, completitud = promedios_diarios(tabla)
+    return {
+        'daily': diarios,
+        'moving': promedios_moviles(tabla),
+        'completeness': completitud,
+        'completitud_periodo': completitud_periodo(tabla),
+        'estadisticas_periodo': estadisticas_periodo(tabla),
+    }
+
+
+def obtener_agregados(result_id):
+    """Productos de un resultado (calculados una vez), o None si el resultado no existe"""
+    clave = (result_id, json.dumps([PROMEDIOS_MOVILES, COMPLETITUD_MINIMA], sort_keys=True))
+    with agregados_lock:
+        agregados = AGREGADOS.get(clave)
+        if agregados is not None:
+            AGREGADOS.move_to_end(clave)
+            return agregados
+    
+    tabla = obtener_resultado(result_id)
+    if tabla is None:
+        return None
+    
+    with medir('etapa', 'agregados', len(tabla), len(tabla) * len(tabla.parametros)):
+        agregados = calcular_agregados(tabla)
+    
+    with agregados_lock:
+        AGREGADOS[clave] = agregados
+        while len(AGREGADOS) > current_app.config['RESULTS_IN_MEMORY']:
+            AGREGADOS.popitem(last=False)
+    return agregados
+
+
+def lttb(x, y, puntos):
+    """Posiciones elegidas por Largest-Triangle-Three-Buckets para dibujar `puntos` puntos
+
+    Se conservan el primero y el último; el resto se divide en `puntos` - 2
+    tramos y de cada uno se elige el punto que forma el triángulo de mayor
+    área con el punto elegido antes y el promedio del tramo siguiente.
+    """
+    import numpy as np
+    
+    n = len(x)
+    if puntos >= n or puntos < 3:
+        return np.arange(n)
+    
+    limites = (np.arange(puntos - 1) * ((n - 2) / (puntos - 2))).astype(np.intp) + 1
+    limites[-1] = n - 1
+    elegidos = np.empty(puntos, dtype=np.intp)
+    elegidos[0], elegidos[-1] = 0, n - 1
+    
+    # Promedio de cada tramo (el siguiente del último tramo es el último punto)
+    largos = np.diff(limites)
+    medias_x = np.append(np.add.reduceat(x[:n - 1], limites[:-1]) / largos, x[n - 1])
+    medias_y = np.append(np.add.reduceat(y[:n - 1], limites[:-1]) / largos, y[n - 1])
+    
+    anterior = 0
+    for i in range(puntos - 2):
+        inicio, fin = limites[i], limites[i + 1]
+        areas = np.abs((x[anterior] - medias_x[i + 1]) * (y[inicio:fin] - y[anterior])
+                       - (x[anterior] - x[inicio:fin]) * (medias_y[i + 1] - y[anterior]))
+        anterior = inicio + int(areas.argmax())
+        elegidos[i + 1] = anterior
+    
+    return elegidos
+
+
+def instantes(claves):
+    """Segundos desde 1970 de cada fila (DATE y HOUR, o solo DATE en tablas diarias)"""
+    import numpy as np
+    import pandas as pd
+
+    if 'HOUR' in claves:
+        fechas = calcular_fecha_hora(claves)
+    else:
+        fechas = pd.to_datetime(claves['DATE'], format='%Y-%m-%d').to_numpy()
+    return fechas.astype('datetime64[s]').astype(np.int64).astype(np.float64)
+
+
+def series_reducidas(tabla, estaciones, parametros, puntos, fecha_inicio=None, fecha_fin=None):
+    """Serie de cada estación y parámetro (solo valores válidos) reducida a `puntos` con LTTB"""
+    import numpy as np
+
+    series = []
+    for estacion in estaciones:
+        indices = filtrar_resultado(tabla, [estacion], fecha_inicio, fecha_fin)
+        if len(indices) == 0:
+            continue
+        fechas = tabla.claves['DATE'].to_numpy()[indices]
+        x = instantes(tabla.claves.iloc[indices])
+        for param in parametros:
+            y = tabla.valores[param][indices]
+            validos = np.flatnonzero(~np.isnan(y))
+            elegidos = validos[lttb(x[validos], y[validos], puntos)]
+            series.append({
+                'station': estacion,
+                'parameter': param,
+                'total': len(validos),
+                'x': fechas[elegidos].tolist(),
+                'y': y[elegidos].tolist(),
+            })
+    return series
+
+
+# ============================================================================
+# DESCARGAS (EXPORTACIÓN BAJO DEMANDA)
+# ============================================================================
+
+# Al validar solo se registran los nombres de descarga de cada formato; el
+# archivo se genera la primera vez que se pide (o al validar, si el formato
+# está en EXPORT_EAGER_FORMATS) y se guarda también en la caché. Los nombres
+# terminan con el comienzo del id del resultado, así dos resultados nunca
+# comparten descarga y un nombre que ya salió del registro (acotado como
+# RESULTADOS) se vuelve a resolver desde la memoria o la caché en disco. Los
+# resúmenes del Excel se recalculan al exportarlo.
+
+FORMATOS_EXPORTACION = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv.gz': 'application/gzip',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+DESCARGAS = OrderedDict()  # nombre -> {'result_id', 'formato', 'lock'}
+descargas_lock = threading.Lock()
+
+LONGITUD_ID_DESCARGA = 12  # caracteres del id del resultado en el nombre de descarga
+
+
+def nombres_descarga(filename, result_id):
+    """Nombre del archivo de descarga de cada formato para un archivo subido y su resultado"""
+    base = f"validado_{os.path.splitext(filename)[0]}_{result_id[:LONGITUD_ID_DESCARGA]}"
+    return {formato: f"{base}.{formato}" for formato in FORMATOS_EXPORTACION}
+
+
+def anotar_descarga(nombre, result_id, formato):
+    """Entrada del registro de descargas para `nombre` (LRU acotado; con descargas_lock)"""
+    info = DESCARGAS.get(nombre)
+    if info is None:
+        info = DESCARGAS[nombre] = {'result_id': result_id, 'formato': formato, 'lock': threading.Lock()}
+    DESCARGAS.move_to_end(nombre)
+    while len(DESCARGAS) > current_app.config['RESULTS_IN_MEMORY'] * len(FORMATOS_EXPORTACION):
+        DESCARGAS.popitem(last=False)
+    return info
+
+
+def registrar_descargas(result_id, filename):
+    """Registrar las descargas de un resultado sin generarlas todavía"""
+    nombres = nombres_descarga(filename, result_id)
+    
+    with descargas_lock:
+        for formato, nombre in nombres.items():
+            anotar_descarga(nombre, result_id, formato)
+    
+    return nombres
+
+
+def olvidar_descargas(result_ids):
+    """Sacar del registro las descargas de resultados que ya no están en memoria"""
+    with descargas_lock:
+        for nombre in [n for n, info in DESCARGAS.items() if info['result_id'] in result_ids]:
+            del DESCARGAS[nombre]
+
+
+def resultado_de_descarga(nombre):
+    """(result_id, formato) de un nombre de descarga fuera del registro, o None
+
+    El id se busca por su comienzo entre los resultados en memoria y las
+    entradas de la caché en disco; solo vale si hay uno solo.
+    """
+    formato = next((f for f in FORMATOS_EXPORTACION if nombre.endswith(f'.{f}')), None)
+    if formato is None:
+        return None
+    prefijo = nombre[:-len(formato) - 1].rsplit('_', 1)[-1]
+    if len(prefijo) != LONGITUD_ID_DESCARGA or any(c not in '0123456789abcdef' for c in prefijo):
+        return None
+    
+    with resultados_lock:
+        candidatos = {result_id for result_id in RESULTADOS if result_id.startswith(prefijo)}
+    carpeta = current_app.config['RESULT_CACHE_FOLDER']
+    if not candidatos and os.path.isdir(carpeta):
+        candidatos = {entrada.name for entrada in os.scandir(carpeta)
+                      if entrada.is_dir() and entrada.name.startswith(prefijo)}
+    
+    return (candidatos.pop(), formato) if len(candidatos) == 1 else None
+
+
+def generar_descarga(nombre, resumenes=None):
+    """Ruta del archivo de descarga, generándolo si hace falta (None si no se puede)
+
+    `resumenes` evita recalcularlos cuando el Excel se exporta al validar.
+    """
+    with descargas_lock:
+        info = DESCARGAS.get(nombre)
+        if info is not None:
+            DESCARGAS.move_to_end(nombre)
+    if info is None:
+        encontrado = resultado_de_descarga(nombre)
+        if encontrado is None:
+            return None
+        with descargas_lock:
+            info = anotar_descarga(nombre, *encontrado)
+    
+    ruta = os.path.join(current_app.config['UPLOAD_FOLDER'], nombre)
+    result_id, formato = info['result_id'], info['formato']
+    
+    with info['lock']:
+        if os.path.exists(ruta):
+            return ruta
+        
+        en_cache = archivo_exportado_cache(result_id, formato)
+        if os.path.exists(en_cache):
+            publicar_archivo(en_cache, ruta)
+            return ruta
+        
+        tabla = obtener_resultado(result_id)
+        if tabla is None:
+            return None
+        
+        # Se escribe en un temporal propio para no servir nunca un archivo a medias
+        tabla_export = aplicar_decimales(tabla)
+        temporal = f"{ruta}.{uuid.uuid4().hex[:8]}.tmp"
+        if formato == 'xlsx':
+            resumenes = resumenes or crear_resumen_validacion(tabla_export)
+            exportado = exportar_resultados(tabla_export, resumenes, temporal)[0] is not None
+        elif formato == 'csv.gz':
+            exportado = exportar_csv_gz(tabla_export, temporal)
+        else:
+            exportado = exportar_parquet(tabla_export, temporal)
+        
+        if not exportado:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            return None
+        
+        os.replace(temporal, ruta)
+        agregar_archivo_cache(result_id, formato, ruta)
+    
+    return ruta
+
+
+def tipo_mime(nombre):
+    for formato, mime in FORMATOS_EXPORTACION.items():
+        if nombre.endswith(f'.{formato}'):
+            return mime
+    return FORMATOS_EXPORTACION['xlsx']
+
+
+# ============================================================================
+# ALMACENAMIENTO DE ARCHIVOS SUBIDOS
+# ============================================================================
+
+# Los archivos subidos se guardan calculando su SHA-256 mientras se escriben;
+# si el contenido ya estaba subido, el nombre nuevo es un enlace duro al
+# archivo existente. Los archivos de UPLOAD_FOLDER (subidos y validados) se
+# cuentan una vez por contenido y se borran por TTL y, al superar
+# STORAGE_MAX_BYTES, los menos usados primero. El último uso es la fecha de
+# modificación, que se actualiza al validar o descargar. Las descargas
+# borradas se vuelven a generar desde la caché o el resultado en memoria.
+
+HASHES_SUBIDOS = {}  # sha256 -> nombre de un archivo subido con ese contenido
+SHA_POR_SUBIDO = {}  # nombre -> sha256 (índice inverso de HASHES_SUBIDOS)
+HUELLAS_SUBIDAS = {}  # (dispositivo, inodo) -> (sha256, tamaño), para no volver a leer el archivo
+ESTADISTICAS_ALMACEN = {'subidos': 0, 'duplicados': 0, 'bytes_ahorrados': 0, 'expulsados': 0, 'bytes_expulsados': 0}
+almacen_lock = threading.Lock()
+
+
+def guardar_subida(archivo, nombre, tamano_bloque=1024 * 1024):
+    """Guardar un archivo subido en UPLOAD_FOLDER calculando su SHA-256 al escribirlo
+
+    Si ya hay un archivo subido con el mismo contenido se enlaza a él en vez
+    de conservar una segunda copia. Devuelve (nombre final, sha256, duplicado).
+    """
+    carpeta = current_app.config['UPLOAD_FOLDER']
+    h = hashlib.sha256()
+    tamano = 0
+    
+    os.makedirs(carpeta, exist_ok=True)
+    descriptor, temporal = tempfile.mkstemp(dir=carpeta, prefix='.subida_')
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            for bloque in iter(lambda: archivo.stream.read(tamano_bloque), b''):
+                h.update(bloque)
+                f.write(bloque)
+                tamano += len(bloque)
+    except BaseException:
+        os.remove(temporal)
+        raise
+    sha = h.hexdigest()
+    
+    with almacen_lock:
+        ESTADISTICAS_ALMACEN['subidos'] += 1
+        base, extension = os.path.splitext(nombre)
+        destino = os.path.join(carpeta, nombre)
+        intento = 1
+        while os.path.exists(destino) and huella_subida(destino) != sha:
+            intento += 1
+            nombre = f"{base}_{intento}{extension}"
+            destino = os.path.join(carpeta, nombre)
+        
+        existente = HASHES_SUBIDOS.get(sha)
+        existente = os.path.join(carpeta, existente) if existente else None
+        duplicado = existente is not None and os.path.exists(existente)
+        
+        if os.path.exists(destino):
+            os.remove(temporal)
+        elif duplicado:
+            os.remove(temporal)
+            publicar_archivo(existente, destino)
+        else:
+            os.replace(temporal, destino)
+            HASHES_SUBIDOS[sha] = nombre
+            SHA_POR_SUBIDO[nombre] = sha
+        
+        if duplicado:
+            ESTADISTICAS_ALMACEN['duplicados'] += 1
+            ESTADISTICAS_ALMACEN['bytes_ahorrados'] += tamano
+        info = os.stat(destino)
+        HUELLAS_SUBIDAS[(info.st_dev, info.st_ino)] = (sha, info.st_size)
+    
+    marcar_uso(destino)
+    return nombre, sha, duplicado
+
+
+def huella_subida(ruta):
+    """SHA-256 de un archivo guardado con guardar_subida (None si no se conoce)"""
+    try:
+        info = os.stat(ruta)
+    except OSError:
+        return None
+    huella = HUELLAS_SUBIDAS.get((info.st_dev, info.st_ino))
+    if huella is None or huella[1] != info.st_size:
+        return None
+    return huella[0]
+
+
+def marcar_uso(ruta):
+    """Registrar el uso de un archivo (su fecha de modificación) para la expulsión LRU/TTL"""
+    try:
+        os.utime(ruta)
+    except OSError:
+        pass
+
+
+def archivos_almacen():
+    """Archivos de UPLOAD_FOLDER agrupados por contenido (inodo)
+
+    Devuelve una lista de grupos con sus nombres, tamaño, último uso y tipo
+    ('subido' o 'validado'). Se omiten carpetas y temporales.
+    """
+    carpeta = current_app.config['UPLOAD_FOLDER']
+    grupos = {}
+    if not os.path.isdir(carpeta):
+        return []
+    
+    for entrada in os.scandir(carpeta):
+        if not entrada.is_file(follow_symlinks=False) or entrada.name.startswith('.') \
+                or entrada.name.endswith('.tmp'):
+            continue
+        try:
+            info = entrada.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        grupo = grupos.setdefault((info.st_dev, info.st_ino), {
+            'inodo': (info.st_dev, info.st_ino),
+            'nombres': [],
+            'bytes': info.st_size,
+            'usado': info.st_mtime,
+            'tipo': 'validado' if entrada.name.startswith('validado_') else 'subido',
+        })
+        grupo['nombres'].append(entrada.name)
+    
+    return list(grupos.values())
+
+
+def nombres_en_uso():
+    """Archivos subidos que usa algún trabajo en cola o en proceso"""
+    with trabajos_lock:
+        return {nombre for trabajo in TRABAJOS.values() if trabajo['estado'] in ('en_cola', 'procesando')
+                for nombre in trabajo['archivos']}
+
+
+def liberar_almacen(protegidos=()):
+    """Borrar archivos vencidos (TTL) y, si se supera la cuota, los menos usados
+
+    Nunca se borran los `protegidos` ni los archivos de trabajos pendientes.
+    Un archivo que otro proceso o hilo ya borró se salta.
+    """
+    protegidos = set(protegidos) | nombres_en_uso()
+    limite_uso = time.time() - current_app.config['STORAGE_TTL_SECONDS']
+    carpeta = current_app.config['UPLOAD_FOLDER']
+    
+    with almacen_lock:
+        grupos = sorted(archivos_almacen(), key=lambda g: g['usado'])
+        total = sum(g['bytes'] for g in grupos)
+        
+        for grupo in grupos:
+            if grupo['usado'] >= limite_uso and total <= current_app.config['STORAGE_MAX_BYTES']:
+                break
+            if protegidos.intersection(grupo['nombres']):
+                continue
+            
+            borrados = 0
+            for nombre in grupo['nombres']:
+                try:
+                    os.remove(os.path.join(carpeta, nombre))
+                    borrados += 1
+                except FileNotFoundError:
+                    pass
+                sha = SHA_POR_SUBIDO.pop(nombre, None)
+                if sha is not None and HASHES_SUBIDOS.get(sha) == nombre:
+                    del HASHES_SUBIDOS[sha]
+            
+            huella = HUELLAS_SUBIDAS.pop(grupo['inodo'], None)
+            if huella is not None:
+                borrar_tablas_convertidas(carpeta, huella[0])
+            
+            total -= grupo['bytes']
+            if borrados:
+                ESTADISTICAS_ALMACEN['expulsados'] += borrados
+                ESTADISTICAS_ALMACEN['bytes_expulsados'] += grupo['bytes']
+
+
+def estado_almacen():
+    """Uso de disco de UPLOAD_FOLDER y contadores del almacenamiento"""
+    with almacen_lock:
+        grupos = archivos_almacen()
+        estadisticas = dict(ESTADISTICAS_ALMACEN)
+    
+    por_tipo = {tipo: {'archivos': sum(len(g['nombres']) for g in grupos if g['tipo'] == tipo),
+                       'bytes': sum(g['bytes'] for g in grupos if g['tipo'] == tipo)}
+                for tipo in ('subido', 'validado')}
+    
+    return {
+        **estadisticas,
+        'archivos': sum(len(g['nombres']) for g in grupos),
+        'contenidos_distintos': len(grupos),
+        'bytes': sum(g['bytes'] for g in grupos),
+        'max_bytes': current_app.config['STORAGE_MAX_BYTES'],
+        'ttl_segundos': current_app.config['STORAGE_TTL_SECONDS'],
+        'por_tipo': por_tipo,
+        'tablas_convertidas': estado_tablas_convertidas(),
+    }
+
+
+# ============================================================================
+# TABLAS CONVERTIDAS (ARROW IPC)
+# ============================================================================
+# La tabla BD convertida de cada archivo se guarda en un archivo Arrow IPC
+# (Feather v2, sin comprimir) en la carpeta oculta .convertidas junto al
+# archivo. El nombre combina el contenido del archivo, su extensión y la
+# huella de los mapeos de conversión: cambiar los rangos u otras reglas no
+# la invalida, cambiar un mapeo sí. Se lee con memory-map: los valores y
+# banderas son vistas del archivo sin copiar. Para validar en sitio el mapa
+# es copy-on-write (mmap.ACCESS_COPY): solo las páginas que las reglas
+# modifican se copian a memoria privada, el archivo no cambia.
+
+CARPETA_CONVERTIDAS = '.convertidas'
+VERSION_TABLA_CONVERTIDA = 1
+
+ESTADISTICAS_CONVERTIDAS = {'aciertos': 0, 'fallos': 0, 'guardadas': 0}
+
+
+def huella_conversion():
+    """Hash de los mapeos y constantes que definen la conversión ENVISTA → BD"""
+    configuracion = {
+        'version': VERSION_TABLA_CONVERTIDA,
+        'estaciones': MAPEO_ESTACIONES,
+        'parametros': MAPEO_PARAMETROS,
+        'banderas': MAPEO_BANDERAS_ENVISTA,
+        'codigos': list(BANDERAS),
+        'valores_na': sorted(VALORES_NA_ENVISTA),
+        'columnas': COLUMNAS_BD,
+    }
+    texto = json.dumps(configuracion, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+
+def ruta_tabla_convertida(ruta):
+    """Archivo Arrow IPC de la tabla convertida de `ruta` con los mapeos actuales"""
+    sha = huella_subida(ruta) or hash_archivo(ruta)
+    extension = os.path.splitext(ruta)[1].lower().lstrip('.')
+    carpeta = os.path.join(os.path.dirname(os.path.abspath(ruta)), CARPETA_CONVERTIDAS)
+    return os.path.join(carpeta, f'{sha}_{extension}_{huella_conversion()[:16]}.arrow')
+
+
+def guardar_tabla_convertida(tabla, ruta_arrow):
+    """Escribir la tabla en Arrow IPC (un solo lote) y borrar las de mapeos anteriores
+
+    STATION y DATE se guardan como diccionario; cada parámetro, como valor
+    float64 (NaN incluido, sin máscara de nulos) y código de bandera uint8.
+    """
+    import numpy as np
+    
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return False
+    
+    columnas = {
+        'STATION': pa.array(tabla.claves['STATION'].to_numpy(dtype=object), pa.string()).dictionary_encode(),
+        'DATE': pa.array(tabla.claves['DATE'].to_numpy(dtype=object), pa.string()).dictionary_encode(),
+        'HOUR': pa.array(tabla.claves['HOUR'].to_numpy(dtype=np.int64)),
+    }
+    for param in tabla.parametros:
+        columnas[param] = pa.array(tabla.valores[param])
+        columnas[f'{param}_BANDERA'] = pa.array(tabla.banderas[param])
+    tabla_arrow = pa.table(columnas)
+    
+    carpeta = os.path.dirname(ruta_arrow)
+    temporal = None
+    try:
+        os.makedirs(carpeta, exist_ok=True)
+        descriptor, temporal = tempfile.mkstemp(dir=carpeta, suffix='.tmp')
+        os.close(descriptor)
+        with pa.OSFile(temporal, 'wb') as destino:
+            with pa.ipc.new_file(destino, tabla_arrow.schema) as writer:
+                writer.write_table(tabla_arrow, max_chunksize=max(len(tabla_arrow), 1))
+        os.replace(temporal, ruta_arrow)
+    except OSError as e:
+        print(f"Error al guardar la tabla convertida: {e}")
+        if temporal is not None and os.path.exists(temporal):
+            os.remove(temporal)
+        return False
+    
+    # Las del mismo archivo con otra huella de conversión ya no sirven
+    prefijo = os.path.basename(ruta_arrow).rsplit('_', 1)[0] + '_'
+    for entrada in os.scandir(carpeta):
+        if entrada.name.startswith(prefijo) and entrada.path != ruta_arrow:
+            try:
+                os.remove(entrada.path)
+            except FileNotFoundError:
+                pass
+    
+    with almacen_lock:
+        ESTADISTICAS_CONVERTIDAS['guardadas'] += 1
+    return True
+
+
+def leer_tabla_convertida(ruta_arrow, escribible=False):
+    """Cargar con memory-map una tabla guardada con guardar_tabla_convertida
+
+    Los valores y banderas son vistas de solo lectura del archivo mapeado;
+    con `escribible` el mapa es copy-on-write y las vistas se pueden validar
+    en sitio sin copiar las columnas que no cambian.
+    """
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+    
+    if escribible:
+        with open(ruta_arrow, 'rb') as archivo:
+            mapa = mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_COPY)
+        base = np.frombuffer(mapa, dtype=np.uint8)
+        inicio, fin = base.ctypes.data, base.ctypes.data + len(base)
+        tabla_arrow = pa.ipc.open_file(pa.BufferReader(pa.py_buffer(mapa))).read_all()
+    else:
+        tabla_arrow = pa.ipc.open_file(pa.memory_map(ruta_arrow, 'r')).read_all()
+    
+    def columna(nombre):
+        columna_arrow = tabla_arrow.column(nombre)
+        return columna_arrow.chunk(0) if columna_arrow.num_chunks == 1 else columna_arrow.combine_chunks()
+    
+    def decodificar(nombre):
+        diccionario = columna(nombre)
+        return diccionario.dictionary.to_numpy(zero_copy_only=False)[diccionario.indices.to_numpy()]
+    
+    def arreglo(nombre):
+        vista = columna(nombre).to_numpy()
+        if not escribible:
+            return vista
+        posicion = vista.ctypes.data
+        if len(vista) == 0 or not inicio <= posicion < fin:
+            return vista.copy()
+        # La misma región, pero vista desde el mapa copy-on-write (escribible)
+        return np.frombuffer(mapa, dtype=vista.dtype, count=len(vista), offset=posicion - inicio)
+    
+    claves = pd.DataFrame({
+        'STATION': decodificar('STATION'),
+        'DATE': decodificar('DATE'),
+        'HOUR': columna('HOUR').to_numpy(),
+    })
+    parametros = [nombre for nombre in tabla_arrow.column_names
+                  if nombre not in ('STATION', 'DATE', 'HOUR') and not nombre.endswith('_BANDERA')]
+    
+    valores = {param: arreglo(param) for param in parametros}
+    banderas = {param: arreglo(f'{param}_BANDERA') for param in parametros}
+    
+    return TablaBD(claves, valores, banderas)
+
+
+def cargar_tabla_convertida(ruta_arrow):
+    """Tabla convertida guardada (escribible), o None si no existe o no se puede leer"""
+    if not os.path.exists(ruta_arrow):
+        with almacen_lock:
+            ESTADISTICAS_CONVERTIDAS['fallos'] += 1
+        return None
+    try:
+        tabla = leer_tabla_convertida(ruta_arrow, escribible=True)
+    except Exception as e:
+        print(f"Error al leer la tabla convertida: {e}")
+        with almacen_lock:
+            ESTADISTICAS_CONVERTIDAS['fallos'] += 1
+        return None
+    
+    with almacen_lock:
+        ESTADISTICAS_CONVERTIDAS['aciertos'] += 1
+    return tabla
+
+
+def borrar_tablas_convertidas(carpeta, sha):
+    """Borrar las tablas convertidas de un contenido (al expulsar el archivo subido)"""
+    carpeta = os.path.join(carpeta, CARPETA_CONVERTIDAS)
+    if not os.path.isdir(carpeta):
+        return
+    for entrada in os.scandir(carpeta):
+        if entrada.name.startswith(f'{sha}_'):
+            try:
+                os.remove(entrada.path)
+            except FileNotFoundError:
+                pass
+
+
+def estado_tablas_convertidas():
+    """Archivos y bytes de las tablas convertidas de UPLOAD_FOLDER y sus contadores"""
+    carpeta = os.path.join(current_app.config['UPLOAD_FOLDER'], CARPETA_CONVERTIDAS)
+    tamanos = [entrada.stat().st_size for entrada in os.scandir(carpeta)
+               if entrada.name.endswith('.arrow')] if os.path.isdir(carpeta) else []
+    return {**ESTADISTICAS_CONVERTIDAS, 'archivos': len(tamanos), 'bytes': sum(tamanos)}
+
+
+# ============================================================================
+# TRABAJOS DE VALIDACIÓN ASÍNCRONA
+# ============================================================================
+
+ETAPAS_VALIDACION = ['carga', 'conversion', 'validacion', 'resumen', 'exportacion']
+
+TRABAJOS = {}
+trabajos_lock = threading.Lock()
+ejecutor_trabajos = None
+
+
+def obtener_ejecutor_trabajos():
+    """Pool de hilos acotado (VALIDATION_WORKERS) creado en el primer uso"""
+    global ejecutor_trabajos
+    with trabajos_lock:
+        if ejecutor_trabajos is None:
+            ejecutor_trabajos = ThreadPoolExecutor(
+                max_workers=current_app.config['VALIDATION_WORKERS'],
+                thread_name_prefix='validacion'
+            )
+        return ejecutor_trabajos
+
+
+def en_contexto(funcion):
+    """`funcion` envuelta para ejecutarse en otro hilo con el contexto de la aplicación actual"""
+    aplicacion = current_app._get_current_object()
+    
+    def ejecutar(*args, **kwargs):
+        with aplicacion.app_context():
+            return funcion(*args, **kwargs)
+    
+    return ejecutar
+
+
+def crear_trabajo(filename, archivos=None):
+    """Registrar un trabajo nuevo en cola y devolver su id
+
+    `archivos` son los archivos subidos que usa (por defecto, `filename`).
+    """
+    trabajo_id = uuid.uuid4().hex
+    ahora = datetime.now().isoformat()
+    
+    with trabajos_lock:
+        TRABAJOS[trabajo_id] = {
+            'id': trabajo_id,
+            'filename': filename,
+            'archivos': list(archivos or [filename]),
+            'estado': 'en_cola',
+            'etapa_actual': None,
+            'etapas': {etapa: {'estado': 'pendiente', 'inicio': None, 'fin': None}
+                       for etapa in ETAPAS_VALIDACION},
+            'filas_leidas': 0,
+            'progreso': 0,
+            'creado': ahora,
+            'actualizado': ahora,
+            'terminado_en': None,
+            'error': None,
+            'resultado': None,
+            'codigo_http': None,
+            'tiempos': [],
+            'perfil': None,
+        }
+    
+    return trabajo_id
+
+
+def actualizar_trabajo(trabajo_id, **cambios):
+    """Actualizar campos de un trabajo (seguro entre hilos)"""
+    with trabajos_lock:
+        trabajo = TRABAJOS.get(trabajo_id)
+        if trabajo is None:
+            return
+        trabajo.update(cambios)
+        trabajo['actualizado'] = datetime.now().isoformat()
+
+
+def marcar_etapa(trabajo_id, etapa, estado):
+    """Marcar una etapa como 'en_curso' o 'completada' y recalcular el progreso"""
+    ahora = datetime.now().isoformat()
+    
+    with trabajos_lock:
+        trabajo = TRABAJOS.get(trabajo_id)
+        if trabajo is None:
+            return
+        info = trabajo['etapas'][etapa]
+        info['estado'] = estado
+        if estado == 'en_curso':
+            info['inicio'] = ahora
+            trabajo['etapa_actual'] = etapa
+        else:
+            info['fin'] = ahora
+        completadas = sum(1 for e in trabajo['etapas'].values() if e['estado'] == 'completada')
+        trabajo['progreso'] = round(100 * completadas / len(ETAPAS_VALIDACION))
+        trabajo['actualizado'] = ahora
+
+
+def vista_trabajo(trabajo):
+    """Estado público de un trabajo (sin el resultado completo)"""
+    return {clave: valor for clave, valor in trabajo.items() if clave not in ('resultado', 'codigo_http')}
+
+
+def limpiar_trabajos_vencidos():
+    """Olvidar trabajos terminados hace más de JOB_TTL_SECONDS"""
+    limite = datetime.now().timestamp() - current_app.config['JOB_TTL_SECONDS']
+    
+    with trabajos_lock:
+        vencidos = [trabajo_id for trabajo_id, trabajo in TRABAJOS.items()
+                    if trabajo['terminado_en'] is not None
+                    and datetime.fromisoformat(trabajo['terminado_en']).timestamp() < limite]
+        for trabajo_id in vencidos:
+            del TRABAJOS[trabajo_id]
+
+
+def ejecutar_validacion_completa(filename, carpeta, trabajo_id=None, archivos_lote=None):
+    """Pipeline completo de validación: carga, conversión, validación, resumen y exportación
+
+    Devuelve (cuerpo de la respuesta, código HTTP). Si se indica un trabajo,
+    va reportando el avance de cada etapa. Con `archivos_lote` (nombres de
+    archivos subidos) se leen todos en paralelo, se unen sin horas repetidas
+    y se validan juntos; `filename` es entonces solo el nombre de las
+    descargas.
+    """
+    def etapa(nombre, estado):
+        if trabajo_id is not None:
+            marcar_etapa(trabajo_id, nombre, estado)
+    
+    def al_leer_bloque(filas_leidas):
+        if trabajo_id is not None:
+            actualizar_trabajo(trabajo_id, filas_leidas=filas_leidas)
+    
+    def al_leer_archivo(i, tabla):
+        filas_archivos[i] = len(tabla) if tabla is not None else None
+        al_leer_bloque(sum(filas or 0 for filas in filas_archivos))
+    
+    rutas = [os.path.join(carpeta, nombre) for nombre in (archivos_lote or [filename])]
+    
+    # 0. Resultado ya calculado para el mismo contenido y configuración
+    with medir('etapa', 'cache'):
+        clave = clave_cache_lote(rutas) if archivos_lote else clave_cache(rutas[0])
+        respuesta_cache = buscar_en_cache(clave)
+    registrar_resultado(clave, origen=archivos_lote or [filename])
+    if respuesta_cache is not None:
+        for nombre in ETAPAS_VALIDACION:
+            etapa(nombre, 'en_curso')
+            etapa(nombre, 'completada')
+        return respuesta_desde_cache(clave, filename, respuesta_cache), 200
+    
+    # 1-2. Cargar datos ENVISTA por bloques y convertir a formato base
+    # (cada bloque se convierte al leerlo, por eso la carga incluye la conversión;
+    # en un lote la conversión es la unión de los archivos)
+    etapa('carga', 'en_curso')
+    with medir('etapa', 'carga') as medicion:
+        if archivos_lote:
+            filas_archivos = [None] * len(rutas)
+            tablas = leer_archivos_lote(rutas, current_app.config['BATCH_PARSE_PROCESSES'], al_leer_archivo)
+            fallidos = [nombre for nombre, tabla in zip(archivos_lote, tablas) if tabla is None]
+            if fallidos:
+                return {'error': f"No se pudieron cargar los datos de: {', '.join(fallidos)}"}, 400
+            medicion['filas'] = sum(filas_archivos)
+        else:
+            tabla_convertida = cargar_tabla_bd(rutas[0], al_leer_bloque=al_leer_bloque)
+            if tabla_convertida is None:
+                return {'error': 'No se pudieron cargar los datos del archivo'}, 400
+            medicion['filas'] = len(tabla_convertida)
+        medicion['celdas'] = medicion['filas'] * len(COLUMNAS_BD[3:])
+    etapa('carga', 'completada')
+    
+    etapa('conversion', 'en_curso')
+    if archivos_lote:
+        with medir('etapa', 'union_lote', medicion['filas'], medicion['celdas']):
+            tabla_convertida, filas_duplicadas = unir_tablas_lote(tablas)
+        del tablas
+    if len(tabla_convertida) == 0:
+        return {'error': 'No se pudieron convertir los datos'}, 400
+    etapa('conversion', 'completada')
+    
+    filas = len(tabla_convertida)
+    celdas = filas * len(tabla_convertida.parametros)
+    
+    # 3. Aplicar TODAS las validaciones
+    etapa('validacion', 'en_curso')
+    with medir('etapa', 'validacion', filas, celdas):
+        tabla_validada = validar_datos_completo(tabla_convertida, procesos=current_app.config['VALIDATION_PROCESSES'],
+                                                en_sitio=True)
+    etapa('validacion', 'completada')
+    
+    lote = None
+    if archivos_lote:
+        lote = {
+            'archivos': [{'filename': nombre, 'filas': filas}
+                         for nombre, filas in zip(archivos_lote, filas_archivos)],
+            'filas_duplicadas': filas_duplicadas,
+        }
+    
+    return completar_validacion(clave, filename, carpeta, tabla_validada, etapa, lote), 200
+
+
+def exportar_formatos_inmediatos(archivos, resumenes=None):
+    """Generar ya las descargas de EXPORT_EAGER_FORMATS"""
+    for formato in current_app.config['EXPORT_EAGER_FORMATS']:
+        generar_descarga(archivos[formato], resumenes if formato == 'xlsx' else None)
+
+
+def respuesta_desde_cache(clave, filename, respuesta_cache):
+    """Respuesta de una validación guardada en caché, con las descargas de `filename`"""
+    archivos = registrar_descargas(clave, filename)
+    exportar_formatos_inmediatos(archivos)
+    return {**respuesta_cache, 'output_filename': archivos['xlsx'], 'output_files': archivos,
+            'desde_cache': True}
+
+
+def completar_validacion(clave, filename, carpeta, tabla_validada, etapa=lambda nombre, estado: None, lote=None):
+    """Etapas finales del pipeline sobre la tabla ya validada
+
+    Crea los resúmenes, registra el resultado y las descargas, guarda las
+    filas en el historial y la respuesta en la caché. Devuelve el cuerpo
+    de la respuesta.
+    """
+    import numpy as np
+    
+    filas = len(tabla_validada)
+    celdas = filas * len(tabla_validada.parametros)
+    
+    # 4. Crear resúmenes (una sola vez, sobre los valores con decimales del
+    # Excel; la respuesta y la exportación usan los mismos)
+    etapa('resumen', 'en_curso')
+    with medir('etapa', 'resumen', filas, celdas):
+        tabla_export = aplicar_decimales(tabla_validada)
+        resumenes = crear_resumen_validacion(tabla_export)
+    resumen_banderas, resumen_detallado, estadisticas, stats_detalladas = resumenes
+    etapa('resumen', 'completada')
+    
+    # 5. Registrar las descargas (se exportan al pedirlas, salvo EXPORT_EAGER_FORMATS)
+    # y guardar las filas en el almacén histórico
+    etapa('exportacion', 'en_curso')
+    with medir('etapa', 'exportacion', filas, celdas):
+        registrar_resultado(clave, tabla_validada)
+        guardar_en_historial_seguro(tabla_validada)
+        archivos = registrar_descargas(clave, filename)
+        exportar_formatos_inmediatos(archivos, resumenes)
+    etapa('exportacion', 'completada')
+    
+    # 6. Preparar respuesta (solo la primera página; el resto se pide a /api/results)
+    primera_pagina = pagina_resultado(tabla_validada, np.arange(len(tabla_validada)))
+    
+    response = {
+        'success': True,
+        'message': 'Validación completa realizada exitosamente',
+        'output_filename': archivos['xlsx'],
+        'output_files': archivos,
+        'result_id': clave,
+        'rows_url': f'/api/results/{clave}/rows',
+        'summary': {
+            'total_registros': len(tabla_validada),
+            'estaciones': tabla_validada.claves['STATION'].nunique(),
+            'fecha_inicio': tabla_validada.claves['DATE'].min(),
+            'fecha_fin': tabla_validada.claves['DATE'].max(),
+            'banderas': resumen_banderas.to_dict() if not resumen_banderas.empty else {},
+            'estadisticas': estadisticas.to_dict() if not estadisticas.empty else {}
+        },
+        'data_preview': primera_pagina['data'],
+        'estadisticas_detalladas': stats_detalladas.to_dict(orient='records') if not stats_detalladas.empty else [],
+        'desde_cache': False
+    }
+    if lote is not None:
+        response['lote'] = lote
+    
+    exportados = {formato: os.path.join(carpeta, nombre) for formato, nombre in archivos.items()
+                  if os.path.exists(os.path.join(carpeta, nombre))}
+    with medir('etapa', 'guardar_cache'):
+        guardar_en_cache(clave, response, tabla_validada, exportados)
+    
+    return response
+
+
+def ejecutar_trabajo_validacion(trabajo_id, filename, carpeta, archivos_lote=None):
+    """Cuerpo del hilo trabajador: ejecutar el pipeline y guardar el resultado"""
+    actualizar_trabajo(trabajo_id, estado='procesando')
+    iniciar_tiempos_solicitud()
+    
+    with perfilar(f'validacion_{trabajo_id}') as ruta_perfil:
+        try:
+            with medir('etapa', 'total'):
+                resultado, codigo = ejecutar_validacion_completa(filename, carpeta, trabajo_id, archivos_lote)
+        except Exception as e:
+            resultado, codigo = {'error': f'Error durante la validación: {str(e)}'}, 500
+    
+    terminar_trabajo(trabajo_id, resultado, codigo, ruta_perfil)
+
+
+def terminar_trabajo(trabajo_id, resultado, codigo, ruta_perfil=None):
+    """Guardar el resultado de un trabajo y los tiempos medidos en su hilo"""
+    actualizar_trabajo(
+        trabajo_id,
+        estado='completado' if codigo == 200 else 'error',
+        etapa_actual=None,
+        error=resultado.get('error'),
+        resultado=resultado,
+        codigo_http=codigo,
+        tiempos=terminar_tiempos_solicitud(),
+        perfil=ruta_perfil,
+        terminado_en=datetime.now().isoformat()
+    )
+
+
+# ============================================================================
+# VALIDACIÓN EN FLUJO
+# ============================================================================
+# Variante de la validación completa que envía cada estación apenas termina
+# de validarse: sus filas (en trozos de STREAM_CHUNK_ROWS) y su resumen, y al
+# final el mismo cuerpo que /api/validate/full. Nunca se arma la lista
+# completa de registros; solo la tabla columnar que ya usa el pipeline.
+#
+# La validación corre como un trabajo más (en el pool de VALIDATION_WORKERS
+# y, con VALIDATION_PROCESSES > 1, con las estaciones en el pool de
+# procesos); el hilo de la solicitud solo releva los mensajes que el trabajo
+# deja en una cola acotada (STREAM_QUEUE_MESSAGES), que frena la validación
+# si el cliente lee más lento.
+
+FORMATOS_FLUJO = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream',
+}
+
+
+def rangos_estaciones(claves):
+    """(estación, inicio, fin) de cada bloque de filas de una misma estación
+
+    La tabla debe venir ordenada por STATION, así cada estación es un rango
+    contiguo y sus filas se toman como vistas, sin copiar.
+    """
+    import numpy as np
+
+    estaciones = claves['STATION'].to_numpy()
+    if len(estaciones) == 0:
+        return []
+    cambios = np.flatnonzero(estaciones[1:] != estaciones[:-1]) + 1
+    inicios = np.concatenate([[0], cambios])
+    fines = np.concatenate([cambios, [len(estaciones)]])
+    return [(estaciones[inicio], int(inicio), int(fin)) for inicio, fin in zip(inicios, fines)]
+
+
+def validar_en_flujo(filename, carpeta, trabajo_id=None):
+    """Pipeline de validación que va entregando mensajes (dicts) por estación
+
+    Mensajes, en orden: 'inicio' (estaciones y total de filas), para cada
+    estación varios 'filas' y un 'estacion' con su resumen, y al final
+    'resumen' con el cuerpo de la validación completa. Un problema con el
+    archivo se entrega como mensaje 'error'. Si se indica un trabajo, va
+    reportando sus etapas y las estaciones ya validadas.
+    """
+    def etapa(nombre, estado):
+        if trabajo_id is not None:
+            marcar_etapa(trabajo_id, nombre, estado)
+    
+    def al_leer_bloque(filas_leidas):
+        if trabajo_id is not None:
+            actualizar_trabajo(trabajo_id, filas_leidas=filas_leidas)
+    
+    ruta = os.path.join(carpeta, filename)
+    limite = current_app.config['STREAM_CHUNK_ROWS']
+    
+    with medir('etapa', 'cache'):
+        clave = clave_cache(ruta)
+        respuesta_cache = buscar_en_cache(clave)
+        tabla = obtener_resultado(clave) if respuesta_cache is not None else None
+    registrar_resultado(clave, origen=[filename])
+    
+    desde_cache = tabla is not None
+    if not desde_cache:
+        etapa('carga', 'en_curso')
+        with medir('etapa', 'carga') as medicion:
+            tabla = cargar_tabla_bd(ruta, al_leer_bloque=al_leer_bloque)
+            if tabla is not None:
+                medicion['filas'] = len(tabla)
+                medicion['celdas'] = len(tabla) * len(tabla.parametros)
+        if tabla is None:
+            yield {'tipo': 'error', 'error': 'No se pudieron cargar los datos del archivo'}
+            return
+        etapa('carga', 'completada')
+        if len(tabla) == 0:
+            yield {'tipo': 'error', 'error': 'No se pudieron convertir los datos'}
+            return
+    
+    etapa('conversion', 'en_curso')
+    if not tabla.claves['STATION'].is_monotonic_increasing:
+        tabla = tabla.ordenada()
+    estaciones = rangos_estaciones(tabla.claves)
+    reglas = compilar_reglas()
+    futuros = None
+    if not desde_cache:
+        # Antes de tomar las vistas, así cada estación escribe sus orígenes en la tabla completa
+        tabla.iniciar_origenes()
+        procesos = current_app.config['VALIDATION_PROCESSES']
+        if procesos > 1 and len(estaciones) > 1:
+            # Todas las estaciones se encargan al pool ya; se entregan en orden
+            ejecutor = obtener_ejecutor_procesos(procesos)
+            futuros = [ejecutor.submit(validar_estaciones, tabla.tomar(slice(inicio, fin)), True)
+                       for _, inicio, fin in estaciones]
+    etapa('conversion', 'completada')
+    
+    etapa('validacion', 'en_curso')
+    if trabajo_id is not None:
+        actualizar_trabajo(trabajo_id, estaciones_validadas=0, total_estaciones=len(estaciones))
+    yield {
+        'tipo': 'inicio',
+        'estaciones': [estacion for estacion, _, _ in estaciones],
+        'total_filas': len(tabla),
+        'desde_cache': desde_cache,
+    }
+    
+    for indice, (estacion, inicio, fin) in enumerate(estaciones, start=1):
+        # Las reglas escriben sobre la vista, es decir, sobre la tabla completa
+        parte = tabla.tomar(slice(inicio, fin))
+        if not desde_cache:
+            with medir('etapa', 'validacion', len(parte), len(parte) * len(parte.parametros)):
+                if futuros is None:
+                    aplicar_reglas(parte, reglas, en_sitio=True)
+                else:
+                    escribir_parte(tabla, slice(inicio, fin), futuros[indice - 1].result())
+        
+        for desde in range(0, len(parte), limite):
+            yield {
+                'tipo': 'filas',
+                'estacion': estacion,
+                'desde': inicio + desde,
+                'data': parte.tomar(slice(desde, desde + limite)).a_formato_base().fillna('').to_dict('records'),
+            }
+        
+        resumen_banderas, _, _, stats_detalladas = crear_resumen_validacion(aplicar_decimales(parte))
+        yield {
+            'tipo': 'estacion',
+            'estacion': estacion,
+            'indice': indice,
+            'total_estaciones': len(estaciones),
+            'filas': len(parte),
+            'banderas': resumen_banderas.to_dict() if not resumen_banderas.empty else {},
+            'estadisticas_detalladas': stats_detalladas.to_dict(orient='records') if not stats_detalladas.empty else [],
+        }
+        if trabajo_id is not None:
+            actualizar_trabajo(trabajo_id, estaciones_validadas=indice)
+    etapa('validacion', 'completada')
+    
+    if desde_cache:
+        for nombre in ('resumen', 'exportacion'):
+            etapa(nombre, 'en_curso')
+            etapa(nombre, 'completada')
+        respuesta = respuesta_desde_cache(clave, filename, respuesta_cache)
+    else:
+        respuesta = completar_validacion(clave, filename, carpeta, tabla, etapa)
+    yield {'tipo': 'resumen', **respuesta}
+
+
+def enviar_mensaje(cola, mensaje, cancelado):
+    """Dejar un mensaje en la cola del flujo (se descarta si el cliente ya se desconectó)"""
+    while not cancelado.is_set():
+        try:
+            cola.put(mensaje, timeout=1)
+            return
+        except queue.Full:
+            pass
+
+
+def ejecutar_trabajo_flujo(trabajo_id, filename, carpeta, cola, cancelado):
+    """Cuerpo del hilo trabajador de una validación en flujo: pasa cada mensaje a la cola
+
+    Si el cliente se desconecta la validación sigue hasta el final (el
+    resultado queda registrado y en caché); solo se dejan de enviar mensajes.
+    El fin del flujo se marca con None.
+    """
+    actualizar_trabajo(trabajo_id, estado='procesando')
+    iniciar_tiempos_solicitud()
+    resultado, codigo = {'error': 'La validación terminó sin resumen'}, 500
+    
+    with perfilar(f'flujo_{trabajo_id}') as ruta_perfil:
+        try:
+            with medir('etapa', 'total'):
+                for mensaje in validar_en_flujo(filename, carpeta, trabajo_id):
+                    if mensaje['tipo'] == 'resumen':
+                        resultado = {clave: valor for clave, valor in mensaje.items() if clave != 'tipo'}
+                        codigo = 200
+                    elif mensaje['tipo'] == 'error':
+                        resultado, codigo = {'error': mensaje['error']}, 400
+                    enviar_mensaje(cola, mensaje, cancelado)
+        except Exception as e:
+            resultado, codigo = {'error': f'Error durante la validación: {str(e)}'}, 500
+            enviar_mensaje(cola, {'tipo': 'error', **resultado}, cancelado)
+    
+    terminar_trabajo(trabajo_id, resultado, codigo, ruta_perfil)
+    enviar_mensaje(cola, None, cancelado)
+
+
+def relevar_mensajes(trabajo_id, cola, cancelado):
+    """Mensajes de un trabajo en flujo a medida que llegan a la cola
+
+    El primero ('trabajo') identifica el trabajo, que también se puede
+    consultar en /api/jobs. Al cerrarse el generador (fin del flujo o
+    cliente desconectado) se avisa al trabajo para que no espere más.
+    """
+    try:
+        yield {'tipo': 'trabajo', 'job_id': trabajo_id, 'status_url': f'/api/jobs/{trabajo_id}'}
+        while True:
+            mensaje = cola.get()
+            if mensaje is None:
+                return
+            yield mensaje
+    finally:
+        cancelado.set()
+
+
+def mensajes_flujo(mensajes, formato):
+    """Serializar los mensajes como líneas NDJSON o eventos SSE"""
+    try:
+        for mensaje in mensajes:
+            datos = current_app.json.dumps(mensaje)
+            if formato == 'sse':
+                yield f"event: {mensaje['tipo']}\ndata: {datos}\n\n"
+            else:
+                yield datos + '\n'
+    except Exception as e:
+        mensaje = {'tipo': 'error', 'error': f'Error durante la validación: {str(e)}'}
+        datos = current_app.json.dumps(mensaje)
+        yield f"event: error\ndata: {datos}\n\n" if formato == 'sse' else datos + '\n'
+
+
+# ============================================================================
+# REVALIDACIÓN CON CAMBIOS DE CONFIGURACIÓN
+# ============================================================================
+# Para probar otros límites sin tocar el código: la tabla convertida (antes
+# de validar) de cada resultado se vuelve a leer de la caché Arrow de los
+# archivos subidos, se conserva en memoria y sobre una copia se aplican las
+# reglas compiladas con los cambios. Solo se repiten la validación y el
+# conteo de banderas; nada se exporta, se guarda en caché ni en el historial.
+# El origen y la tabla convertida van en la entrada del resultado en
+# RESULTADOS y se olvidan con ella.
+
+CAMPOS_RANGO = ('min', 'max', 'limite_deteccion')
+
+
+def tabla_convertida_resultado(result_id):
+    """Tabla convertida (sin validar) de un resultado, o None si sus archivos ya no están
+
+    Se lee como en el pipeline (desde la tabla Arrow de cada archivo si
+    existe) y se guarda en la entrada del resultado mientras siga en memoria.
+    """
+    with resultados_lock:
+        entrada = RESULTADOS.get(result_id)
+        if entrada is None or entrada['origen'] is None:
+            return None
+        if entrada['convertida'] is not None:
+            return entrada['convertida']
+        nombres = entrada['origen']
+    
+    tablas = []
+    for nombre in nombres:
+        ruta = os.path.join(current_app.config['UPLOAD_FOLDER'], nombre)
+        tabla = cargar_tabla_bd(ruta) if os.path.exists(ruta) else None
+        if tabla is None:
+            return None
+        marcar_uso(ruta)
+        tablas.append(tabla)
+    tabla = unir_tablas_lote(tablas)[0] if len(tablas) > 1 else tablas[0]
+    
+    with resultados_lock:
+        if result_id in RESULTADOS:
+            RESULTADOS[result_id]['convertida'] = tabla
+    return tabla
+
+
+def es_numero(valor):
+    """True para int o float (no bool), como llegan los números en JSON"""
+    return isinstance(valor, (int, float)) and not isinstance(valor, bool)
+
+
+def reglas_con_cambios(cambios):
+    """Reglas compiladas con los cambios pedidos sobre la configuración
+
+    `cambios` puede traer 'rangos' ({parámetro: {min, max, limite_deteccion}}),
+    'temperatura_interna' ({min, max}), 'horas_constantes' y 'relaciones'
+    ({nombre: {min, max}}); lo que no se indica queda como en la
+    configuración. Devuelve (reglas, cambios aplicados) o lanza ValueError.
+    """
+    desconocidos = set(cambios) - {'rangos', 'temperatura_interna', 'horas_constantes', 'relaciones'}
+    if desconocidos:
+        raise ValueError(f"Cambios desconocidos: {', '.join(sorted(desconocidos))}")
+    
+    for seccion in ('rangos', 'temperatura_interna', 'relaciones'):
+        if not isinstance(cambios.get(seccion, {}), dict):
+            raise ValueError(f'{seccion} debe ser un objeto')
+    
+    argumentos, aplicados = {}, {}
+    
+    if cambios.get('rangos'):
+        rangos = {param: dict(config) for param, config in RANGOS.items()}
+        for param, campos in cambios['rangos'].items():
+            if param not in rangos or not isinstance(campos, dict):
+                raise ValueError(f'Rango desconocido: {param}')
+            for campo, valor in campos.items():
+                if campo not in CAMPOS_RANGO:
+                    raise ValueError(f"Campos de rango permitidos: {', '.join(CAMPOS_RANGO)}")
+                if not es_numero(valor) and not (campo == 'limite_deteccion' and valor is None):
+                    raise ValueError(f'{param}.{campo} debe ser un número')
+                rangos[param][campo] = valor
+            if rangos[param]['min'] > rangos[param]['max']:
+                raise ValueError(f'{param}: min no puede ser mayor que max')
+            aplicados.setdefault('rangos', {})[param] = rangos[param]
+        argumentos['rangos'] = rangos
+    
+    if cambios.get('temperatura_interna'):
+        temperatura = dict(TEMPERATURA_INTERNA)
+        for campo, valor in cambios['temperatura_interna'].items():
+            if campo not in ('min', 'max') or not es_numero(valor):
+                raise ValueError('temperatura_interna solo admite min y max numéricos')
+            temperatura[campo] = valor
+        if temperatura['min'] > temperatura['max']:
+            raise ValueError('temperatura_interna: min no puede ser mayor que max')
+        argumentos['temperatura_interna'] = temperatura
+        aplicados['temperatura_interna'] = {'min': temperatura['min'], 'max': temperatura['max']}
+    
+    if cambios.get('horas_constantes') is not None:
+        horas = cambios['horas_constantes']
+        if not isinstance(horas, int) or isinstance(horas, bool) or horas < 1:
+            raise ValueError('horas_constantes debe ser un entero mayor que 0')
+        argumentos['horas_constantes'] = aplicados['horas_constantes'] = horas
+    
+    if cambios.get('relaciones'):
+        relaciones = [dict(relacion) for relacion in RELACIONES]
+        por_nombre = {relacion['nombre']: relacion for relacion in relaciones}
+        for nombre, campos in cambios['relaciones'].items():
+            if nombre not in por_nombre or not isinstance(campos, dict):
+                raise ValueError(f'Relación desconocida: {nombre}')
+            for campo, valor in campos.items():
+                if campo not in ('min', 'max') or not (es_numero(valor) or (campo == 'min' and valor is None)):
+                    raise ValueError(f'{nombre} solo admite min (número o null) y max numérico')
+                por_nombre[nombre][campo] = valor
+            aplicados.setdefault('relaciones', {})[nombre] = {
+                'min': por_nombre[nombre]['min'], 'max': por_nombre[nombre]['max']
+            }
+        argumentos['relaciones'] = relaciones
+    
+    return compilar_reglas(**argumentos), aplicados
+
+
+def conteo_banderas(tabla):
+    """Matriz (parámetro x código de bandera) con la cantidad de celdas de cada bandera"""
+    import numpy as np
+
+    conteo = np.zeros((len(tabla.parametros), len(BANDERA_POR_CODIGO)), dtype=np.int64)
+    for i, param in enumerate(tabla.parametros):
+        conteo[i] = np.bincount(tabla.banderas[param], minlength=len(BANDERA_POR_CODIGO))
+    return conteo
+
+
+def diferencia_banderas(base, nueva):
+    """Cantidades de cada bandera antes y después, en total y por parámetro
+
+    Solo aparecen las banderas presentes en alguna de las dos tablas y, por
+    parámetro, las que cambiaron. 'celdas_cambiadas' cuenta las celdas cuya
+    bandera es distinta (las tablas tienen las mismas filas en el mismo orden).
+    """
+    import numpy as np
+    
+    conteo_base, conteo_nuevo = conteo_banderas(base), conteo_banderas(nueva)
+    totales_base, totales_nuevo = conteo_base.sum(axis=0), conteo_nuevo.sum(axis=0)
+    
+    banderas = {
+        BANDERA_POR_CODIGO[codigo]: {
+            'base': int(totales_base[codigo]),
+            'nuevo': int(totales_nuevo[codigo]),
+            'diferencia': int(totales_nuevo[codigo] - totales_base[codigo]),
+        }
+        for codigo in range(1, len(BANDERA_POR_CODIGO))
+        if totales_base[codigo] or totales_nuevo[codigo]
+    }
+    
+    por_parametro = [
+        {
+            'Contaminante': param,
+            'Bandera': BANDERA_POR_CODIGO[codigo],
+            'base': int(conteo_base[i, codigo]),
+            'nuevo': int(conteo_nuevo[i, codigo]),
+            'diferencia': int(conteo_nuevo[i, codigo] - conteo_base[i, codigo]),
+        }
+        for i, param in enumerate(base.parametros)
+        for codigo in np.flatnonzero(conteo_base[i] != conteo_nuevo[i])
+        if codigo != 0
+    ]
+    
+    celdas_cambiadas = sum(int(np.count_nonzero(base.banderas[p] != nueva.banderas[p])) for p in base.parametros)
+    return {'banderas': banderas, 'por_parametro': por_parametro, 'celdas_cambiadas': celdas_cambiadas}
+
+
+# ============================================================================
+# NEGOCIACIÓN DE CONTENIDO Y CACHÉ HTTP
+# ============================================================================
+# Las páginas de filas se entregan en JSON, MessagePack (mismo cuerpo) o
+# Arrow IPC según el encabezado Accept. Las respuestas JSON y de datos se
+# comprimen con brotli o gzip según Accept-Encoding, y los endpoints de datos
+# llevan un ETag fuerte del contenido: si el cliente ya tiene esa versión
+# (If-None-Match) se responde 304 sin cuerpo. msgpack y brotli son opcionales.
+
+TIPO_JSON = 'application/json'
+TIPO_MSGPACK = 'application/msgpack'
+TIPO_ARROW = 'application/vnd.apache.arrow.stream'
+
+TIPOS_COMPRIMIBLES = {TIPO_JSON, TIPO_MSGPACK, TIPO_ARROW, 'text/plain'}
+
+ENDPOINTS_CONDICIONALES = {f'{rutas.name}.{vista}' for vista in (
+    'get_config', 'get_job_result', 'get_result_rows', 'get_result_aggregates',
+    'get_result_aggregate_rows', 'get_result_series', 'get_result_provenance', 'get_history',
+)}
+
+MODULOS_OPCIONALES = {}
+
+MAX_ETIQUETAS_DESCARGA = 1024
+ETIQUETAS_DESCARGA = OrderedDict()  # (dispositivo, inodo, tamaño) -> sha256 del archivo
+etiquetas_lock = threading.Lock()
+
+
+def modulo_opcional(nombre):
+    """Módulo opcional ya importado, o None si no está instalado (se intenta una vez)"""
+    if nombre not in MODULOS_OPCIONALES:
+        try:
+            MODULOS_OPCIONALES[nombre] = importlib.import_module(nombre)
+        except ImportError:
+            MODULOS_OPCIONALES[nombre] = None
+    return MODULOS_OPCIONALES[nombre]
+
+
+def tipo_aceptado(arrow=False):
+    """Mejor tipo de respuesta según Accept entre los disponibles (JSON por defecto)"""
+    tipos = [TIPO_JSON]
+    if modulo_opcional('msgpack') is not None:
+        tipos.append(TIPO_MSGPACK)
+    if arrow and modulo_opcional('pyarrow') is not None:
+        tipos.append(TIPO_ARROW)
+    return request.accept_mimetypes.best_match(tipos, default=TIPO_JSON)
+
+
+def responder_datos(cuerpo):
+    """Respuesta con el cuerpo en JSON o MessagePack, según Accept"""
+    if tipo_aceptado() == TIPO_MSGPACK:
+        respuesta = current_app.response_class(modulo_opcional('msgpack').packb(cuerpo), mimetype=TIPO_MSGPACK)
+    else:
+        respuesta = jsonify(cuerpo)
+    respuesta.vary.add('Accept')
+    return respuesta
+
+
+def cuerpo_arrow(tabla, metadatos):
+    """Stream Arrow IPC de una TablaBD; `metadatos` va como JSON en el esquema ('pagina')"""
+    import pyarrow as pa
+    
+    tabla_arrow = tabla_a_arrow(tabla)
+    tabla_arrow = tabla_arrow.replace_schema_metadata({'pagina': json.dumps(metadatos, ensure_ascii=False)})
+    destino = pa.BufferOutputStream()
+    with pa.ipc.new_stream(destino, tabla_arrow.schema) as escritor:
+        escritor.write_table(tabla_arrow)
+    return destino.getvalue().to_pybytes()
+
+
+def responder_pagina(pagina_tabla, pagina, limite, total, formato='records', **extra):
+    """Respuesta con una página de filas en JSON, MessagePack o Arrow IPC, según Accept
+
+    En Arrow las filas van en el stream (valores como float64 y banderas
+    como texto) y el resto del cuerpo JSON, sin 'data', en los metadatos.
+    """
+    if tipo_aceptado(arrow=True) == TIPO_ARROW:
+        with medir('etapa', 'arrow', len(pagina_tabla)):
+            cuerpo = cuerpo_arrow(pagina_tabla, {**extra, **datos_pagina(pagina, limite, total)})
+        respuesta = current_app.response_class(cuerpo, mimetype=TIPO_ARROW)
+        respuesta.vary.add('Accept')
+        return respuesta
+    
+    return responder_datos({**extra, **formatear_pagina(pagina_tabla, pagina, limite, total, formato)})
+
+
+def codificacion_aceptada():
+    """brotli o gzip según Accept-Encoding (None si el cliente no acepta ninguna)"""
+    if 'Accept-Encoding' not in request.headers:
+        return None
+    disponibles = (['br'] if modulo_opcional('brotli') is not None else []) + ['gzip']
+    return request.accept_encodings.best_match(disponibles)
+
+
+def comprimir(cuerpo, codificacion):
+    """Comprimir un cuerpo con brotli o gzip al nivel COMPRESS_LEVEL"""
+    nivel = current_app.config['COMPRESS_LEVEL']
+    if codificacion == 'br':
+        return modulo_opcional('brotli').compress(cuerpo, quality=nivel)
+    return gzip.compress(cuerpo, compresslevel=nivel, mtime=0)
+
+
+def etiqueta_descarga(ruta):
+    """ETag fuerte de un archivo descargable: el SHA-256 de su contenido
+
+    Se calcula una vez por archivo (dispositivo, inodo y tamaño); la fecha
+    de modificación no sirve porque marcar_uso la cambia en cada descarga.
+    """
+    huella = huella_subida(ruta)
+    if huella is not None:
+        return huella
+    
+    info = os.stat(ruta)
+    clave = (info.st_dev, info.st_ino, info.st_size)
+    with etiquetas_lock:
+        huella = ETIQUETAS_DESCARGA.get(clave)
+        if huella is not None:
+            ETIQUETAS_DESCARGA.move_to_end(clave)
+            return huella
+    
+    huella = hash_archivo(ruta)
+    with etiquetas_lock:
+        ETIQUETAS_DESCARGA[clave] = huella
+        while len(ETIQUETAS_DESCARGA) > MAX_ETIQUETAS_DESCARGA:
+            ETIQUETAS_DESCARGA.popitem(last=False)
+    return huella
+
+
+@rutas.after_app_request
+def negociar_respuesta(respuesta):
+    """ETag y GET condicional (304) en los endpoints de datos; brotli/gzip en JSON y datos
+
+    Se omiten las respuestas en flujo, los archivos (send_file maneja su
+    propio ETag) y las que ya vienen codificadas. El ETag distingue la
+    codificación, porque cada una es una representación distinta.
+    """
+    if (request.method not in ('GET', 'HEAD') or respuesta.status_code != 200
+            or respuesta.direct_passthrough or respuesta.is_streamed
+            or 'Content-Encoding' in respuesta.headers):
+        return respuesta
+    
+    condicional = request.endpoint in ENDPOINTS_CONDICIONALES
+    comprimible = respuesta.mimetype in TIPOS_COMPRIMIBLES
+    if not condicional and not comprimible:
+        return respuesta
+    
+    cuerpo = respuesta.get_data()
+    codificacion = None
+    if comprimible and len(cuerpo) >= current_app.config['COMPRESS_MIN_BYTES']:
+        respuesta.vary.add('Accept-Encoding')
+        codificacion = codificacion_aceptada()
+    
+    if condicional:
+        etiqueta = hashlib.sha256(cuerpo).hexdigest()[:32]
+        respuesta.set_etag(f'{etiqueta}-{codificacion}' if codificacion else etiqueta)
+        respuesta.cache_control.no_cache = True
+        respuesta.make_conditional(request)
+        if respuesta.status_code == 304:
+            return respuesta
+    
+    if codificacion:
+        with medir('etapa', 'compresion'):
+            respuesta.set_data(comprimir(cuerpo, codificacion))
+        respuesta.headers['Content-Encoding'] = codificacion
+    return respuesta
+
+
+# ============================================================================
+# ENDPOINTS DE LA API
+# ============================================================================
+
+def allowed_file(filename):
+    """Verificar si el archivo tiene una extensión permitida"""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+@rutas.route('/api/health', methods=['GET'])
+def health_check():
+    """Endpoint de salud de la API"""
+    return jsonify({
+        'status': 'ok',
+        'message': 'API de Validación de Calidad del Aire funcionando',
+        'timestamp': datetime.now().isoformat(),
+        'version': '2.0.0'
+    })
+
+
+@rutas.route('/api/config', methods=['GET'])
+def get_config():
+    """Obtener configuración del validador"""
+    return jsonify({
         'estaciones': MAPEO_ESTACIONES,
         'parametros': MAPEO_PARAMETROS,
         'rangos': RANGOS,
@@ -511,7 +4286,7 @@ def get_config():
     })
 
 
-@app.route('/api/upload', methods=['POST'])
+@rutas.route('/api/upload', methods=['POST'])
 def upload_file():
     """Subir archivo ENVISTA para procesar"""
     if 'file' not in request.files:
@@ -525,98 +4300,568 @@ def upload_file():
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"{timestamp}_{filename}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        filename, sha, duplicado = guardar_subida(file, f"{timestamp}_{filename}")
+        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+        liberar_almacen(protegidos=[filename])
         
         return jsonify({
             'message': 'Archivo subido exitosamente',
             'filename': filename,
-            'filepath': filepath
+            'filepath': filepath,
+            'sha256': sha,
+            'duplicado': duplicado
         })
     
-    return jsonify({'error': 'Tipo de archivo no permitido. Use .xlsx o .xls'}), 400
+    return jsonify({'error': 'Tipo de archivo no permitido. Use .xlsx, .xls, .csv, .parquet o .arrow'}), 400
 
 
-@app.route('/api/validate/full', methods=['POST'])
+@rutas.route('/api/validate/full', methods=['POST'])
 def validate_full():
-    """Validación completa de datos"""
+    """Validación completa de datos (asíncrona: devuelve el id del trabajo)"""
+    data = request.get_json()
+    
+    if not data or 'filename' not in data:
+        return jsonify({'error': 'Se requiere el nombre del archivo'}), 400
+    
+    filename = data['filename']
+    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+    
+    if not os.path.exists(filepath):
+        return jsonify({'error': 'Archivo no encontrado'}), 404
+    
+    marcar_uso(filepath)
+    limpiar_trabajos_vencidos()
+    trabajo_id = crear_trabajo(filename)
+    obtener_ejecutor_trabajos().submit(
+        en_contexto(ejecutar_trabajo_validacion), trabajo_id, filename, current_app.config['UPLOAD_FOLDER']
+    )
+    
+    return jsonify({
+        'job_id': trabajo_id,
+        'estado': 'en_cola',
+        'status_url': f'/api/jobs/{trabajo_id}',
+        'result_url': f'/api/jobs/{trabajo_id}/result'
+    }), 202
+
+
+@rutas.route('/api/validate/stream', methods=['POST'])
+def validate_stream():
+    """Validación completa en flujo: filas y resumen de cada estación al terminarla
+
+    Responde NDJSON (una línea JSON por mensaje) o, con "format": "sse",
+    Server-Sent Events. La validación espera su turno en la cola de
+    trabajos como /api/validate/full; el último mensaje ('resumen') es el
+    cuerpo que devuelve el resultado de ese trabajo.
+    """
     data = request.get_json()
     
     if not data or 'filename' not in data:
         return jsonify({'error': 'Se requiere el nombre del archivo'}), 400
     
+    formato = data.get('format', 'ndjson')
+    if formato not in FORMATOS_FLUJO:
+        return jsonify({'error': f"format debe ser uno de: {', '.join(FORMATOS_FLUJO)}"}), 400
+    
     filename = data['filename']
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+    
+    if not os.path.exists(filepath):
+        return jsonify({'error': 'Archivo no encontrado'}), 404
+    
+    marcar_uso(filepath)
+    limpiar_trabajos_vencidos()
+    trabajo_id = crear_trabajo(filename)
+    cola, cancelado = queue.Queue(maxsize=current_app.config['STREAM_QUEUE_MESSAGES']), threading.Event()
+    obtener_ejecutor_trabajos().submit(
+        en_contexto(ejecutar_trabajo_flujo), trabajo_id, filename, current_app.config['UPLOAD_FOLDER'],
+        cola, cancelado
+    )
+    
+    mensajes = relevar_mensajes(trabajo_id, cola, cancelado)
+    return Response(
+        stream_with_context(mensajes_flujo(mensajes, formato)),
+        mimetype=FORMATOS_FLUJO[formato],
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@rutas.route('/api/validate/batch', methods=['POST'])
+def validate_batch():
+    """Validación de varios archivos como una sola serie (asíncrona: devuelve el id del trabajo)"""
+    data = request.get_json()
+    
+    if not data or not isinstance(data.get('filenames'), list) or not data['filenames']:
+        return jsonify({'error': 'Se requiere la lista de archivos (filenames)'}), 400
+    
+    filenames = data['filenames']
+    if len(filenames) > current_app.config['BATCH_MAX_FILES']:
+        return jsonify({'error': f"Se permiten hasta {current_app.config['BATCH_MAX_FILES']} archivos por lote"}), 400
+    
+    faltantes = [f for f in filenames
+                 if not isinstance(f, str) or not os.path.exists(os.path.join(current_app.config['UPLOAD_FOLDER'], f))]
+    if faltantes:
+        return jsonify({'error': 'Archivos no encontrados', 'archivos': faltantes}), 404
+    for f in filenames:
+        marcar_uso(os.path.join(current_app.config['UPLOAD_FOLDER'], f))
+    
+    # Nombre con el que se registran las descargas del lote
+    filename = f"lote_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{len(filenames)}_archivos"
+    
+    limpiar_trabajos_vencidos()
+    trabajo_id = crear_trabajo(filename, archivos=filenames)
+    obtener_ejecutor_trabajos().submit(
+        en_contexto(ejecutar_trabajo_validacion), trabajo_id, filename, current_app.config['UPLOAD_FOLDER'],
+        filenames
+    )
+    
+    return jsonify({
+        'job_id': trabajo_id,
+        'estado': 'en_cola',
+        'archivos': len(filenames),
+        'status_url': f'/api/jobs/{trabajo_id}',
+        'result_url': f'/api/jobs/{trabajo_id}/result'
+    }), 202
+
+
+@rutas.route('/api/validate/append', methods=['POST'])
+def validate_append():
+    """Validación incremental: sumar un archivo nuevo al historial de cada estación"""
+    data = request.get_json()
+    
+    if not data or 'filename' not in data:
+        return jsonify({'error': 'Se requiere el nombre del archivo'}), 400
+    
+    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], data['filename'])
     
     if not os.path.exists(filepath):
         return jsonify({'error': 'Archivo no encontrado'}), 404
+    marcar_uso(filepath)
     
+    tiempos = iniciar_tiempos_solicitud()
     try:
-        # 1. Cargar datos ENVISTA
-        df_envista = cargar_y_procesar_envista(filepath)
-        
-        if df_envista is None or len(df_envista) == 0:
-            return jsonify({'error': 'No se pudieron cargar los datos del archivo'}), 400
-        
-        # 2. Convertir a formato base
-        df_convertido = convertir_a_formato_base(df_envista)
-        
-        if len(df_convertido) == 0:
-            return jsonify({'error': 'No se pudieron convertir los datos'}), 400
-        
-        # 3. Aplicar TODAS las validaciones
-        df_validado = validar_datos_completo(df_convertido)
-        
-        # 4. Crear resúmenes
-        resumen_banderas, resumen_detallado, estadisticas, stats_detalladas = crear_resumen_validacion(df_validado)
-        
-        # 5. Guardar archivo validado
-        output_filename = f"validado_{filename}"
-        output_filepath = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-        exportar_resultados(df_validado, output_filepath)
-        
-        # 6. Preparar respuesta
-        df_json = df_validado.fillna('').to_dict(orient='records')
-        
-        response = {
-            'success': True,
-            'message': 'Validación completa realizada exitosamente',
-            'output_filename': output_filename,
-            'summary': {
-                'total_registros': len(df_validado),
-                'estaciones': df_validado['STATION'].nunique(),
-                'fecha_inicio': df_validado['DATE'].min(),
-                'fecha_fin': df_validado['DATE'].max(),
-                'banderas': resumen_banderas.to_dict() if not resumen_banderas.empty else {},
-                'estadisticas': estadisticas.to_dict() if not estadisticas.empty else {}
-            },
-            'data_preview': df_json,
-            'estadisticas_detalladas': stats_detalladas.to_dict(orient='records') if not stats_detalladas.empty else []
+        with perfilar(f'anexar_{uuid.uuid4().hex}') as ruta_perfil, medir('etapa', 'total'):
+            with medir('etapa', 'carga') as medicion:
+                tabla = cargar_tabla_bd(filepath)
+                if tabla is not None:
+                    medicion['filas'] = len(tabla)
+                    medicion['celdas'] = len(tabla) * len(tabla.parametros)
+            if tabla is None:
+                return jsonify({'error': 'No se pudieron cargar los datos del archivo'}), 400
+            
+            with medir('etapa', 'validacion', len(tabla), len(tabla) * len(tabla.parametros)):
+                detalle, revalidadas = anexar_tabla(tabla)
+            with medir('etapa', 'exportacion', len(revalidadas)):
+                guardar_en_historial_seguro(revalidadas)
+            
+            # Las filas revalidadas (nuevas y la ventana que pudo cambiar) quedan
+            # disponibles como resultado paginado
+            result_id = uuid.uuid4().hex
+            registrar_resultado(result_id, revalidadas)
+            with medir('etapa', 'resumen', len(revalidadas)):
+                resumen_banderas = crear_resumen_validacion(revalidadas)[0]
+    finally:
+        terminar_tiempos_solicitud()
+    
+    cuerpo = {
+        'success': True,
+        'message': 'Datos anexados al historial',
+        'estaciones': detalle,
+        'result_id': result_id,
+        'rows_url': f'/api/results/{result_id}/rows',
+        'summary': {
+            'filas_revalidadas': len(revalidadas),
+            'banderas': resumen_banderas.to_dict() if not resumen_banderas.empty else {},
         }
+    }
+    if ruta_perfil is not None:
+        cuerpo['perfil'] = ruta_perfil
+    
+    respuesta = jsonify(cuerpo)
+    respuesta.headers['Server-Timing'] = encabezado_server_timing(tiempos)
+    return respuesta
+
+
+@rutas.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Estado y avance por etapa de un trabajo de validación"""
+    with trabajos_lock:
+        trabajo = TRABAJOS.get(job_id)
+        if trabajo is None:
+            return jsonify({'error': 'Trabajo no encontrado'}), 404
+        return jsonify(vista_trabajo(trabajo))
+
+
+@rutas.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """Resultado de un trabajo terminado (202 mientras siga en proceso)"""
+    with trabajos_lock:
+        trabajo = TRABAJOS.get(job_id)
+        if trabajo is None:
+            return jsonify({'error': 'Trabajo no encontrado'}), 404
+        if trabajo['resultado'] is None:
+            return jsonify(vista_trabajo(trabajo)), 202
+        resultado, codigo, tiempos = trabajo['resultado'], trabajo['codigo_http'], trabajo['tiempos']
+    
+    respuesta = jsonify(resultado)
+    if tiempos:
+        respuesta.headers['Server-Timing'] = encabezado_server_timing(tiempos)
+    return respuesta, codigo
+
+
+def parametros_consulta_filas(columnas_validas, nombre_columnas='columns'):
+    """Leer de la URL paginación, formato, columnas y filtros de una consulta de filas
+
+    Devuelve (parámetros, None) o (None, mensaje de error).
+    """
+    try:
+        pagina = int(request.args.get('page', 1))
+        limite = int(request.args.get('limit', current_app.config['RESULTS_PAGE_SIZE']))
+    except ValueError:
+        return None, 'page y limit deben ser números enteros'
+    
+    if pagina < 1 or not 1 <= limite <= current_app.config['RESULTS_MAX_PAGE_SIZE']:
+        return None, f"page debe ser >= 1 y limit entre 1 y {current_app.config['RESULTS_MAX_PAGE_SIZE']}"
+    
+    formato = request.args.get('layout', 'records')
+    if formato not in FORMATOS_RESULTADO:
+        return None, f"layout debe ser uno de: {', '.join(FORMATOS_RESULTADO)}"
+    
+    columnas = None
+    if request.args.get(nombre_columnas):
+        columnas = [c.strip() for c in request.args[nombre_columnas].split(',') if c.strip()]
+        desconocidas = [c for c in columnas if c not in columnas_validas and c not in ('STATION', 'DATE', 'HOUR')]
+        if desconocidas:
+            return None, f"Columnas desconocidas: {', '.join(desconocidas)}"
+    
+    return {
+        'pagina': pagina,
+        'limite': limite,
+        'formato': formato,
+        'columnas': columnas,
+        'estaciones': [e.strip() for e in request.args.get('station', '').split(',') if e.strip()],
+        'fecha_inicio': request.args.get('date_from'),
+        'fecha_fin': request.args.get('date_to'),
+    }, None
+
+
+@rutas.route('/api/results/<result_id>/rows', methods=['GET'])
+def get_result_rows(result_id):
+    """Filas de un resultado validado: paginación, filtros y proyección de columnas"""
+    tabla = obtener_resultado(result_id)
+    if tabla is None:
+        return jsonify({'error': 'Resultado no encontrado'}), 404
+    
+    consulta, error = parametros_consulta_filas(tabla.parametros)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    indices = filtrar_resultado(
+        tabla,
+        estaciones=consulta['estaciones'],
+        fecha_inicio=consulta['fecha_inicio'],
+        fecha_fin=consulta['fecha_fin']
+    )
+    
+    pagina_tabla = recortar_pagina(tabla, indices, consulta['pagina'], consulta['limite'], consulta['columnas'])
+    return responder_pagina(pagina_tabla, consulta['pagina'], consulta['limite'], len(indices),
+                            consulta['formato'], result_id=result_id)
+
+
+@rutas.route('/api/results/<result_id>/aggregates', methods=['GET'])
+def get_result_aggregates(result_id):
+    """Productos disponibles de un resultado, y completitud y estadísticas de cada estación y parámetro"""
+    agregados = obtener_agregados(result_id)
+    if agregados is None:
+        return jsonify({'error': 'Resultado no encontrado'}), 404
+    
+    return jsonify({
+        'result_id': result_id,
+        'products': {
+            producto: {
+                'total': len(agregados[producto]),
+                'columns': list(agregados[producto].claves.columns) + agregados[producto].parametros,
+                'rows_url': f'/api/results/{result_id}/aggregates/{producto}',
+            }
+            for producto in PRODUCTOS_AGREGADOS
+        },
+        'promedios_moviles': PROMEDIOS_MOVILES,
+        'completitud_minima': COMPLETITUD_MINIMA,
+        'completitud': agregados['completitud_periodo'],
+        'estadisticas': agregados['estadisticas_periodo'],
+    })
+
+
+@rutas.route('/api/results/<result_id>/aggregates/<producto>', methods=['GET'])
+def get_result_aggregate_rows(result_id, producto):
+    """Filas de un producto (daily, moving, completeness) con los filtros de /rows"""
+    if producto not in PRODUCTOS_AGREGADOS:
+        return jsonify({'error': f"Producto desconocido; use uno de: {', '.join(PRODUCTOS_AGREGADOS)}"}), 404
+    
+    agregados = obtener_agregados(result_id)
+    if agregados is None:
+        return jsonify({'error': 'Resultado no encontrado'}), 404
+    tabla = agregados[producto]
+    
+    consulta, error = parametros_consulta_filas(tabla.parametros)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    indices = filtrar_resultado(
+        tabla,
+        estaciones=consulta['estaciones'],
+        fecha_inicio=consulta['fecha_inicio'],
+        fecha_fin=consulta['fecha_fin']
+    )
+    
+    pagina_tabla = recortar_pagina(tabla, indices, consulta['pagina'], consulta['limite'], consulta['columnas'])
+    return responder_pagina(pagina_tabla, consulta['pagina'], consulta['limite'], len(indices),
+                            consulta['formato'], result_id=result_id, product=producto)
+
+
+@rutas.route('/api/results/<result_id>/series', methods=['GET'])
+def get_result_series(result_id):
+    """Series por estación y parámetro reducidas en el servidor (LTTB) para gráficas"""
+    import pandas as pd
+    
+    producto = request.args.get('product', 'hourly')
+    if producto not in PRODUCTOS_SERIES:
+        return jsonify({'error': f"product debe ser uno de: {', '.join(PRODUCTOS_SERIES)}"}), 400
+    
+    try:
+        puntos = int(request.args.get('points', current_app.config['SERIES_DEFAULT_POINTS']))
+    except ValueError:
+        return jsonify({'error': 'points debe ser un número entero'}), 400
+    if not 3 <= puntos <= current_app.config['SERIES_MAX_POINTS']:
+        return jsonify({'error': f"points debe estar entre 3 y {current_app.config['SERIES_MAX_POINTS']}"}), 400
+    
+    if producto == 'hourly':
+        tabla = obtener_resultado(result_id)
+    else:
+        agregados = obtener_agregados(result_id)
+        tabla = agregados[producto] if agregados is not None else None
+    if tabla is None:
+        return jsonify({'error': 'Resultado no encontrado'}), 404
+    
+    disponibles = pd.unique(tabla.claves['STATION']).tolist()
+    estaciones = [e.strip() for e in request.args.get('station', '').split(',') if e.strip()] or disponibles
+    parametros = [p.strip() for p in request.args.get('parameter', '').split(',') if p.strip()] or tabla.parametros
+    desconocidos = [p for p in parametros if p not in tabla.valores]
+    if desconocidos:
+        return jsonify({'error': f"Parámetros desconocidos: {', '.join(desconocidos)}"}), 400
+    
+    with medir('etapa', 'series'):
+        series = series_reducidas(tabla, [e for e in estaciones if e in disponibles], parametros, puntos,
+                                  request.args.get('date_from'), request.args.get('date_to'))
+    
+    return responder_datos({
+        'result_id': result_id,
+        'product': producto,
+        'points': puntos,
+        'series': series,
+    })
+
+
+@rutas.route('/api/results/<result_id>/provenance', methods=['GET'])
+def get_result_provenance(result_id):
+    """Celdas de un resultado con las reglas que las marcaron (máscara de origen)"""
+    import numpy as np
+    
+    tabla = obtener_resultado(result_id)
+    if tabla is None:
+        return jsonify({'error': 'Resultado no encontrado'}), 404
+    if tabla.origenes is None:
+        return jsonify({'error': 'El resultado no tiene orígenes de banderas'}), 404
+    
+    consulta, error = parametros_consulta_filas(tabla.parametros, nombre_columnas='parameter')
+    if error:
+        return jsonify({'error': error}), 400
+    
+    bits = compilar_reglas()['origenes']
+    reglas = [r.strip() for r in request.args.get('rule', '').split(',') if r.strip()]
+    desconocidas = [r for r in reglas if r not in bits]
+    if desconocidas:
+        return jsonify({'error': f"Reglas desconocidas: {', '.join(desconocidas)}"}), 400
+    
+    indices = filtrar_resultado(
+        tabla,
+        estaciones=consulta['estaciones'],
+        fecha_inicio=consulta['fecha_inicio'],
+        fecha_fin=consulta['fecha_fin']
+    )
+    parametros = [p for p in tabla.parametros if consulta['columnas'] is None or p in consulta['columnas']]
+    filas, columnas, mascaras = celdas_con_origen(tabla, indices, parametros, sum(bits[r] for r in reglas))
+    
+    inicio = (consulta['pagina'] - 1) * consulta['limite']
+    pagina = slice(inicio, inicio + consulta['limite'])
+    return responder_datos({
+        'result_id': result_id,
+        'reglas': bits,
+        'totales': {nombre: int(np.count_nonzero(mascaras & bit)) for nombre, bit in bits.items()},
+        **datos_pagina(consulta['pagina'], consulta['limite'], len(filas)),
+        'data': registros_origen(tabla, filas[pagina], columnas[pagina], mascaras[pagina], parametros, bits),
+    })
+
+
+@rutas.route('/api/results/<result_id>/revalidate', methods=['POST'])
+def revalidate_result(result_id):
+    """Revalidar un resultado con otros límites y comparar sus banderas con las originales"""
+    base = obtener_resultado(result_id)
+    if base is None:
+        return jsonify({'error': 'Resultado no encontrado'}), 404
+    
+    cambios = request.get_json(silent=True)
+    if not isinstance(cambios, dict):
+        return jsonify({'error': 'Se requiere un objeto JSON con los cambios'}), 400
+    try:
+        reglas, aplicados = reglas_con_cambios(cambios)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    tiempos = iniciar_tiempos_solicitud()
+    try:
+        with medir('etapa', 'carga'):
+            convertida = tabla_convertida_resultado(result_id)
+        if convertida is None:
+            return jsonify({'error': 'Los archivos originales del resultado ya no están disponibles'}), 404
         
-        return jsonify(response)
+        filas, celdas = len(convertida), len(convertida) * len(convertida.parametros)
+        with medir('etapa', 'revalidacion', filas, celdas):
+            revalidada = aplicar_reglas(convertida, reglas)
+        with medir('etapa', 'resumen', filas, celdas):
+            diferencia = diferencia_banderas(base, revalidada)
+    finally:
+        terminar_tiempos_solicitud()
     
-    except Exception as e:
-        return jsonify({'error': f'Error durante la validación: {str(e)}'}), 500
+    respuesta = jsonify({
+        'result_id': result_id,
+        'cambios': aplicados,
+        'total_registros': filas,
+        **diferencia,
+    })
+    respuesta.headers['Server-Timing'] = encabezado_server_timing(tiempos)
+    return respuesta
+
+
+@rutas.route('/api/history', methods=['GET'])
+def get_history():
+    """Consultar el almacén histórico por estación, parámetro y rango de fechas"""
+    consulta, error = parametros_consulta_filas(COLUMNAS_BD[3:], nombre_columnas='parameter')
+    if error:
+        return jsonify({'error': error}), 400
+    
+    parametros = None
+    if consulta['columnas'] is not None:
+        parametros = [c for c in consulta['columnas'] if c not in ('STATION', 'DATE', 'HOUR')]
+    
+    try:
+        tabla, total = consultar_historial(
+            estaciones=consulta['estaciones'],
+            parametros=parametros,
+            fecha_inicio=consulta['fecha_inicio'],
+            fecha_fin=consulta['fecha_fin'],
+            inicio=(consulta['pagina'] - 1) * consulta['limite'],
+            limite=consulta['limite']
+        )
+    except ImportError:
+        return jsonify({'error': 'El almacén histórico requiere pyarrow'}), 500
+    
+    return responder_pagina(tabla, consulta['pagina'], consulta['limite'], total, consulta['formato'])
+
+
+@rutas.route('/api/cache', methods=['GET'])
+def get_cache_stats():
+    """Aciertos, fallos y uso de disco de la caché de resultados"""
+    return jsonify(estado_cache())
+
+
+@rutas.route('/api/storage', methods=['GET'])
+def get_storage_stats():
+    """Uso de disco de los archivos subidos y validados, duplicados evitados y expulsiones"""
+    return jsonify(estado_almacen())
 
 
-@app.route('/api/download/<filename>', methods=['GET'])
+@rutas.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Métricas de rendimiento por etapa y regla (formato de texto de Prometheus)"""
+    return current_app.response_class(metricas_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+@rutas.route('/api/download/<filename>', methods=['GET'])
 def download_file(filename):
-    """Descargar archivo procesado"""
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    """Descargar archivo procesado (se exporta en la primera descarga)"""
+    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
     
-    if not os.path.exists(filepath):
-        return jsonify({'error': 'Archivo no encontrado'}), 404
+    if os.path.exists(filepath):
+        marcar_uso(filepath)
+    else:
+        filepath = generar_descarga(filename)
+        if filepath is None:
+            return jsonify({'error': 'Archivo no encontrado'}), 404
+        liberar_almacen(protegidos=[filename])
     
     return send_file(
         filepath,
         as_attachment=True,
         download_name=filename,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        mimetype=tipo_mime(filename),
+        etag=etiqueta_descarga(filepath)
     )
 
 
+# ============================================================================
+# FÁBRICA DE LA APLICACIÓN
+# ============================================================================
+# crear_app arma una aplicación Flask con el blueprint de rutas y CORS. El
+# código fuera de una solicitud lee la configuración de current_app: los
+# trabajos en segundo plano se ejecutan con el contexto de la aplicación que
+# los creó (en_contexto) y los workers de los pools de procesos arman la suya
+# con la configuración que reciben (iniciar_worker). Los resultados, trabajos
+# y cachés en memoria son del proceso. Para un servidor WSGI con preload
+# (gunicorn --preload, ver wsgi.py), crear_app(precargar=True) deja todo
+# cargado en el proceso maestro antes del fork: los workers arrancan sin
+# importar nada.
+
+MODULOS_PRECARGA = ('numpy', 'pandas', 'openpyxl', 'pyarrow', 'pyarrow.parquet', 'pyarrow.ipc', 'msgpack',
+                    'brotli')
+
+
+def crear_app(configuracion=None, precargar=False):
+    """Crear la aplicación Flask
+
+    `configuracion` se aplica sobre CONFIGURACION_POR_DEFECTO; si cambia
+    UPLOAD_FOLDER, la caché de resultados, los perfiles y el almacén
+    histórico se mueven debajo de la nueva carpeta salvo que se indiquen
+    también. UPLOAD_FOLDER se crea si no existe. Con `precargar` se importan
+    los módulos de MODULOS_PRECARGA (en el resto del código se importan al
+    usarlos), se compilan las tablas de búsqueda y se congelan los objetos
+    vivos para que el recolector de basura no toque (y copie) sus páginas en
+    los workers.
+    """
+    configuracion = dict(configuracion or {})
+    if 'UPLOAD_FOLDER' in configuracion:
+        carpeta = configuracion['UPLOAD_FOLDER']
+        configuracion.setdefault('RESULT_CACHE_FOLDER', os.path.join(carpeta, 'cache'))
+        configuracion.setdefault('PROFILE_FOLDER', os.path.join(carpeta, 'perfiles'))
+        configuracion.setdefault('HISTORY_FOLDER', os.path.join(carpeta, 'historial'))
+    
+    app = Flask(__name__)
+    app.config.update(CONFIGURACION_POR_DEFECTO)
+    app.config.update(configuracion)
+    CORS(app)
+    app.register_blueprint(rutas)
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    
+    if precargar:
+        for nombre in MODULOS_PRECARGA:
+            modulo_opcional(nombre)
+        compilar_tablas()
+        compilar_mapeo_banderas()
+        gc.collect()
+        gc.freeze()
+    
+    return app
+
+
 if __name__ == '__main__':
     print("\n" + "="*60)
     print("API DE VALIDACIÓN DE CALIDAD DEL AIRE")
@@ -624,4 +4869,4 @@ if __name__ == '__main__':
     print(f"Servidor iniciando en http://localhost:8000")
     print("="*60 + "\n")
     
-    app.run(debug=True, host='0.0.0.0', port=8000)
+    crear_app().run(debug=True, host='0.0.0.0', port=8000)
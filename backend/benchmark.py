@@ -0,0 +1,365 @@
+"""
+Benchmark del pipeline de validación con archivos ENVISTA sintéticos
+
+Genera libros Trs.xlsx con el diseño real de ENVISTA (estaciones en la fila 3,
+parámetros en la fila 4 y datos desde la fila 6, con banderas de
+MAPEO_BANDERAS_ENVISTA mezcladas entre los valores) y mide el tiempo y la
+memoria pico de cada etapa. Los resultados se guardan en JSON para comparar
+versiones:
+
+    python benchmark.py --tamanos dia mes anio --salida actual.json
+    python benchmark.py --tamanos dia mes anio --comparar actual.json
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import app as validador
+
+
+# ============================================================================
+# CONFIGURACIÓN DEL BENCHMARK
+# ============================================================================
+
+# Tamaños predefinidos (horas de datos por estación)
+TAMANOS = {
+    'dia': 24,
+    'semana': 24 * 7,
+    'mes': 24 * 30,
+    'anio': 24 * 365,
+    '3anios': 24 * 365 * 3,
+}
+
+# Parámetros ENVISTA de cada estación: (media, desviación, decimales)
+PARAMETROS_SINTETICOS = {
+    'O3': (0.030, 0.020, 3), 'NO': (0.010, 0.008, 3), 'NO2': (0.020, 0.010, 3),
+    'NOX': (0.030, 0.015, 3), 'SO2': (0.003, 0.003, 3), 'CO': (1.0, 0.6, 2),
+    'PM10': (45, 25, 0), 'PM2.5': (20, 12, 0), 'TempInt': (25, 2, 2),
+    'TempExt': (22, 7, 2), 'RH': (50, 25, 1), 'WS': (2, 1.5, 1), 'WD': (180, 100, 1),
+    'PRECIP': (0.1, 0.4, 2), 'Presion': (640, 60, 1), 'Radiación': (300, 350, 1),
+    'IUV': (3, 3, 2),
+}
+
+TASA_BANDERAS = 0.03     # fracción de celdas con texto de bandera ENVISTA
+TASA_VACIAS = 0.01       # fracción de celdas vacías
+TASA_RACHAS = 0.01       # probabilidad de iniciar una racha de valores repetidos
+
+UMBRAL_REGRESION = 0.10  # al comparar: más de 10% más lento (o más memoria) es regresión
+# Diferencia mínima para marcar regresión (evita el ruido de las etapas muy cortas)
+MINIMO_REGRESION = {'segundos': 0.01, 'memoria_pico_mb': 1.0}
+
+
+# ============================================================================
+# GENERADOR DE LIBROS ENVISTA
+# ============================================================================
+
+def generar_columna(rng, horas, media, desviacion, decimales):
+    """Serie horaria de un parámetro con rachas de valores repetidos"""
+    valores = np.round(np.abs(rng.normal(media, desviacion, horas)), decimales)
+
+    inicios = np.flatnonzero(rng.random(horas) < TASA_RACHAS)
+    for inicio, largo in zip(inicios, rng.integers(2, 7, len(inicios))):
+        valores[inicio:inicio + largo] = valores[inicio]
+
+    return valores
+
+
+def generar_envista(horas, estaciones=None, semilla=0):
+    """Datos sintéticos en el diseño de columnas de ENVISTA
+
+    Devuelve (fechas, columnas) donde columnas es una lista de
+    (estación, parámetro, celdas) y cada celda es un número, un texto de
+    bandera ENVISTA o None.
+    """
+    rng = np.random.default_rng(semilla)
+    estaciones = estaciones or list(validador.MAPEO_ESTACIONES)
+    banderas = np.array(list(validador.MAPEO_BANDERAS_ENVISTA), dtype=object)
+    fechas = pd.date_range('2024-01-01 01:00', periods=horas, freq='h').to_pydatetime()
+
+    columnas = []
+    for estacion in estaciones:
+        series = {parametro: generar_columna(rng, horas, *config)
+                  for parametro, config in PARAMETROS_SINTETICOS.items()}
+        # NOX cercano a NO + NO2 salvo en algunas horas, para ejercitar la regla de relación
+        ruido = np.where(rng.random(horas) < 0.05, rng.uniform(0.5, 1.5, horas), 1.0)
+        series['NOX'] = np.round((series['NO'] + series['NO2']) * ruido, 3)
+
+        for parametro, valores in series.items():
+            celdas = valores.astype(object)
+            mask_bandera = rng.random(horas) < TASA_BANDERAS
+            celdas[mask_bandera] = rng.choice(banderas, mask_bandera.sum())
+            celdas[rng.random(horas) < TASA_VACIAS] = None
+            columnas.append((estacion, parametro, celdas))
+
+    return fechas, columnas
+
+
+def escribir_libro_envista(fechas, columnas, archivo_salida):
+    """Escribir un libro Trs.xlsx (modo write_only de openpyxl)"""
+    from openpyxl import Workbook
+
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet('Trs')
+    ancho = len(columnas) + 1
+
+    hoja.append(['Reporte de datos horarios'] + [None] * (ancho - 1))
+    hoja.append([None] * ancho)
+    hoja.append([None] + [estacion for estacion, _, _ in columnas])
+    hoja.append([None] + [parametro for _, parametro, _ in columnas])
+    hoja.append(['Fecha'] + ['' for _ in columnas])
+
+    matriz = np.empty((len(fechas), ancho), dtype=object)
+    matriz[:, 0] = fechas
+    for j, (_, _, celdas) in enumerate(columnas, start=1):
+        matriz[:, j] = celdas
+    for fila in matriz.tolist():
+        hoja.append(fila)
+
+    libro.save(archivo_salida)
+
+
+def obtener_libro(horas, carpeta, semilla=0):
+    """Ruta del libro sintético para un tamaño (se genera solo si no existe)"""
+    ruta = os.path.join(carpeta, f'envista_{horas}h_s{semilla}.xlsx')
+    if not os.path.exists(ruta):
+        fechas, columnas = generar_envista(horas, semilla=semilla)
+        temporal = ruta + '.tmp.xlsx'
+        escribir_libro_envista(fechas, columnas, temporal)
+        os.replace(temporal, ruta)
+    return ruta
+
+
+# ============================================================================
+# MEDICIÓN
+# ============================================================================
+
+def medir(funcion, repeticiones=1, memoria=True):
+    """Ejecutar una etapa: mejor tiempo de `repeticiones` y memoria pico
+
+    La memoria se mide en una ejecución aparte con tracemalloc, para que su
+    costo no se sume al tiempo. Devuelve (resultado, medición).
+    """
+    tiempos = []
+    for _ in range(repeticiones):
+        gc.collect()
+        inicio = time.perf_counter()
+        resultado = funcion()
+        tiempos.append(time.perf_counter() - inicio)
+
+    medicion = {
+        'segundos': round(min(tiempos), 6),
+        'segundos_mediana': round(statistics.median(tiempos), 6),
+    }
+
+    if memoria:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            funcion()
+            _, pico = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        medicion['memoria_pico_mb'] = round(pico / (1024 * 1024), 3)
+
+    return resultado, medicion
+
+
+def medir_pipeline(ruta, carpeta, repeticiones=1, memoria=True, al_terminar_etapa=None):
+    """Medir cada etapa del pipeline sobre un libro ENVISTA
+
+    Cada etapa recibe la salida de la anterior, igual que en
+    ejecutar_validacion_completa. `al_terminar_etapa` recibe el nombre y la
+    medición de cada etapa al terminarla.
+    """
+    etapas = {}
+
+    def etapa(nombre, funcion):
+        resultado, medicion = medir(funcion, repeticiones, memoria)
+        etapas[nombre] = medicion
+        if al_terminar_etapa is not None:
+            al_terminar_etapa(nombre, medicion)
+        return resultado
+
+    # cargar_tabla_bd mide la lectura del libro, sin la tabla convertida guardada
+    aplicacion = validador.crear_app({'CONVERTED_CACHE_ENABLED': False})
+    with aplicacion.app_context():
+        df_envista = etapa('cargar_y_procesar_envista', lambda: validador.cargar_y_procesar_envista(ruta))
+        etapa('cargar_tabla_bd', lambda: validador.cargar_tabla_bd(ruta))
+        etapa('convertir_a_formato_base', lambda: validador.convertir_a_formato_base(df_envista))
+        tabla = etapa('convertir_a_tabla_bd', lambda: validador.convertir_a_tabla_bd(df_envista).ordenada())
+        del df_envista
+
+        ruta_arrow = os.path.join(carpeta, 'benchmark_convertida.arrow')
+        validador.guardar_tabla_convertida(tabla, ruta_arrow)
+        etapa('cargar_tabla_convertida', lambda: validador.leer_tabla_convertida(ruta_arrow, escribible=True))
+        os.remove(ruta_arrow)
+
+        tabla = etapa('validar_rangos', lambda: validador.validar_rangos(tabla))
+        tabla = etapa('validar_temperatura_interna', lambda: validador.validar_temperatura_interna(tabla))
+        tabla_validada = etapa('validar_series_temporales', lambda: validador.validar_series_temporales(tabla))
+        del tabla
+
+        tabla_export = etapa('aplicar_decimales', lambda: validador.aplicar_decimales(tabla_validada))
+        resumenes = etapa('crear_resumen_validacion', lambda: validador.crear_resumen_validacion(tabla_export))
+
+        archivo_salida = os.path.join(carpeta, 'benchmark_validado.xlsx')
+        etapa('exportar_resultados',
+              lambda: validador.exportar_resultados(tabla_export, resumenes, archivo_salida))
+        os.remove(archivo_salida)
+
+        # Todas las filas serializadas como las devuelve /api/results/<id>/rows
+        total = len(tabla_validada)
+        etapa('serializacion_json', lambda: aplicacion.json.dumps(
+            validador.pagina_resultado(tabla_validada, np.arange(total), 1, max(total, 1))))
+
+    return etapas, total
+
+
+def version_actual():
+    """Commit de git y versiones de las dependencias principales"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+
+    import openpyxl
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'openpyxl': openpyxl.__version__,
+    }
+
+
+# ============================================================================
+# COMPARACIÓN ENTRE VERSIONES
+# ============================================================================
+
+def comparar_resultados(anterior, actual, umbral=UMBRAL_REGRESION):
+    """Comparar dos resultados de benchmark por tamaño y etapa
+
+    Devuelve una lista de filas (tamaño, etapa, métrica, antes, ahora,
+    cambio relativo, es_regresion).
+    """
+    anteriores = {r['tamano']: r for r in anterior['resultados']}
+    filas = []
+
+    for resultado in actual['resultados']:
+        previo = anteriores.get(resultado['tamano'])
+        if previo is None:
+            continue
+        for nombre, medicion in resultado['etapas'].items():
+            medicion_previa = previo['etapas'].get(nombre)
+            if medicion_previa is None:
+                continue
+            for metrica in ('segundos', 'memoria_pico_mb'):
+                if metrica not in medicion or metrica not in medicion_previa:
+                    continue
+                antes, ahora = medicion_previa[metrica], medicion[metrica]
+                cambio = (ahora - antes) / antes if antes else 0.0
+                regresion = cambio > umbral and ahora - antes > MINIMO_REGRESION[metrica]
+                filas.append((resultado['tamano'], nombre, metrica, antes, ahora, cambio, regresion))
+
+    return filas
+
+
+def imprimir_comparacion(filas):
+    print(f"\n{'tamaño':<8} {'etapa':<28} {'métrica':<16} {'antes':>10} {'ahora':>10} {'cambio':>8}")
+    for tamano, nombre, metrica, antes, ahora, cambio, regresion in filas:
+        marca = '  <-- regresión' if regresion else ''
+        print(f"{tamano:<8} {nombre:<28} {metrica:<16} {antes:>10.3f} {ahora:>10.3f} {cambio:>+8.1%}{marca}")
+
+
+# ============================================================================
+# LÍNEA DE COMANDOS
+# ============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark del pipeline de validación ENVISTA')
+    parser.add_argument('--tamanos', nargs='+', default=['dia', 'mes', 'anio'],
+                        help=f"tamaños a medir: {', '.join(TAMANOS)} o un número de horas")
+    parser.add_argument('--repeticiones', type=int, default=1, help='ejecuciones por etapa (se guarda la mejor)')
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--sin-memoria', action='store_true', help='no medir memoria pico (más rápido)')
+    parser.add_argument('--carpeta', default=os.path.join(tempfile.gettempdir(), 'benchmark_envista'),
+                        help='carpeta donde se guardan (y reutilizan) los libros sintéticos')
+    parser.add_argument('--salida', help='archivo JSON de resultados (por defecto benchmark.json en --carpeta)')
+    parser.add_argument('--comparar', help='JSON de una ejecución anterior para detectar regresiones')
+    parser.add_argument('--umbral', type=float, default=UMBRAL_REGRESION,
+                        help='cambio relativo a partir del cual se marca regresión')
+    args = parser.parse_args(argv)
+    if args.salida is None:
+        args.salida = os.path.join(args.carpeta, 'benchmark.json')
+
+    os.makedirs(args.carpeta, exist_ok=True)
+    resultados = []
+
+    for tamano in args.tamanos:
+        if tamano not in TAMANOS and not tamano.isdigit():
+            parser.error(f'Tamaño no reconocido: {tamano}')
+        horas = TAMANOS.get(tamano) or int(tamano)
+
+        print(f"\n=== {tamano}: {horas} horas x {len(validador.MAPEO_ESTACIONES)} estaciones ===")
+        inicio = time.perf_counter()
+        ruta = obtener_libro(horas, args.carpeta, args.semilla)
+        print(f"Libro: {ruta} ({os.path.getsize(ruta) / (1024 * 1024):.1f} MB, "
+              f"{time.perf_counter() - inicio:.1f}s)")
+
+        def al_terminar_etapa(nombre, medicion):
+            memoria = f"{medicion['memoria_pico_mb']:>9.1f} MB" if 'memoria_pico_mb' in medicion else ''
+            print(f"  {nombre:<28} {medicion['segundos']:>9.3f}s {memoria}")
+
+        etapas, filas_bd = medir_pipeline(ruta, args.carpeta, args.repeticiones,
+                                          not args.sin_memoria, al_terminar_etapa)
+        resultados.append({
+            'tamano': tamano,
+            'horas': horas,
+            'estaciones': len(validador.MAPEO_ESTACIONES),
+            'filas_bd': filas_bd,
+            'archivo_mb': round(os.path.getsize(ruta) / (1024 * 1024), 3),
+            'etapas': etapas,
+        })
+
+    salida = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'version': version_actual(),
+        'parametros': {'semilla': args.semilla, 'repeticiones': args.repeticiones},
+        'resultados': resultados,
+    }
+
+    anterior = None
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            anterior = json.load(f)
+
+    with open(args.salida, 'w', encoding='utf-8') as f:
+        json.dump(salida, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados guardados en {args.salida}")
+
+    if anterior is not None:
+        filas = comparar_resultados(anterior, salida, args.umbral)
+        imprimir_comparacion(filas)
+        if any(fila[-1] for fila in filas):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
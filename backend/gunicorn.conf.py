@@ -0,0 +1,18 @@
+"""Configuración de gunicorn para wsgi.py (gunicorn -c gunicorn.conf.py wsgi:app)"""
+
+import os
+
+bind = os.environ.get('VALIDADOR_BIND', '0.0.0.0:8000')
+
+# La aplicación se carga y precompila una vez en el proceso maestro; los
+# workers la heredan con fork y comparten esa memoria mientras no la escriban
+preload_app = True
+
+# Trabajos, descargas pendientes e historial incremental viven en la memoria
+# de cada worker: con más de uno, el balanceador debe mantener a cada cliente
+# en el mismo worker (los resultados y la caché sí se comparten en disco)
+workers = int(os.environ.get('VALIDADOR_WORKERS', 1))
+threads = int(os.environ.get('VALIDADOR_THREADS', 8))
+
+# Una validación en flujo puede tardar varios minutos en archivos grandes
+timeout = int(os.environ.get('VALIDADOR_TIMEOUT', 300))
@@ -0,0 +1,25 @@
+"""
+Punto de entrada WSGI para producción
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Variables de entorno:
+    VALIDADOR_UPLOAD_FOLDER  carpeta de archivos subidos y validados (por
+                             defecto validador_calidad_aire en la carpeta
+                             temporal del sistema)
+    VALIDADOR_PRECARGAR      '0' para no precargar módulos ni congelar objetos
+    VALIDADOR_HISTORIAL      '1' para guardar cada validación en el almacén
+                             histórico (UPLOAD_FOLDER/historial)
+"""
+
+import os
+
+from app import crear_app
+
+configuracion = {}
+if os.environ.get('VALIDADOR_UPLOAD_FOLDER'):
+    configuracion['UPLOAD_FOLDER'] = os.environ['VALIDADOR_UPLOAD_FOLDER']
+if os.environ.get('VALIDADOR_HISTORIAL') == '1':
+    configuracion['HISTORY_ENABLED'] = True
+
+app = crear_app(configuracion, precargar=os.environ.get('VALIDADOR_PRECARGAR', '1') != '0')
@@ -6,6 +6,10 @@ interface DataTableProps {
   columns?: string[];
   maxRows?: number;
   showAll?: boolean;
+  // Paginación en el servidor: `data` es solo la página actual
+  totalRows?: number;
+  page?: number;
+  onPageChange?: (page: number) => void;
 }
 
 // Orden exacto de columnas según BD_2024.xlsx
@@ -43,10 +47,30 @@ const HEADER_COLORS: Record<string, string> = {
   'UVI': 'bg-purple-600 text-white',
 };
 
-export default function DataTable({ data, columns, maxRows = 50, showAll = false }: DataTableProps) {
-  const [currentPage, setCurrentPage] = useState(0);
+export default function DataTable({
+  data,
+  columns,
+  maxRows = 50,
+  showAll = false,
+  totalRows,
+  page,
+  onPageChange,
+}: DataTableProps) {
+  const [localPage, setLocalPage] = useState(0);
   const [showLegend, setShowLegend] = useState(false);
   const rowsPerPage = showAll ? 100 : maxRows;
+  const serverSide = onPageChange !== undefined;
+  const currentPage = serverSide ? page ?? 0 : localPage;
+  const totalCount = serverSide ? totalRows ?? data.length : data.length;
+
+  const setCurrentPage = (update: number | ((p: number) => number)) => {
+    const next = typeof update === 'function' ? update(currentPage) : update;
+    if (serverSide) {
+      onPageChange?.(next);
+    } else {
+      setLocalPage(next);
+    }
+  };
 
   if (!data || data.length === 0) {
     return (
@@ -83,10 +107,10 @@ export default function DataTable({ data, columns, maxRows = 50, showAll = false
   const displayColumns = getOrderedColumns();
   
   // Paginación
-  const totalPages = Math.ceil(data.length / rowsPerPage);
+  const totalPages = Math.ceil(totalCount / rowsPerPage);
   const startIndex = currentPage * rowsPerPage;
-  const endIndex = Math.min(startIndex + rowsPerPage, data.length);
-  const displayData = data.slice(startIndex, endIndex);
+  const endIndex = Math.min(startIndex + rowsPerPage, totalCount);
+  const displayData = serverSide ? data : data.slice(startIndex, endIndex);
 
   const getCellClass = (value: any, column: string) => {
     if (typeof value === 'string') {
@@ -317,7 +341,7 @@ export default function DataTable({ data, columns, maxRows = 50, showAll = false
         <div className="text-sm text-slate-600">
           Mostrando <span className="font-medium">{startIndex + 1}</span> a{' '}
           <span className="font-medium">{endIndex}</span> de{' '}
-          <span className="font-medium">{data.length.toLocaleString()}</span> registros
+          <span className="font-medium">{totalCount.toLocaleString()}</span> registros
         </div>
       </div>
     </div>
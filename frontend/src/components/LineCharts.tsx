@@ -1,4 +1,4 @@
-import { useState, useMemo } from 'react';
+import { useState, useMemo, useEffect } from 'react';
 import {
   LineChart,
   Line,
@@ -9,18 +9,17 @@ import {
   Legend,
   ResponsiveContainer,
 } from 'recharts';
-
-interface DataPoint {
-  STATION: string;
-  DATE: string;
-  HOUR: number;
-  [key: string]: string | number | null;
-}
+import apiService, { EstadisticaEstacion, ResultSeries } from '../services/api';
 
 interface LineChartsProps {
-  data: DataPoint[];
+  resultId: string;
+  stations: string[];
+  estadisticas: EstadisticaEstacion[];
 }
 
+// Puntos por serie que se piden al servidor (LTTB)
+const SERIES_POINTS = 500;
+
 // Colores para cada estación - todos distintos y vibrantes
 const STATION_COLORS: Record<string, string> = {
   'AGU': '#06b6d4', // cyan
@@ -89,153 +88,101 @@ const PARAM_COLORS: Record<string, string> = {
   'UVI': '#eab308',
 };
 
-const LineCharts = ({ data }: LineChartsProps) => {
-  const [compareByStation, setCompareByStation] = useState<boolean>(false);
-  const [selectedStation, setSelectedStation] = useState<string>('all');
-  const [selectedContaminante, setSelectedContaminante] = useState<string>('O3');
-  const [selectedMeteorologico, setSelectedMeteorologico] = useState<string>('IT');
-
-  // Obtener estaciones únicas
-  const stations = useMemo(() => {
-    const uniqueStations = [...new Set(data.map((d) => d.STATION))];
-    return uniqueStations.sort();
-  }, [data]);
+// Serie temporal de una gráfica: con 'all' el parámetro elegido en cada
+// estación; con una estación, todos los parámetros de la categoría
+const useSeries = (
+  resultId: string,
+  stations: string[],
+  selectedStation: string,
+  selectedParam: string,
+  params: string[],
+  enabled: boolean
+) => {
+  const [series, setSeries] = useState<ResultSeries[]>([]);
 
-  // Procesar datos para gráfica de contaminantes
-  const contaminantesData = useMemo(() => {
-    if (compareByStation) {
-      // Comparar por estaciones - promedios por estación para cada contaminante
-      const stationData: Record<string, Record<string, { sum: number; count: number }>> = {};
-      
-      data.forEach((row) => {
-        const station = row.STATION;
-        if (!stationData[station]) {
-          stationData[station] = {};
-        }
-
-        CONTAMINANTES.forEach((param) => {
-          const value = row[param];
-          if (value !== null && value !== undefined && typeof value === 'number' && !isNaN(value)) {
-            if (!stationData[station][param]) {
-              stationData[station][param] = { sum: 0, count: 0 };
-            }
-            stationData[station][param].sum += value;
-            stationData[station][param].count += 1;
-          }
-        });
+  useEffect(() => {
+    if (!enabled) return;
+    let cancelled = false;
+    apiService
+      .getResultSeries(resultId, {
+        points: SERIES_POINTS,
+        station: selectedStation === 'all' ? stations : [selectedStation],
+        parameter: selectedStation === 'all' ? [selectedParam] : params,
+      })
+      .then((response) => {
+        if (!cancelled) setSeries(response.series);
+      })
+      .catch(() => {
+        if (!cancelled) setSeries([]);
       });
+    return () => {
+      cancelled = true;
+    };
+  }, [resultId, stations, selectedStation, selectedParam, params, enabled]);
 
-      // Convertir a formato para gráfica de barras (estaciones en X, contaminantes como barras)
-      return stations.map((station) => {
-        const result: Record<string, string | number> = { station };
-        CONTAMINANTES.forEach((param) => {
-          if (stationData[station]?.[param]) {
-            result[param] = Number((stationData[station][param].sum / stationData[station][param].count).toFixed(2));
-          }
-        });
-        return result;
-      });
-    } else {
-      // Serie temporal
-      const processedData: Record<string, Record<string, number | null>> = {};
-      
-      data.forEach((row) => {
-        const timeKey = `${row.DATE} ${String(row.HOUR).padStart(2, '0')}:00`;
-        
-        if (!processedData[timeKey]) {
-          processedData[timeKey] = {};
-        }
+  return series;
+};
 
-        if (selectedStation === 'all') {
-          const value = row[selectedContaminante];
-          if (value !== null && value !== undefined && typeof value === 'number' && !isNaN(value)) {
-            processedData[timeKey][row.STATION] = value;
-          }
-        } else {
-          if (row.STATION === selectedStation) {
-            CONTAMINANTES.forEach((param) => {
-              const value = row[param];
-              if (value !== null && value !== undefined && typeof value === 'number' && !isNaN(value)) {
-                processedData[timeKey][param] = value;
-              }
-            });
-          }
-        }
-      });
+// Unir las series (cada una con sus propios instantes) en filas por instante
+const seriesToRows = (series: ResultSeries[], byStation: boolean) => {
+  const rows: Record<string, Record<string, number>> = {};
+  series.forEach((serie) => {
+    const key = byStation ? serie.station : serie.parameter;
+    serie.x.forEach((time, i) => {
+      if (!rows[time]) {
+        rows[time] = {};
+      }
+      rows[time][key] = serie.y[i];
+    });
+  });
 
-      return Object.entries(processedData)
-        .map(([time, values]) => ({ time, ...values }))
-        .sort((a, b) => a.time.localeCompare(b.time));
-    }
-  }, [data, selectedStation, selectedContaminante, compareByStation, stations]);
+  return Object.entries(rows)
+    .map(([time, values]) => ({ time, ...values }))
+    .sort((a, b) => a.time.localeCompare(b.time));
+};
 
-  // Procesar datos para gráfica de meteorológicos
-  const meteorologicosData = useMemo(() => {
-    if (compareByStation) {
-      // Comparar por estaciones - promedios por estación para cada meteorológico
-      const stationData: Record<string, Record<string, { sum: number; count: number }>> = {};
-      
-      data.forEach((row) => {
-        const station = row.STATION;
-        if (!stationData[station]) {
-          stationData[station] = {};
-        }
+// Promedio de cada estación para los parámetros de una categoría
+const averagesByStation = (stations: string[], estadisticas: EstadisticaEstacion[], params: string[]) =>
+  stations.map((station) => {
+    const result: Record<string, string | number> = { station };
+    estadisticas.forEach((estadistica) => {
+      if (estadistica.Estación === station && params.includes(estadistica.Contaminante)) {
+        result[estadistica.Contaminante] = Number(estadistica.Promedio.toFixed(2));
+      }
+    });
+    return result;
+  });
 
-        METEOROLOGICOS.forEach((param) => {
-          const value = row[param];
-          if (value !== null && value !== undefined && typeof value === 'number' && !isNaN(value)) {
-            if (!stationData[station][param]) {
-              stationData[station][param] = { sum: 0, count: 0 };
-            }
-            stationData[station][param].sum += value;
-            stationData[station][param].count += 1;
-          }
-        });
-      });
+const LineCharts = ({ resultId, stations, estadisticas }: LineChartsProps) => {
+  const [compareByStation, setCompareByStation] = useState<boolean>(false);
+  const [selectedStation, setSelectedStation] = useState<string>('all');
+  const [selectedContaminante, setSelectedContaminante] = useState<string>('O3');
+  const [selectedMeteorologico, setSelectedMeteorologico] = useState<string>('IT');
 
-      // Convertir a formato para gráfica de barras
-      return stations.map((station) => {
-        const result: Record<string, string | number> = { station };
-        METEOROLOGICOS.forEach((param) => {
-          if (stationData[station]?.[param]) {
-            result[param] = Number((stationData[station][param].sum / stationData[station][param].count).toFixed(2));
-          }
-        });
-        return result;
-      });
-    } else {
-      // Serie temporal
-      const processedData: Record<string, Record<string, number | null>> = {};
-      
-      data.forEach((row) => {
-        const timeKey = `${row.DATE} ${String(row.HOUR).padStart(2, '0')}:00`;
-        
-        if (!processedData[timeKey]) {
-          processedData[timeKey] = {};
-        }
+  const contaminantesSeries = useSeries(
+    resultId, stations, selectedStation, selectedContaminante, CONTAMINANTES, !compareByStation
+  );
+  const meteorologicosSeries = useSeries(
+    resultId, stations, selectedStation, selectedMeteorologico, METEOROLOGICOS, !compareByStation
+  );
 
-        if (selectedStation === 'all') {
-          const value = row[selectedMeteorologico];
-          if (value !== null && value !== undefined && typeof value === 'number' && !isNaN(value)) {
-            processedData[timeKey][row.STATION] = value;
-          }
-        } else {
-          if (row.STATION === selectedStation) {
-            METEOROLOGICOS.forEach((param) => {
-              const value = row[param];
-              if (value !== null && value !== undefined && typeof value === 'number' && !isNaN(value)) {
-                processedData[timeKey][param] = value;
-              }
-            });
-          }
-        }
-      });
+  // Datos para gráfica de contaminantes
+  const contaminantesData = useMemo(
+    () =>
+      compareByStation
+        ? averagesByStation(stations, estadisticas, CONTAMINANTES)
+        : seriesToRows(contaminantesSeries, selectedStation === 'all'),
+    [compareByStation, stations, estadisticas, contaminantesSeries, selectedStation]
+  );
 
-      return Object.entries(processedData)
-        .map(([time, values]) => ({ time, ...values }))
-        .sort((a, b) => a.time.localeCompare(b.time));
-    }
-  }, [data, selectedStation, selectedMeteorologico, compareByStation, stations]);
+  // Datos para gráfica de meteorológicos
+  const meteorologicosData = useMemo(
+    () =>
+      compareByStation
+        ? averagesByStation(stations, estadisticas, METEOROLOGICOS)
+        : seriesToRows(meteorologicosSeries, selectedStation === 'all'),
+    [compareByStation, stations, estadisticas, meteorologicosSeries, selectedStation]
+  );
 
   // Líneas para contaminantes
   const contaminantesLines = useMemo(() => {
@@ -12,16 +12,11 @@ import {
   ErrorBar,
   Cell,
 } from 'recharts';
-
-interface DataPoint {
-  STATION: string;
-  DATE: string;
-  HOUR: number;
-  [key: string]: string | number | null;
-}
+import { EstadisticaEstacion } from '../services/api';
 
 interface StatChartsProps {
-  data: DataPoint[];
+  stations: string[];
+  estadisticas: EstadisticaEstacion[];
 }
 
 // Parámetros por categoría
@@ -66,83 +61,42 @@ const STATION_COLORS: Record<string, string> = {
   'VAL': '#f43f5e',
 };
 
-const StatCharts = ({ data }: StatChartsProps) => {
+const StatCharts = ({ stations, estadisticas }: StatChartsProps) => {
   const [showBoxPlot, setShowBoxPlot] = useState<boolean>(false);
   const [selectedParam, setSelectedParam] = useState<string>('O3');
   const [paramType, setParamType] = useState<'contaminantes' | 'meteorologicos'>('contaminantes');
 
-  // Obtener estaciones únicas
-  const stations = useMemo(() => {
-    const uniqueStations = [...new Set(data.map((d) => d.STATION))];
-    return uniqueStations.sort();
-  }, [data]);
-
   const currentParams = paramType === 'contaminantes' ? CONTAMINANTES : METEOROLOGICOS;
 
-  // Calcular estadísticas por estación para el parámetro seleccionado
+  // Estadísticas por estación del parámetro seleccionado (calculadas en el servidor)
   const statsData = useMemo(() => {
-    const stationStats: Record<string, number[]> = {};
-
-    data.forEach((row) => {
-      const station = row.STATION;
-      const value = row[selectedParam];
-      
-      if (value !== null && value !== undefined && typeof value === 'number' && !isNaN(value)) {
-        if (!stationStats[station]) {
-          stationStats[station] = [];
-        }
-        stationStats[station].push(value);
+    const porEstacion: Record<string, EstadisticaEstacion> = {};
+    estadisticas.forEach((estadistica) => {
+      if (estadistica.Contaminante === selectedParam) {
+        porEstacion[estadistica.Estación] = estadistica;
       }
     });
 
-    return stations.map((station) => {
-      const values = stationStats[station] || [];
-      if (values.length === 0) {
+    return stations
+      .filter((station) => porEstacion[station])
+      .map((station) => {
+        const estadistica = porEstacion[station];
         return {
           station,
-          promedio: 0,
-          desviacion: 0,
-          min: 0,
-          max: 0,
-          q1: 0,
-          mediana: 0,
-          q3: 0,
-          count: 0,
+          promedio: estadistica.Promedio,
+          desviacion: estadistica.Desviación,
+          min: estadistica.Mínimo,
+          max: estadistica.Máximo,
+          q1: estadistica.Q1,
+          mediana: estadistica.Mediana,
+          q3: estadistica.Q3,
+          count: estadistica['Horas válidas'],
+          // Para error bars
+          errorNeg: estadistica.Desviación,
+          errorPos: estadistica.Desviación,
         };
-      }
-
-      // Ordenar valores para calcular cuartiles
-      const sorted = [...values].sort((a, b) => a - b);
-      const n = sorted.length;
-      
-      // Calcular estadísticas
-      const sum = values.reduce((a, b) => a + b, 0);
-      const promedio = sum / n;
-      const varianza = values.reduce((acc, val) => acc + Math.pow(val - promedio, 2), 0) / n;
-      const desviacion = Math.sqrt(varianza);
-      
-      const min = sorted[0];
-      const max = sorted[n - 1];
-      const mediana = n % 2 === 0 ? (sorted[n/2 - 1] + sorted[n/2]) / 2 : sorted[Math.floor(n/2)];
-      const q1 = sorted[Math.floor(n * 0.25)];
-      const q3 = sorted[Math.floor(n * 0.75)];
-
-      return {
-        station,
-        promedio: Number(promedio.toFixed(4)),
-        desviacion: Number(desviacion.toFixed(4)),
-        min: Number(min.toFixed(4)),
-        max: Number(max.toFixed(4)),
-        q1: Number(q1.toFixed(4)),
-        mediana: Number(mediana.toFixed(4)),
-        q3: Number(q3.toFixed(4)),
-        count: n,
-        // Para error bars
-        errorNeg: Number(desviacion.toFixed(4)),
-        errorPos: Number(desviacion.toFixed(4)),
-      };
-    }).filter(s => s.count > 0);
-  }, [data, selectedParam, stations]);
+      });
+  }, [estadisticas, selectedParam, stations]);
 
   // Datos para Box Plot (simulado con barras)
   const boxPlotData = useMemo(() => {
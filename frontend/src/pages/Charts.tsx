@@ -1,19 +1,21 @@
 import { useState } from 'react';
 import { BarChart3, Upload, AlertCircle } from 'lucide-react';
 import { useDropzone } from 'react-dropzone';
-import apiService from '../services/api';
+import apiService, { EstadisticaEstacion } from '../services/api';
 import LineCharts from '../components/LineCharts';
 import StatCharts from '../components/StatCharts';
 
-interface DataPoint {
-  STATION: string;
-  DATE: string;
-  HOUR: number;
-  [key: string]: string | number | null;
+// Las gráficas no reciben las filas horarias: las series llegan reducidas
+// (LTTB) y las estadísticas por estación ya calculadas por el servidor
+interface ChartsResult {
+  resultId: string;
+  totalRegistros: number;
+  stations: string[];
+  estadisticas: EstadisticaEstacion[];
 }
 
 const Charts = () => {
-  const [data, setData] = useState<DataPoint[]>([]);
+  const [result, setResult] = useState<ChartsResult | null>(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
   const [filename, setFilename] = useState<string | null>(null);
@@ -33,8 +35,14 @@ const Charts = () => {
       // Validar y obtener datos
       const validationResult = await apiService.validateFull(uploadResult.filename);
       
-      if (validationResult.success && validationResult.data_preview) {
-        setData(validationResult.data_preview as DataPoint[]);
+      if (validationResult.success && validationResult.result_id) {
+        const aggregates = await apiService.getResultAggregates(validationResult.result_id);
+        setResult({
+          resultId: validationResult.result_id,
+          totalRegistros: validationResult.summary.total_registros,
+          stations: [...new Set(aggregates.completitud.map((c) => c.Estación))].sort(),
+          estadisticas: aggregates.estadisticas,
+        });
       } else {
         setError('No se pudieron obtener los datos validados');
       }
@@ -66,7 +74,7 @@ const Charts = () => {
       </div>
 
       {/* Upload area si no hay datos */}
-      {data.length === 0 && (
+      {!result && (
         <div
           {...getRootProps()}
           className={`border-2 border-dashed rounded-xl p-12 text-center cursor-pointer transition-colors ${
@@ -106,15 +114,15 @@ const Charts = () => {
       )}
 
       {/* Gráficas */}
-      {data.length > 0 && (
+      {result && (
         <>
           <div className="bg-blue-50 border border-blue-200 rounded-lg p-4">
             <p className="text-blue-700">
-              <strong>Archivo cargado:</strong> {filename} ({data.length} registros)
+              <strong>Archivo cargado:</strong> {filename} ({result.totalRegistros} registros)
             </p>
             <button
               onClick={() => {
-                setData([]);
+                setResult(null);
                 setFilename(null);
               }}
               className="mt-2 text-sm text-blue-600 hover:text-blue-800 underline"
@@ -123,9 +131,13 @@ const Charts = () => {
             </button>
           </div>
 
-          <LineCharts data={data} />
+          <LineCharts
+            resultId={result.resultId}
+            stations={result.stations}
+            estadisticas={result.estadisticas}
+          />
           
-          <StatCharts data={data} />
+          <StatCharts stations={result.stations} estadisticas={result.estadisticas} />
         </>
       )}
     </div>
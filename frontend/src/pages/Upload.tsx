@@ -2,28 +2,41 @@ import { useState } from 'react';
 import { Download, FileCheck } from 'lucide-react';
 import FileUpload from '../components/FileUpload';
 import DataTable from '../components/DataTable';
-import apiService, { ValidationResponse } from '../services/api';
+import apiService, { ValidationResponse, ValidationStreamMessage } from '../services/api';
+
+const PAGE_SIZE = 50;
 
 export default function Upload() {
   const [isLoading, setIsLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
   const [success, setSuccess] = useState<string | null>(null);
   const [validationResult, setValidationResult] = useState<ValidationResponse | null>(null);
+  const [progress, setProgress] = useState<string | null>(null);
+  const [streamedRows, setStreamedRows] = useState(0);
+  const [rows, setRows] = useState<Record<string, any>[]>([]);
+  const [page, setPage] = useState(0);
 
   const handleFileUpload = async (file: File) => {
     setIsLoading(true);
     setError(null);
     setSuccess(null);
     setValidationResult(null);
+    setProgress(null);
+    setRows([]);
+    setStreamedRows(0);
 
     try {
       // 1. Subir archivo
       const uploadResponse = await apiService.uploadFile(file);
       
-      // 2. Validar datos (siempre validación completa)
-      const validationResponse = await apiService.validateFull(uploadResponse.filename);
+      // 2. Validar datos (siempre validación completa), mostrando las filas
+      // de cada estación a medida que llegan
+      setProgress('Cargando archivo...');
+      const validationResponse = await apiService.validateStream(uploadResponse.filename, handleStreamMessage);
 
       setValidationResult(validationResponse);
+      setRows(validationResponse.data_preview);
+      setPage(0);
       setSuccess(`Archivo procesado exitosamente. ${validationResponse.summary.total_registros.toLocaleString()} registros validados.`);
 
     } catch (err: any) {
@@ -33,9 +46,41 @@ export default function Upload() {
     }
   };
 
-  const handleDownload = () => {
-    if (validationResult?.output_filename) {
-      window.open(apiService.downloadFile(validationResult.output_filename), '_blank');
+  const handleStreamMessage = (message: ValidationStreamMessage) => {
+    if (message.tipo === 'trabajo') {
+      setProgress('En cola...');
+    } else if (message.tipo === 'inicio') {
+      setProgress(`Validando ${message.estaciones.length} estaciones...`);
+    } else if (message.tipo === 'filas') {
+      setStreamedRows((count) => count + message.data.length);
+      setRows((current) =>
+        current.length < PAGE_SIZE ? [...current, ...message.data].slice(0, PAGE_SIZE) : current
+      );
+    } else if (message.tipo === 'estacion') {
+      setProgress(`Estación ${message.estacion} validada (${message.indice} de ${message.total_estaciones})`);
+    } else if (message.tipo === 'resumen') {
+      setProgress('Generando resumen...');
+    }
+  };
+
+  const handlePageChange = async (newPage: number) => {
+    if (!validationResult) return;
+
+    try {
+      const result = await apiService.getResultRows(validationResult.result_id, {
+        page: newPage + 1,
+        limit: PAGE_SIZE,
+      });
+      setRows(result.data);
+      setPage(newPage);
+    } catch (err: any) {
+      setError(err.response?.data?.error || 'Error al obtener los registros');
+    }
+  };
+
+  const handleDownload = (filename = validationResult?.output_filename) => {
+    if (filename) {
+      window.open(apiService.downloadFile(filename), '_blank');
     }
   };
 
@@ -57,8 +102,26 @@ export default function Upload() {
           error={error}
           success={success}
         />
+        {isLoading && progress && (
+          <p className="mt-4 text-sm text-slate-500">{progress}</p>
+        )}
       </div>
 
+      {/* Primeras filas mientras se valida el resto */}
+      {isLoading && rows.length > 0 && (
+        <div className="bg-white rounded-xl shadow-sm border border-slate-200 overflow-hidden">
+          <div className="p-4 border-b border-slate-200">
+            <h2 className="text-lg font-semibold text-slate-800">
+              Vista Previa de Datos
+            </h2>
+            <p className="text-sm text-slate-500">
+              {streamedRows.toLocaleString()} registros validados hasta ahora
+            </p>
+          </div>
+          <DataTable data={rows} maxRows={PAGE_SIZE} />
+        </div>
+      )}
+
       {/* Results Section */}
       {validationResult && (
         <div className="space-y-6">
@@ -71,13 +134,27 @@ export default function Upload() {
                   Resultados de Validación
                 </h2>
               </div>
-              <button
-                onClick={handleDownload}
-                className="flex items-center gap-2 px-4 py-2 bg-primary-600 hover:bg-primary-700 text-white rounded-lg transition-colors"
-              >
-                <Download className="h-4 w-4" />
-                Descargar Excel
-              </button>
+              <div className="flex items-center gap-2">
+                {(['csv.gz', 'parquet'] as const).map((format) =>
+                  validationResult.output_files?.[format] ? (
+                    <button
+                      key={format}
+                      onClick={() => handleDownload(validationResult.output_files[format])}
+                      className="flex items-center gap-2 px-3 py-2 bg-slate-100 hover:bg-slate-200 text-slate-700 rounded-lg text-sm transition-colors"
+                    >
+                      <Download className="h-4 w-4" />
+                      {format.toUpperCase()}
+                    </button>
+                  ) : null
+                )}
+                <button
+                  onClick={() => handleDownload()}
+                  className="flex items-center gap-2 px-4 py-2 bg-primary-600 hover:bg-primary-700 text-white rounded-lg transition-colors"
+                >
+                  <Download className="h-4 w-4" />
+                  Descargar Excel
+                </button>
+              </div>
             </div>
 
             {/* Stats */}
@@ -133,10 +210,16 @@ export default function Upload() {
                 Vista Previa de Datos
               </h2>
               <p className="text-sm text-slate-500">
-                Mostrando {validationResult.data_preview.length.toLocaleString()} registros (paginados de 50 en 50)
+                {validationResult.summary.total_registros.toLocaleString()} registros (paginados de {PAGE_SIZE} en {PAGE_SIZE})
               </p>
             </div>
-            <DataTable data={validationResult.data_preview} />
+            <DataTable
+              data={rows}
+              maxRows={PAGE_SIZE}
+              totalRows={validationResult.summary.total_registros}
+              page={page}
+              onPageChange={handlePageChange}
+            />
           </div>
 
           {/* Estadísticas Detalladas */}
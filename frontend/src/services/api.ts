@@ -29,6 +29,8 @@ export interface UploadResponse {
   message: string;
   filename: string;
   filepath: string;
+  sha256: string;
+  duplicado: boolean;
 }
 
 export interface ValidationSummary {
@@ -55,11 +57,208 @@ export interface ValidationResponse {
   success: boolean;
   message: string;
   output_filename: string;
+  // Se generan en la primera descarga
+  output_files: Record<'xlsx' | 'csv.gz' | 'parquet', string>;
+  result_id: string;
+  rows_url: string;
   summary: ValidationSummary;
+  // Solo la primera página; el resto se pide con getResultRows
   data_preview: Record<string, any>[];
   estadisticas_detalladas: EstadisticaDetallada[];
+  desde_cache: boolean;
 }
 
+export interface ResultRowsParams {
+  page?: number;
+  limit?: number;
+  station?: string[];
+  date_from?: string;
+  date_to?: string;
+  columns?: string[];
+}
+
+export interface ResultRowsResponse {
+  result_id: string;
+  page: number;
+  limit: number;
+  total: number;
+  total_pages: number;
+  columns: string[];
+  layout: 'records';
+  data: Record<string, any>[];
+}
+
+export interface ResultColumnsResponse extends Omit<ResultRowsResponse, 'layout' | 'data'> {
+  layout: 'columnar';
+  data: Record<string, any[]>;
+}
+
+export type AggregateProduct = 'daily' | 'moving' | 'completeness';
+
+export interface CompletitudEstacion {
+  Estación: string;
+  Contaminante: string;
+  'Horas esperadas': number;
+  'Horas válidas': number;
+  'Completitud (%)': number;
+}
+
+// Estadísticas de los valores válidos de una estación y parámetro en todo el resultado
+export interface EstadisticaEstacion {
+  Estación: string;
+  Contaminante: string;
+  'Horas válidas': number;
+  Promedio: number;
+  Desviación: number;
+  Mínimo: number;
+  Q1: number;
+  Mediana: number;
+  Q3: number;
+  Máximo: number;
+}
+
+export interface ResultAggregatesResponse {
+  result_id: string;
+  products: Record<AggregateProduct, { total: number; columns: string[]; rows_url: string }>;
+  promedios_moviles: Record<string, number>;
+  completitud_minima: number;
+  completitud: CompletitudEstacion[];
+  estadisticas: EstadisticaEstacion[];
+}
+
+export interface AggregateRowsResponse extends ResultRowsResponse {
+  product: AggregateProduct;
+}
+
+export interface SeriesParams {
+  product?: 'hourly' | AggregateProduct;
+  points?: number;
+  station?: string[];
+  parameter?: string[];
+  date_from?: string;
+  date_to?: string;
+}
+
+export interface ResultSeries {
+  station: string;
+  parameter: string;
+  // Valores válidos de la serie completa, antes de reducirla
+  total: number;
+  x: string[];
+  y: number[];
+}
+
+export interface ResultSeriesResponse {
+  result_id: string;
+  product: 'hourly' | AggregateProduct;
+  points: number;
+  series: ResultSeries[];
+}
+
+// Cambios sobre la configuración para /results/<id>/revalidate; lo que no se
+// indica queda como en el servidor
+export interface RevalidationOverrides {
+  rangos?: Record<string, { min?: number; max?: number; limite_deteccion?: number | null }>;
+  temperatura_interna?: { min?: number; max?: number };
+  horas_constantes?: number;
+  relaciones?: Record<string, { min?: number | null; max?: number }>;
+}
+
+export interface FlagCountDiff {
+  base: number;
+  nuevo: number;
+  diferencia: number;
+}
+
+export interface RevalidationResponse {
+  result_id: string;
+  cambios: RevalidationOverrides;
+  total_registros: number;
+  banderas: Record<string, FlagCountDiff>;
+  por_parametro: ({ Contaminante: string; Bandera: string } & FlagCountDiff)[];
+  celdas_cambiadas: number;
+}
+
+// Celdas con las reglas que se cumplieron en cada una (/results/<id>/provenance)
+export interface ProvenanceParams {
+  page?: number;
+  limit?: number;
+  station?: string[];
+  parameter?: string[];
+  rule?: string[];
+  date_from?: string;
+  date_to?: string;
+}
+
+export interface ProvenanceCell {
+  STATION: string;
+  DATE: string;
+  HOUR: number;
+  Contaminante: string;
+  Bandera: string | null;
+  Origen: number;
+  Reglas: string[];
+}
+
+export interface ProvenanceResponse {
+  result_id: string;
+  // Bit de cada regla en la máscara Origen
+  reglas: Record<string, number>;
+  totales: Record<string, number>;
+  page: number;
+  limit: number;
+  total: number;
+  total_pages: number;
+  data: ProvenanceCell[];
+}
+
+export interface JobStage {
+  estado: 'pendiente' | 'en_curso' | 'completada';
+  inicio: string | null;
+  fin: string | null;
+}
+
+export interface JobStatus {
+  id: string;
+  filename: string;
+  estado: 'en_cola' | 'procesando' | 'completado' | 'error';
+  etapa_actual: string | null;
+  etapas: Record<string, JobStage>;
+  filas_leidas: number;
+  progreso: number;
+  // Solo en las validaciones en flujo
+  estaciones_validadas?: number;
+  total_estaciones?: number;
+  creado: string;
+  actualizado: string;
+  terminado_en: string | null;
+  error: string | null;
+}
+
+export interface JobCreatedResponse {
+  job_id: string;
+  estado: string;
+  status_url: string;
+  result_url: string;
+}
+
+// Mensajes de /validate/stream, uno por línea (NDJSON)
+export type ValidationStreamMessage =
+  | { tipo: 'trabajo'; job_id: string; status_url: string }
+  | { tipo: 'inicio'; estaciones: string[]; total_filas: number; desde_cache: boolean }
+  | { tipo: 'filas'; estacion: string; desde: number; data: Record<string, any>[] }
+  | {
+      tipo: 'estacion';
+      estacion: string;
+      indice: number;
+      total_estaciones: number;
+      filas: number;
+      banderas: ValidationSummary['banderas'];
+      estadisticas_detalladas: EstadisticaDetallada[];
+    }
+  | ({ tipo: 'resumen' } & ValidationResponse)
+  | { tipo: 'error'; error: string };
+
 export interface StatsResponse {
   banderas_global: Record<string, any>;
   banderas_detallado: any[];
@@ -67,6 +266,38 @@ export interface StatsResponse {
   estadisticas_detalladas: any[];
 }
 
+const JOB_POLL_INTERVAL_MS = 1000;
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
+
+const startValidation = async (filename: string): Promise<JobCreatedResponse> => {
+  const response = await api.post('/validate/full', { filename });
+  return response.data;
+};
+
+const getJob = async (jobId: string): Promise<JobStatus> => {
+  const response = await api.get(`/jobs/${jobId}`);
+  return response.data;
+};
+
+const resultRowsQuery = (params: ResultRowsParams) => ({
+  ...params,
+  station: params.station?.join(','),
+  columns: params.columns?.join(','),
+});
+
+const getResultRows = async (resultId: string, params: ResultRowsParams = {}): Promise<ResultRowsResponse> => {
+  const response = await api.get(`/results/${resultId}/rows`, { params: resultRowsQuery(params) });
+  return response.data;
+};
+
+const getResultColumns = async (resultId: string, params: ResultRowsParams = {}): Promise<ResultColumnsResponse> => {
+  const response = await api.get(`/results/${resultId}/rows`, {
+    params: { ...resultRowsQuery(params), layout: 'columnar' },
+  });
+  return response.data;
+};
+
 // Servicios
 export const apiService = {
   // Health check
@@ -115,8 +346,124 @@ export const apiService = {
     return response.data;
   },
 
-  validateFull: async (filename: string): Promise<ValidationResponse> => {
-    const response = await api.post('/validate/full', { filename });
+  // La validación completa corre como trabajo en el servidor: se crea el
+  // trabajo, se consulta su avance y al terminar se pide el resultado
+  startValidation,
+
+  getJob,
+
+  validateFull: async (
+    filename: string,
+    onProgress?: (job: JobStatus) => void
+  ): Promise<ValidationResponse> => {
+    const { job_id } = await startValidation(filename);
+
+    let job = await getJob(job_id);
+    onProgress?.(job);
+    while (job.estado !== 'completado' && job.estado !== 'error') {
+      await sleep(JOB_POLL_INTERVAL_MS);
+      job = await getJob(job_id);
+      onProgress?.(job);
+    }
+
+    const response = await api.get(`/jobs/${job_id}/result`);
+    return response.data;
+  },
+
+  // Validación completa en flujo: las filas y el resumen de cada estación
+  // llegan apenas se validan; devuelve el mismo resultado que validateFull
+  validateStream: async (
+    filename: string,
+    onMessage?: (message: ValidationStreamMessage) => void
+  ): Promise<ValidationResponse> => {
+    const response = await fetch(`${API_BASE_URL}/validate/stream`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ filename }),
+    });
+    // Mismo formato de error que axios para que las páginas lo traten igual
+    if (!response.ok || !response.body) {
+      throw { response: { data: await response.json().catch(() => ({})) } };
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let result: ValidationResponse | null = null;
+    let done = false;
+
+    while (!done) {
+      const chunk = await reader.read();
+      done = chunk.done;
+      buffer += decoder.decode(chunk.value, { stream: !done });
+      const lines = buffer.split('\n');
+      buffer = done ? '' : lines.pop() ?? '';
+
+      for (const line of lines) {
+        if (!line.trim()) continue;
+        const message: ValidationStreamMessage = JSON.parse(line);
+        if (message.tipo === 'error') {
+          throw { response: { data: { error: message.error } } };
+        }
+        if (message.tipo === 'resumen') {
+          const { tipo, ...body } = message;
+          result = body;
+        }
+        onMessage?.(message);
+      }
+    }
+
+    if (!result) {
+      throw { response: { data: { error: 'La validación terminó sin resumen' } } };
+    }
+    return result;
+  },
+
+  // Resultados guardados en el servidor (paginados)
+  getResultRows,
+
+  getResultColumns,
+
+  // Promedios diarios, móviles, completitud y estadísticas calculados en el servidor
+  getResultAggregates: async (resultId: string): Promise<ResultAggregatesResponse> => {
+    const response = await api.get(`/results/${resultId}/aggregates`);
+    return response.data;
+  },
+
+  getAggregateRows: async (
+    resultId: string,
+    product: AggregateProduct,
+    params: ResultRowsParams = {}
+  ): Promise<AggregateRowsResponse> => {
+    const response = await api.get(`/results/${resultId}/aggregates/${product}`, {
+      params: resultRowsQuery(params),
+    });
+    return response.data;
+  },
+
+  // Series por estación y parámetro reducidas en el servidor (LTTB) a `points` puntos
+  getResultSeries: async (resultId: string, params: SeriesParams = {}): Promise<ResultSeriesResponse> => {
+    const response = await api.get(`/results/${resultId}/series`, {
+      params: { ...params, station: params.station?.join(','), parameter: params.parameter?.join(',') },
+    });
+    return response.data;
+  },
+
+  getResultProvenance: async (resultId: string, params: ProvenanceParams = {}): Promise<ProvenanceResponse> => {
+    const response = await api.get(`/results/${resultId}/provenance`, {
+      params: {
+        ...params,
+        station: params.station?.join(','),
+        parameter: params.parameter?.join(','),
+        rule: params.rule?.join(','),
+      },
+    });
+    return response.data;
+  },
+
+  // Revalidar un resultado con otros límites y comparar sus banderas con las originales
+  revalidateResult: async (resultId: string, overrides: RevalidationOverrides): Promise<RevalidationResponse> => {
+    const response = await api.post(`/results/${resultId}/revalidate`, overrides);
     return response.data;
   },
 